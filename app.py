@@ -1,29 +1,58 @@
 from flask import (
+    Blueprint,
     Flask,
+    current_app,
+    g,
     request,
     redirect,
     jsonify,
     render_template,
     send_from_directory,
+    stream_with_context,
 )
-from da import DeviantArt, populate
+from da import DeviantArt
+from export import DATASETS, FORMATS, stream_export
+from cache import ResponseCache
+from timeseries import TARGET_POINTS, MAX_POINTS
+import leaderboards
+import metrics
+import storage
+import thumbs as thumbnails
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 import os
+import gzip
+import sqlite3
+import json
+import time
+import hashlib
 import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import ingest
+import refresh
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from sql import (
     top_by_activity,
     get_deviation_activity,
+    get_deviation_activity_bulk,
     get_publication_data,
     get_gallery_data,
     get_user_data,
     get_deviation_data,
+    get_new_activity,
+    latest_activity_id,
+    decode_cursor,
+    get_populate_runs,
+    get_ingest_schedule,
+    get_refresh_requests,
 )
 
-import multiprocessing
-import time
-
 import logging
 
 logger = logging.getLogger(__name__)
@@ -35,30 +64,180 @@ logging.basicConfig(
 
 file_path = os.path.dirname(os.path.abspath(__file__))
 
-# Initialize Flask app
-app = Flask(__name__, static_url_path="/static", static_folder="static")
+# Routes are registered on a blueprint so every worker process can build its
+# own app (and DeviantArt client) through create_app()
+bp = Blueprint("dashboard", __name__)
+
+# JSON bodies smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+
+# Live activity stream: seconds between generation checks, seconds between
+# keepalive comments, and how long one stream lasts before the browser
+# reconnects (with Last-Event-ID) to free the worker
+LIVE_POLL_INTERVAL = 2
+LIVE_HEARTBEAT = 15
+LIVE_MAX_DURATION = 300
+
+# Threads running /api/dashboard sections concurrently, each on its own
+# pooled read connection
+DASHBOARD_WORKERS = storage.READ_POOL_SIZE
+dashboard_executor = ThreadPoolExecutor(
+    max_workers=DASHBOARD_WORKERS, thread_name_prefix="dashboard"
+)
+
+# Thumbnails never change for a deviation id, so let browsers keep them
+THUMB_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def create_app(sqlitedb=None, response_cache_path=None):
+    """Build the dashboard app.
+
+    Settings fall back to the DASTATS_SQLITEDB and DASTATS_RESPONSE_CACHE
+    environment variables so WSGI servers can configure workers.
+    """
+    app = Flask(__name__, static_url_path="/static", static_folder="static")
+    app.config["DA"] = DeviantArt(sqlitedb or os.environ.get("DASTATS_SQLITEDB"))
+    app.extensions["response_cache"] = ResponseCache(
+        path=response_cache_path or os.environ.get("DASTATS_RESPONSE_CACHE")
+    )
+    app.register_blueprint(bp)
+    return app
+
+
+def get_da() -> DeviantArt:
+    return current_app.config["DA"]
+
+
+def get_response_cache() -> ResponseCache:
+    return current_app.extensions["response_cache"]
+
+
+def window_start(window):
+    """Start of a preset rolling window (see leaderboards.WINDOWS), else None.
+
+    Presets cover exactly the range of their precomputed leaderboards
+    rather than whole days from the date picker.
+    """
+    seconds = leaderboards.WINDOWS.get(window)
+    return datetime.now() - timedelta(seconds=seconds) if seconds else None
+
+
+def parse_filters(args):
+    """Filters shared by the dashboard endpoints."""
+    start_date = args.get("start_date")
+    end_date = args.get("end_date")
+    filters = {
+        "start_date": datetime.fromisoformat(start_date) if start_date else None,
+        "end_date": datetime.fromisoformat(end_date) if end_date else None,
+        "gallery": args.get("gallery"),
+        "window": args.get("window"),
+    }
+    if start := window_start(filters["window"]):
+        filters["start_date"], filters["end_date"] = start, None
+    return filters
+
 
+def parse_points(value):
+    """Series length asked for by a client, clamped to 1..MAX_POINTS.
 
-p = None
+    Raises ValueError for anything that isn't a number.
+    """
+    if value is None:
+        return TARGET_POINTS
+    try:
+        points = int(value)
+    except (TypeError, ValueError, OverflowError) as e:
+        raise ValueError(f"points must be an integer, not {value!r}") from e
+    return min(max(points, 1), MAX_POINTS)
 
 
-def populate_hourly():
-    global p
-    while True:
-        if p:
-            p.join()
+def timed(fn, *args):
+    """(result, elapsed milliseconds)"""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, round((time.perf_counter() - started) * 1000, 2)
+
+
+def cached_response(view):
+    """Serve a JSON endpoint from response_cache until the data generation changes.
+
+    Responses carry an ETag and Last-Modified derived from the generation,
+    so a revalidating client gets a 304 without the query being rerun.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        response_cache = get_response_cache()
+        generation, updated_at = storage.generation_info(get_da().sqlite_db)
+        key = ResponseCache.make_key(request.path, request.args)
+        etag = f"{generation}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+        body = response_cache.get(key, generation)
+        if body is not None:
+            response = current_app.response_class(body, mimetype="application/json")
         else:
-            try:
-                p = multiprocessing.Process(target=populate, args=(da,))
-                p.daemon = True
-                p.start()
-            except Exception as e:
-                print(e)
-        time.sleep(3600)
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response_cache.set(key, generation, response.get_data())
+
+        response.set_etag(etag, weak=True)
+        if updated_at:
+            response.last_modified = updated_at
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    return wrapper
+
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(
+            endpoint,
+            request.method,
+            response.status_code,
+            time.perf_counter() - started,
+        )
+    return response
+
+
+@bp.after_app_request
+def compress_response(response):
+    """gzip (or brotli, if installed) JSON bodies above COMPRESS_MIN_SIZE."""
+    if (
+        response.direct_passthrough
+        or response.status_code != 200
+        or response.mimetype != "application/json"
+        or "Content-Encoding" in response.headers
+        or (response.content_length or 0) < COMPRESS_MIN_SIZE
+    ):
+        return response
+
+    accepted = request.accept_encodings
+    if brotli and accepted["br"]:
+        response.set_data(brotli.compress(response.get_data()))
+        response.headers["Content-Encoding"] = "br"
+    elif accepted["gzip"]:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    return response
 
 
-@app.route("/")
+@bp.route("/")
 def index():
+    da = get_da()
     if not os.path.exists(".credentials.json"):
         return render_template("credentials.html")
 
@@ -71,15 +250,16 @@ def index():
     return redirect("/stats/")
 
 
-@app.route("/deviations")
+@bp.route("/deviations")
 def deviations():
     return render_template("deviations.html")
 
 
 # OAuth configuration
-@app.route("/login", methods=["POST"])
+@bp.route("/login", methods=["POST"])
 def login():
     """Redirect to the OAuth provider's authorization URL."""
+    da = get_da()
 
     client_id = request.form.get("client_id")
     client_secret = request.form.get("client_secret")
@@ -91,9 +271,10 @@ def login():
     return redirect(da.authorization_url())
 
 
-@app.route("/callback")
+@bp.route("/callback")
 def callback():
     """Handle the OAuth callback and exchange the code for a token."""
+    da = get_da()
     code = request.args.get("code")
     if not code:
         return "Error: No code received."
@@ -105,74 +286,114 @@ def callback():
     return redirect("/stats/")
 
 
-@app.route("/stats/")
+@bp.route("/stats/")
 def stats():
     return render_template(
         "dashboard.html",
     )
 
 
-@app.route("/update-table")
+@bp.route("/update-table")
+@cached_response
 def update_table():
-    start_date = request.args.get("start_date")
-    end_date = request.args.get("end_date")
+    da = get_da()
+    filters = parse_filters(request.args)
     limit = request.args.get("limit", 10)
-    gallery = request.args.get("gallery")
-    logger.info(f"Updating table for {start_date} to {end_date} with limit {limit}")
-
-    if start_date:
-        start_date = datetime.fromisoformat(start_date)
+    logger.info(f"Updating table for {filters} with limit {limit}")
 
-    if end_date:
-        end_date = datetime.fromisoformat(end_date)
-
-    table_data = top_by_activity(da, start_date, end_date, limit, gallery)
+    start_date, end_date = filters["start_date"], filters["end_date"]
+    gallery, window = filters["gallery"], filters["window"]
+    table_data = top_by_activity(da, start_date, end_date, limit, gallery, window)
 
     return jsonify({"status": "success", "data": table_data})
 
 
-@app.route("/get-sparkline-data", methods=["POST"])
+@bp.route("/get-sparkline-data", methods=["POST"])
 def get_sparkline_data():
+    da = get_da()
     deviation_id = request.json.get("id")
 
-    start_date = request.json.get("start_date")
-    end_date = request.json.get("end_date")
-
-    if start_date:
-        start_date = datetime.fromisoformat(start_date)
-
-    if end_date:
-        end_date = datetime.fromisoformat(end_date)
-    else:
-        end_date = datetime.now()
+    filters = parse_filters(request.json)
+    start_date = filters["start_date"]
+    end_date = filters["end_date"] or datetime.now()
 
     logger.info(
         f"Getting sparkline data for {deviation_id} from {start_date} to {end_date}"
     )
 
+    try:
+        points = parse_points(request.json.get("points"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
     if deviation_id and start_date and end_date:
-        sparkline_data = get_deviation_activity(da, deviation_id, start_date, end_date)
+        sparkline_data = get_deviation_activity(
+            da, deviation_id, start_date, end_date, points
+        )
         return jsonify({"status": "success", "data": sparkline_data})
 
     return jsonify({"status": "error", "message": "Invalid deviation ID"}), 400
 
 
-@app.route("/thumbs/<deviation_id>")
-def thumbs(deviation_id):
-    return send_from_directory(os.path.join(file_path, "thumbs"), f"{deviation_id}.jpg")
+@bp.route("/get-sparkline-data/bulk", methods=["POST"])
+def get_sparkline_data_bulk():
+    da = get_da()
+    deviation_ids = request.json.get("ids") or []
 
+    filters = parse_filters(request.json)
+    start_date = filters["start_date"]
+    end_date = filters["end_date"] or datetime.now()
 
-@app.route("/get-publication-data")
-def get_by_publication_date():
-    start_date = request.args.get("start_date")
-    if start_date:
-        start_date = datetime.fromisoformat(start_date)
+    logger.info(
+        f"Getting sparkline data for {len(deviation_ids)} deviations from {start_date} to {end_date}"
+    )
 
-    end_date = request.args.get("end_date")
-    if end_date:
-        end_date = datetime.fromisoformat(end_date)
+    try:
+        points = parse_points(request.json.get("points"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-    gallery = request.args.get("gallery")
+    if deviation_ids and start_date and end_date:
+        sparkline_data = get_deviation_activity_bulk(
+            da, deviation_ids, start_date, end_date, points
+        )
+        return jsonify({"status": "success", "data": sparkline_data})
+
+    return jsonify({"status": "error", "message": "Invalid deviation IDs"}), 400
+
+
+@bp.route("/thumbs/<deviation_id>")
+def thumbs(deviation_id):
+    """Serve a thumbnail; ?size=N picks the smallest derivative at least N px wide."""
+    directory, filename = thumbnails.THUMBS_DIR, f"{deviation_id}.jpg"
+    immutable = True
+
+    size = request.args.get("size", type=int)
+    if size:
+        derivative = thumbnails.derivative_path(
+            deviation_id, thumbnails.closest_size(size)
+        )
+        if os.path.exists(derivative):
+            directory, filename = os.path.split(derivative)
+        else:
+            # Serve the original until the derivative exists, without pinning it
+            immutable = False
+
+    response = send_from_directory(
+        directory, filename, max_age=THUMB_MAX_AGE if immutable else 3600
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = immutable
+    return response
+
+
+@bp.route("/get-publication-data")
+@cached_response
+def get_by_publication_date():
+    da = get_da()
+    filters = parse_filters(request.args)
+    start_date, end_date = filters["start_date"], filters["end_date"]
+    gallery = filters["gallery"]
 
     logger.info(f"Getting publication data for {start_date} to {end_date}")
     return jsonify(
@@ -183,39 +404,159 @@ def get_by_publication_date():
     )
 
 
-@app.route("/get-gallery-names")
+@bp.route("/api/dashboard")
+@cached_response
+def dashboard():
+    """Everything /stats/ shows for one set of filters, in one response.
+
+    Sections run concurrently on pooled connections; sparklines start as
+    soon as the table is known. `timings` has per-section milliseconds.
+    """
+    da = get_da()
+    filters = parse_filters(request.args)
+    start_date, end_date = filters["start_date"], filters["end_date"]
+    gallery, window = filters["gallery"], filters["window"]
+    limit = request.args.get("limit", 10)
+    user_limit = request.args.get("user_limit", 10)
+    try:
+        points = parse_points(request.args.get("points"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    started = time.perf_counter()
+    sections = {
+        "table": (top_by_activity, da, start_date, end_date, limit, gallery, window),
+        "publication": (get_publication_data, da, start_date, end_date, gallery),
+        "users": (get_user_data, da, start_date, end_date, user_limit, gallery, window),
+        "galleries": (get_gallery_data, da),
+    }
+    futures = {
+        name: dashboard_executor.submit(timed, *call) for name, call in sections.items()
+    }
+
+    data, timings = {"sparklines": None}, {}
+    data["table"], timings["table"] = futures.pop("table").result()
+    if start_date and data["table"]:
+        futures["sparklines"] = dashboard_executor.submit(
+            timed,
+            get_deviation_activity_bulk,
+            da,
+            [row["deviationid"] for row in data["table"]],
+            start_date,
+            end_date or datetime.now(),
+            points,
+        )
+    for name, future in futures.items():
+        data[name], timings[name] = future.result()
+    timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+
+    logger.info(f"Dashboard for {filters} in {timings['total']}ms")
+    return jsonify({"status": "success", "data": data, "timings": timings})
+
+
+@bp.route("/api/populate-runs")
+@cached_response
+def populate_runs():
+    """Populate ledger; ?stage=total gives one row per run."""
+    da = get_da()
+    limit = request.args.get("limit", 50, type=int)
+    stage = request.args.get("stage")
+    return jsonify({"status": "success", "data": get_populate_runs(da, limit, stage)})
+
+
+@bp.route("/api/ingest-schedule")
+def ingest_schedule():
+    return jsonify({"status": "success", "data": get_ingest_schedule(get_da())})
+
+
+@bp.route("/api/refresh", methods=["POST"])
+def request_refresh():
+    """Queue on-demand refreshes: {"kind": ..., "targets": [...], "priority": n}
+
+    `kind` may also be a list, e.g. ["metadata", "whofaved"] for a deviation.
+    Returns the request ids to poll at GET /api/refresh?ids=...
+    """
+    da = get_da()
+    body = request.get_json(silent=True) or {}
+    kinds = body.get("kind") or []
+    kinds = [kinds] if isinstance(kinds, str) else kinds
+    targets = [str(t) for t in body.get("targets") or [] if t]
+    priority = body.get("priority", refresh.DEFAULT_PRIORITY)
+
+    if not kinds or not targets or not all(kind in refresh.KINDS for kind in kinds):
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": f"kind must be one of {list(refresh.KINDS)} with targets",
+                }
+            ),
+            400,
+        )
+
+    try:
+        priority = int(priority)
+    except (TypeError, ValueError):
+        return (
+            jsonify({"status": "error", "message": "priority must be an integer"}),
+            400,
+        )
+
+    ids = []
+    try:
+        for kind in kinds:
+            ids.extend(refresh.enqueue(da.sqlite_db, kind, targets, priority))
+    except sqlite3.OperationalError as e:
+        logger.error(f"Error queueing refresh: {e}")
+        return jsonify({"status": "error", "message": "database is busy"}), 503
+    return jsonify({"status": "success", "data": {"ids": ids}}), 202
+
+
+@bp.route("/api/refresh")
+def refresh_status():
+    """Status of refresh requests: ?ids=1,2,3 or the latest ?limit= requests."""
+    ids = [i for i in request.args.get("ids", "").split(",") if i.isdigit()]
+    limit = request.args.get("limit", 50, type=int)
+    data = get_refresh_requests(get_da(), ids, max(limit, len(ids)))
+    return jsonify({"status": "success", "data": data})
+
+
+@bp.route("/get-gallery-names")
+@cached_response
 def gallery_data():
+    da = get_da()
     return jsonify({"status": "success", "data": get_gallery_data(da)})
 
 
-@app.route("/get-deviations")
+@bp.route("/get-deviations")
+@cached_response
 def get_deviations():
+    da = get_da()
     tags = request.args.get("tags")
     gallery = request.args.get("gallery")
     limit = request.args.get("limit", 100)
-    offset = request.args.get("offset", 0)
+    cursor = request.args.get("cursor")
 
-    return jsonify(
-        {
-            "status": "success",
-            "data": get_deviation_data(da, tags, gallery, limit, offset),
-        }
-    )
+    if tags:
+        tags = [tag.strip() for tag in tags.split(",") if tag.strip()]
 
+    try:
+        data, next_cursor = get_deviation_data(da, tags, gallery, limit, cursor)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-@app.route("/get-users")
-def get_users():
+    return jsonify({"status": "success", "data": data, "next_cursor": next_cursor})
 
-    start_date = request.args.get("start_date")
-    end_date = request.args.get("end_date")
-    limit = request.args.get("limit", 10)
-    gallery = request.args.get("gallery")
 
-    if start_date:
-        start_date = datetime.fromisoformat(start_date)
+@bp.route("/get-users")
+@cached_response
+def get_users():
+    da = get_da()
+    filters = parse_filters(request.args)
+    limit = request.args.get("limit", 10)
 
-    if end_date:
-        end_date = datetime.fromisoformat(end_date)
+    start_date, end_date = filters["start_date"], filters["end_date"]
+    gallery, window = filters["gallery"], filters["window"]
 
     logger.info(
         f"Updating users for {start_date} to {end_date} with limit {limit} and gallery {gallery}"
@@ -224,28 +565,140 @@ def get_users():
     return jsonify(
         {
             "status": "success",
-            "data": get_user_data(da, start_date, end_date, limit, gallery),
+            "data": get_user_data(da, start_date, end_date, limit, gallery, window),
         }
     )
 
 
+@bp.route("/events")
+def live_events():
+    """Server-sent events with activity inserted since Last-Event-ID.
+
+    Checks the data generation every LIVE_POLL_INTERVAL seconds and only
+    queries messages after ingest has committed something new.
+    """
+    da = get_da()
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("after")
+    try:
+        decode_cursor(last_id)
+    except ValueError:
+        last_id = latest_activity_id(da)
+
+    def stream(last_id):
+        yield f"retry: 3000\nid: {last_id}\n\n"
+        generation = None
+        started = last_sent = time.monotonic()
+        while time.monotonic() - started < LIVE_MAX_DURATION:
+            current = storage.data_generation(da.sqlite_db)
+            if current != generation:
+                generation = current
+                while events := get_new_activity(da, last_id):
+                    last_id = events[-1]["id"]
+                    last_sent = time.monotonic()
+                    yield f"id: {last_id}\nevent: activity\ndata: {json.dumps(events)}\n\n"
+            if time.monotonic() - last_sent > LIVE_HEARTBEAT:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            time.sleep(LIVE_POLL_INTERVAL)
+
+    response = current_app.response_class(
+        stream_with_context(stream(last_id)), mimetype="text/event-stream"
+    )
+    response.cache_control.no_cache = True
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@bp.route("/export/<dataset>")
+def export(dataset):
+    """Stream a dataset as ndjson, csv or parquet (?format=, start_date, end_date, gallery)"""
+    da = get_da()
+    fmt = request.args.get("format", "ndjson")
+    if dataset not in DATASETS or fmt not in FORMATS:
+        return jsonify({"status": "error", "message": "Unknown dataset or format"}), 404
+
+    try:
+        chunks = stream_export(
+            da.sqlite_db,
+            dataset,
+            fmt,
+            request.args.get("start_date"),
+            request.args.get("end_date"),
+            request.args.get("gallery"),
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    logger.info(f"Exporting {dataset} as {fmt}")
+    response = current_app.response_class(
+        stream_with_context(chunks), mimetype=FORMATS[fmt]
+    )
+    response.headers["Content-Disposition"] = f"attachment; filename={dataset}.{fmt}"
+    return response
+
+
+@bp.route("/metrics")
+def prometheus_metrics():
+    """Request, SQL, read pool and response cache metrics for Prometheus."""
+    for pool in storage.pool_stats():
+        db = [("db", pool["db_path"])]
+        for state in ("open", "idle"):
+            metrics.registry.set(
+                "read_pool_connections", db + [("state", state)], pool[state]
+            )
+        for outcome in ("hits", "misses", "waits"):
+            metrics.registry.set(
+                "read_pool_requests_total", db + [("outcome", outcome)], pool[outcome]
+            )
+
+    cache = get_response_cache().stats()
+    metrics.registry.set("response_cache_entries", [], cache["entries"])
+    for outcome in ("hits", "misses", "stale"):
+        metrics.registry.set(
+            "response_cache_requests_total", [("outcome", outcome)], cache[outcome]
+        )
+
+    return current_app.response_class(
+        metrics.registry.render(), mimetype="text/plain; version=0.0.4"
+    )
+
+
+@bp.route("/api/slow-queries")
+def slow_queries():
+    return jsonify({"status": "success", "data": list(metrics.slow_queries)})
+
+
+@bp.route("/api/cache-stats")
+def cache_stats():
+    return jsonify({"status": "success", "data": get_response_cache().stats()})
+
+
+@bp.route("/api/pool-stats")
+def pool_stats():
+    return jsonify({"status": "success", "data": storage.pool_stats()})
+
+
 if __name__ == "__main__":
-    global da
     import argparse
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", "-p", type=int, default=4444)
     parser.add_argument("--sqlitedb", type=str, default=None)
     parser.add_argument("--no-populate", action="store_true")
+    parser.add_argument(
+        "--response-cache", type=str, default=None, help="Persist responses here"
+    )
 
     args = parser.parse_args()
-    da = DeviantArt(args.sqlitedb)
+    app = create_app(args.sqlitedb, args.response_cache)
 
     if not args.no_populate:
-        t = threading.Thread(target=populate_hourly)
+        t = threading.Thread(target=ingest.run_scheduler, args=(app.config["DA"],))
         t.daemon = True
         t.start()
 
     logger.info(f"Starting app on port {args.port}")
 
-    app.run(port=args.port, debug=True)
+    # The reloader re-runs this module in a child process, which would start
+    # a second ingest loop alongside the parent's
+    app.run(port=args.port, debug=True, use_reloader=False)
@@ -0,0 +1,67 @@
+import json
+import sqlite3
+import zlib
+
+from models import RawPayload
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def compress(data: dict):
+    """Serialize and compress a JSON payload, preferring zstd when available."""
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    if zstandard:
+        return zstandard.ZstdCompressor(level=10).compress(raw), "zstd"
+    return zlib.compress(raw, 9), "zlib"
+
+
+def decompress(payload: bytes, encoding: str) -> dict:
+    if encoding == "zstd":
+        if not zstandard:
+            raise RuntimeError("zstandard is required to read zstd archive rows")
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    elif encoding == "zlib":
+        raw = zlib.decompress(payload)
+    else:
+        raise ValueError(f"Unknown archive encoding: {encoding}")
+    return json.loads(raw)
+
+
+class PayloadArchive:
+    """Stores raw API payloads keyed by (kind, entity_id) on an open connection.
+
+    With a `writer` (storage.BatchWriter) payloads are queued on it instead.
+    """
+
+    def __init__(self, db: sqlite3.Connection = None, writer=None):
+        self.db = db
+        self.writer = writer
+
+    def store(self, kind: str, entity_id: str, data: dict):
+        if not entity_id:
+            return
+        payload, encoding = compress(data)
+        raw = RawPayload(
+            kind=kind, entity_id=str(entity_id), encoding=encoding, payload=payload
+        )
+        if self.writer:
+            self.writer.upsert(raw, conflict_mode="replace")
+        else:
+            raw.insert(self.db, conflict_mode="replace")
+
+    def iter_payloads(self, kind: str = None, batch_size=500):
+        query = (
+            f"SELECT kind, entity_id, encoding, payload FROM {RawPayload.table_name}"
+        )
+        params = ()
+        if kind:
+            query += " WHERE kind = ?"
+            params = (kind,)
+
+        cursor = self.db.execute(query, params)
+        while rows := cursor.fetchmany(batch_size):
+            for kind, entity_id, encoding, payload in rows:
+                yield kind, entity_id, decompress(payload, encoding)
@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """LRU cache of rendered responses, invalidated by the data generation.
+
+    Entries are stored with the generation they were computed at; a lookup
+    with a newer generation is a miss, so a populate commit invalidates
+    everything without having to notify the web process. An optional sqlite
+    file keeps entries across restarts.
+    """
+
+    def __init__(self, maxsize=256, path=None):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        if path:
+            self.attach_disk(path)
+
+    def attach_disk(self, path):
+        self._disk = sqlite3.connect(path, check_same_thread=False)
+        self._disk.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache "
+            "(key VARCHAR PRIMARY KEY, generation BIGINT, body BLOB)"
+        )
+        self._disk.commit()
+
+    @staticmethod
+    def make_key(endpoint, params):
+        """Normalise request parameters: drop empty values and sort."""
+        items = sorted((k, v) for k, v in params.items() if v not in (None, ""))
+        return endpoint + "?" + "&".join(f"{k}={v}" for k, v in items)
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._disk:
+                entry = self._disk.execute(
+                    "SELECT generation, body FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if entry:
+                    self._store(key, entry)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[0] != generation:
+                self.stale += 1
+                self.misses += 1
+                self._entries.pop(key, None)
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, generation, body):
+        with self._lock:
+            self._store(key, (generation, body))
+            if self._disk:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?)",
+                    (key, generation, body),
+                )
+                self._disk.execute(
+                    "DELETE FROM response_cache WHERE generation <> ?", (generation,)
+                )
+                self._disk.commit()
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._disk:
+                self._disk.execute("DELETE FROM response_cache")
+                self._disk.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "bytes": sum(len(body) for _, body in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "disk": self._disk is not None,
+            }
@@ -1,118 +1,379 @@
-from celery import Celery
-from da import DeviantArt, populate_gallery, populate_metadata, populate_favorites
-import sqlite3
+from celery import Celery, chain, chord, group
+from da import (
+    DeviantArt,
+    populate_gallery,
+    crawl_gallery,
+    mark_deleted,
+    plan_gallery_shards,
+    populate_metadata,
+    populate_favorites,
+    populate_feed,
+    populate_feed_stacks,
+    run_stage,
+    sync_schema,
+)
+from leaderboards import refresh_leaderboards
+import storage
+import redis
 import os
+import uuid
 import logging
 
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
 # Configure Celery
-app = Celery(
-    "da_tasks", broker="redis://localhost:6379/0", backend="redis://localhost:6379/0"
-)
+app = Celery("da_tasks", broker=REDIS_URL, backend=REDIS_URL)
+
+# API-bound stages go to the "crawl" queue and database-bound ones to "db",
+# so each can get its own worker pool. Crawl stages only take the account's
+# writer lock per write batch, so crawl workers fetch in parallel:
+#   celery -A celery_tasks worker -Q crawl -c 4
+#   celery -A celery_tasks worker -Q db -c 1
+app.conf.task_routes = {
+    "celery_tasks.populate_gallery_task": {"queue": "crawl"},
+    "celery_tasks.crawl_gallery_shard_task": {"queue": "crawl"},
+    "celery_tasks.finish_gallery_crawl_task": {"queue": "db"},
+    "celery_tasks.populate_metadata_task": {"queue": "crawl"},
+    "celery_tasks.populate_favorites_task": {"queue": "crawl"},
+    "celery_tasks.populate_feed_task": {"queue": "crawl"},
+    "celery_tasks.populate_feed_stacks_task": {"queue": "crawl"},
+    "celery_tasks.refresh_leaderboards_task": {"queue": "db"},
+    "celery_tasks.release_account_lock_task": {"queue": "db"},
+}
+app.conf.task_track_started = True
+
+# A full run's account lock expires this long (seconds) after the last
+# sign of life from one of its stages, so a lost release (e.g. a killed
+# worker) can't block the account forever; every stage extends it when it
+# starts and with each progress report
+ACCOUNT_LOCK_TTL = 6 * 60 * 60
+
+# Compare-and-delete, so a run only ever releases its own lock
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Compare-and-expire, so a stage only extends its own run's lock
+EXTEND_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 
-@app.task
-def populate_gallery_task(username=None, gallery="all", full=False, offset=0):
-    """Task to populate gallery data"""
-    try:
-        da = DeviantArt(
-            sqlitedb=os.path.join(
-                os.path.dirname(os.path.abspath(__file__)),
-                f"{username}.sqlite" if username else "deviantart_data.sqlite",
-            )
-        )
-        da.check_token()
+def account_db(username=None):
+    return os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        f"{username}.sqlite" if username else "deviantart_data.sqlite",
+    )
 
-        with sqlite3.connect(da.sqlite_db) as db:
-            populate_gallery(
-                da, db, gallery=gallery, username=username, full=full, offset=offset
-            )
-        return {
-            "status": "success",
-            "message": f"Gallery data populated for {username or 'all users'}",
-        }
-    except Exception as e:
-        logger.error(f"Error in populate_gallery_task: {str(e)}")
-        return {"status": "error", "message": str(e)}
 
+def account_lock_key(username=None):
+    return f"da_tasks:populate-lock:{account_db(username)}"
 
-@app.task
-def populate_metadata_task(username=None):
-    """Task to populate metadata"""
-    try:
-        da = DeviantArt(
-            sqlitedb=os.path.join(
-                os.path.dirname(os.path.abspath(__file__)),
-                f"{username}.sqlite" if username else "deviantart_data.sqlite",
-            )
+
+def acquire_account_lock(username, owner, ttl=ACCOUNT_LOCK_TTL):
+    """Take the account's populate lock for `owner`; False if another run has it."""
+    client = redis.Redis.from_url(REDIS_URL)
+    return bool(client.set(account_lock_key(username), owner, nx=True, ex=ttl))
+
+
+def extend_account_lock(username, owner, ttl=ACCOUNT_LOCK_TTL):
+    """Push back the expiry of `owner`'s populate lock; False if it isn't held."""
+    client = redis.Redis.from_url(REDIS_URL)
+    return bool(
+        client.eval(EXTEND_LOCK_SCRIPT, 1, account_lock_key(username), owner, ttl)
+    )
+
+
+def release_account_lock(username, owner):
+    client = redis.Redis.from_url(REDIS_URL)
+    return bool(client.eval(RELEASE_LOCK_SCRIPT, 1, account_lock_key(username), owner))
+
+
+def run_stage_task(task, username, stage, populate, run_id=None, hold_lock=True):
+    """Run one populate stage for an account and record it in populate_runs.
+
+    Reports PROGRESS through the task state when it starts and then, while
+    running, with the API requests and rows written so far; each report
+    also extends the account lock of the full populate `run_id` belongs to.
+    Errors are re-raised so the task fails and the rest of a populate chain
+    is skipped. `populate`'s return value is passed back as "result".
+    Crawl-queue stages pass hold_lock=False, so the writer lock is only
+    taken per write batch and their API calls run in parallel; db-queue
+    stages hold it for the whole task.
+    """
+    run_id = run_id or task.request.id or str(uuid.uuid4())
+    meta = {"username": username, "stage": stage, "run_id": run_id}
+
+    def keep_lock():
+        try:
+            extend_account_lock(username, run_id)
+        except redis.RedisError as e:
+            logger.warning(f"Could not extend populate lock for {run_id}: {e}")
+
+    def report(run):
+        task.update_state(
+            state="PROGRESS",
+            meta={
+                **meta,
+                "api_requests": run.api_requests,
+                "rows_inserted": run.rows_inserted,
+                "rows_updated": run.rows_updated,
+                "rows_skipped": run.rows_skipped,
+            },
         )
+        keep_lock()
+
+    task.update_state(state="PROGRESS", meta=meta)
+    keep_lock()
+    try:
+
+        da = DeviantArt(sqlitedb=account_db(username))
         da.check_token()
 
-        with sqlite3.connect(da.sqlite_db) as db:
-            populate_metadata(da, db)
-        return {
-            "status": "success",
-            "message": f"Metadata populated for {username or 'all users'}",
-        }
+        with storage.BatchWriter(da.sqlite_db, hold_lock=hold_lock) as writer:
+            writer.call(sync_schema)
+            with run_stage(writer, run_id, stage, progress=report) as run:
+                result = populate(da, writer)
     except Exception as e:
-        logger.error(f"Error in populate_metadata_task: {str(e)}")
-        return {"status": "error", "message": str(e)}
+        logger.error(f"Error in {stage} stage for {username or 'default'}: {e}")
+        raise
 
+    return {
+        "status": "success",
+        "message": f"{stage} populated for {username or 'all users'}",
+        "run_id": run_id,
+        "api_requests": run.api_requests,
+        "rows_inserted": run.rows_inserted,
+        "rows_updated": run.rows_updated,
+        "result": result,
+    }
 
-@app.task
-def populate_favorites_task(username=None):
+
+@app.task(bind=True)
+def populate_gallery_task(
+    self, username=None, gallery="all", full=False, offset=0, run_id=None
+):
+    """Task to populate gallery data"""
+    return run_stage_task(
+        self,
+        username,
+        "gallery",
+        lambda da, writer: populate_gallery(
+            da, writer, gallery=gallery, username=username, full=full, offset=offset
+        ),
+        run_id,
+        hold_lock=False,
+    )
+
+
+@app.task(bind=True)
+def crawl_gallery_shard_task(self, username=None, offset=0, end=None, run_id=None):
+    """Task to crawl one offset range of a full gallery crawl; returns the ids seen"""
+    return run_stage_task(
+        self,
+        username,
+        f"gallery:{offset}",
+        lambda da, writer: crawl_gallery(
+            da, writer, username=username, full=True, offset=offset, end=end
+        ),
+        run_id,
+        hold_lock=False,
+    )
+
+
+@app.task(bind=True)
+def finish_gallery_crawl_task(self, shard_results, username=None, run_id=None):
+    """Task to merge the shards' seen ids and sweep deviations that are gone"""
+    seen = set()
+    for shard in shard_results:
+        seen.update(shard["result"])
+    return run_stage_task(
+        self,
+        username,
+        "gallery",
+        lambda da, writer: mark_deleted(writer, seen),
+        run_id,
+    )
+
+
+def sharded_gallery_crawl(username=None, offset=0, run_id=None, shards=None):
+    """Header and body of a full gallery crawl split into offset ranges.
+
+    Each shard runs on whichever crawl worker is free; the deletion sweep
+    only runs (on the union of ids seen) once every shard has succeeded.
+    """
+    shards = shards or plan_gallery_shards(account_db(username), offset)
+    logger.info(f"Crawling {username or 'default'} gallery in {len(shards)} shards")
+    header = group(
+        crawl_gallery_shard_task.si(username, start, end, run_id=run_id)
+        for start, end in shards
+    )
+    return header, finish_gallery_crawl_task.s(username, run_id=run_id)
+
+
+@app.task(bind=True)
+def sharded_gallery_crawl_task(self, username=None, offset=0):
+    """Task to dispatch a sharded full gallery crawl"""
+    header, body = sharded_gallery_crawl(username, offset, self.request.id)
+    result = chord(header, body).apply_async()
+    return {
+        "status": "success",
+        "message": f"Started a {len(header.tasks)} shard gallery crawl",
+        "shards": len(header.tasks),
+        "task": result.id,
+    }
+
+
+@app.task(bind=True)
+def populate_metadata_task(self, username=None, run_id=None):
+    """Task to populate metadata"""
+    return run_stage_task(
+        self, username, "metadata", populate_metadata, run_id, hold_lock=False
+    )
+
+
+@app.task(bind=True)
+def populate_favorites_task(self, username=None, run_id=None):
     """Task to populate favorites"""
-    try:
-        da = DeviantArt(
-            sqlitedb=os.path.join(
-                os.path.dirname(os.path.abspath(__file__)),
-                f"{username}.sqlite" if username else "deviantart_data.sqlite",
-            )
-        )
-        da.check_token()
+    return run_stage_task(
+        self, username, "favorites", populate_favorites, run_id, hold_lock=False
+    )
+
+
+@app.task(bind=True)
+def populate_feed_task(self, username=None, run_id=None):
+    """Task to populate the message feed"""
+    return run_stage_task(
+        self, username, "feed", populate_feed, run_id, hold_lock=False
+    )
 
-        with sqlite3.connect(da.sqlite_db) as db:
-            populate_favorites(da, db)
-        return {
-            "status": "success",
-            "message": f"Favorites populated for {username or 'all users'}",
-        }
-    except Exception as e:
-        logger.error(f"Error in populate_favorites_task: {str(e)}")
-        return {"status": "error", "message": str(e)}
+
+@app.task(bind=True)
+def populate_feed_stacks_task(self, username=None, run_id=None):
+    """Task to fill in stacked feed messages"""
+    return run_stage_task(
+        self, username, "feed_stacks", populate_feed_stacks, run_id, hold_lock=False
+    )
+
+
+@app.task(bind=True)
+def refresh_leaderboards_task(self, username=None, run_id=None):
+    """Task to refresh the leaderboards from the new activity"""
+    return run_stage_task(
+        self,
+        username,
+        "leaderboards",
+        lambda da, writer: writer.call(refresh_leaderboards),
+        run_id,
+    )
 
 
 @app.task
-def full_populate_task(username=None, full=False, offset=0):
-    """Task to run the full populate process"""
-    try:
-        da = DeviantArt(
-            sqlitedb=os.path.join(
-                os.path.dirname(os.path.abspath(__file__)),
-                f"{username}.sqlite" if username else "deviantart_data.sqlite",
-            )
+def release_account_lock_task(username=None, owner=None):
+    """Final (and error) step of a full populate: free the account lock"""
+    released = release_account_lock(username, owner)
+    if not released:
+        logger.warning(f"Populate lock for {username or 'default'} was already gone")
+    return {"status": "success", "released": released, "run_id": owner}
+
+
+def full_populate_workflow(username=None, full=False, offset=0, run_id=None):
+    """A full populate as a DAG of stage tasks:
+
+    gallery -> metadata -> (favorites | feed -> feed_stacks) -> leaderboards
+
+    Metadata only starts once the gallery has inserted new deviations;
+    favorites and the feed crawl side by side (crawl stages only take the
+    writer lock for each write batch, so just their commits are serialized)
+    and the leaderboards, which hold the lock for the whole task, wait for
+    both.
+    A `full` gallery crawl is split into shards crawled in parallel.
+    Returns (signature, {stage: task id}) so progress can be polled per stage.
+    """
+    task_ids = {}
+
+    def stage(name, signature):
+        task_ids[name] = str(uuid.uuid4())
+        return signature.set(task_id=task_ids[name])
+
+    if full:
+        header, body = sharded_gallery_crawl(username, offset, run_id)
+        gallery = chord(header, stage("gallery", body))
+    else:
+        gallery = stage(
+            "gallery",
+            populate_gallery_task.si(username, "all", full, offset, run_id=run_id),
         )
-        da.check_token()
 
-        # Chain the tasks in order
-        gallery_result = populate_gallery_task.delay(username, "all", full, offset)
-        metadata_result = populate_metadata_task.delay(username)
-        favorites_result = populate_favorites_task.delay(username)
+    workflow = chain(
+        gallery,
+        stage("metadata", populate_metadata_task.si(username, run_id=run_id)),
+        group(
+            stage("favorites", populate_favorites_task.si(username, run_id=run_id)),
+            chain(
+                stage("feed", populate_feed_task.si(username, run_id=run_id)),
+                stage(
+                    "feed_stacks", populate_feed_stacks_task.si(username, run_id=run_id)
+                ),
+            ),
+        ),
+        stage("leaderboards", refresh_leaderboards_task.si(username, run_id=run_id)),
+        release_account_lock_task.si(username, run_id),
+    )
+    return workflow, task_ids
+
+
+def populate_progress(task_ids):
+    """{stage: {"state", "info"}} for the task ids returned by full_populate_task"""
+    progress = {}
+    for stage, task_id in task_ids.items():
+        result = app.AsyncResult(task_id)
+        info = result.info
+        if isinstance(info, Exception):
+            info = f"{type(info).__name__}: {info}"
+        progress[stage] = {"state": result.state, "info": info}
+    return progress
+
+
+@app.task(bind=True)
+def full_populate_task(self, username=None, full=False, offset=0):
+    """Task to run the full populate process.
 
+    Only one full populate runs per account at a time; a second one while
+    the first holds the account lock returns "skipped".
+    """
+    run_id = self.request.id or str(uuid.uuid4())
+    if not acquire_account_lock(username, run_id):
+        logger.info(f"A populate for {username or 'default'} is already running")
         return {
-            "status": "success",
-            "message": "Full populate process started",
-            "tasks": {
-                "gallery": gallery_result.id,
-                "metadata": metadata_result.id,
-                "favorites": favorites_result.id,
-            },
+            "status": "skipped",
+            "message": f"A populate for {username or 'all users'} is already running",
         }
+
+    try:
+        workflow, task_ids = full_populate_workflow(username, full, offset, run_id)
+        workflow.on_error(release_account_lock_task.si(username, run_id))
+        workflow.apply_async()
     except Exception as e:
+        release_account_lock(username, run_id)
         logger.error(f"Error in full_populate_task: {str(e)}")
-        return {"status": "error", "message": str(e)}
+        raise
+
+    return {
+        "status": "success",
+        "message": "Full populate process started",
+        "run_id": run_id,
+        "tasks": task_ids,
+    }
 
 
 if __name__ == "__main__":
@@ -2,22 +2,42 @@ import requests
 import sqlite3
 import time
 import os
+import re
 import json
+import uuid
+import copy
 import logging
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
+from urllib.parse import urlparse
 import pandas as pd
 from typing import Iterator
 from models import (
     Deviation,
     DeviationActivity,
     Select,
+    to_epoch,
     DeviationMetadata,
     User,
     Collection,
     Gallery,
     Message,
+    RawPayload,
+    PopulateRun,
+    write_stats,
+)
+from archive import PayloadArchive
+from leaderboards import refresh_leaderboards
+import refresh
+import storage
+import thumbs
+from utils import (
+    get_table_info,
+    generate_alter_statements,
+    create_temp_db_from_sql,
+    schema_fingerprint,
 )
-from utils import get_table_info, generate_alter_statements, create_temp_db_from_sql
 
 logger = logging.getLogger(__name__)
 
@@ -33,8 +53,50 @@ AUTHORIZATION_BASE_URL = "https://www.deviantart.com/oauth2/authorize"
 TOKEN_URL = "https://www.deviantart.com/oauth2/token"
 REDIRECT_URI = "http://localhost:4444/callback"
 
+# Deviations per /gallery/all page (the API maximum)
+GALLERY_PAGE_SIZE = 24
+
+# Deviations per shard of a full gallery crawl split across workers
+GALLERY_SHARD_SIZE = 20 * GALLERY_PAGE_SIZE
+
+# (endpoint, "requests" | "bytes" | "429" | "errors") -> count, recorded for
+# every API response that goes through raise_for_status
+api_stats = Counter()
+
+# Seconds between progress reports from a running stage (see run_stage)
+PROGRESS_INTERVAL = 10
+
+# Called with no arguments after every recorded API response; run_stage
+# registers one per stage that asked for progress reports
+api_call_hooks = []
+
+UUID_SEGMENT = re.compile(
+    r"/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I
+)
+
+
+def api_endpoint(url):
+    """API path with ids replaced (e.g. /deviation/{id}); the host otherwise."""
+    if not url.startswith(API_BASE_URL):
+        return urlparse(url).netloc
+    path = urlparse(url).path[len(urlparse(API_BASE_URL).path) :]
+    return UUID_SEGMENT.sub("/{id}", path)
+
+
+def record_api_call(response):
+    endpoint = api_endpoint(response.url)
+    api_stats[(endpoint, "requests")] += 1
+    api_stats[(endpoint, "bytes")] += len(response.content)
+    if response.status_code == 429:
+        api_stats[(endpoint, "429")] += 1
+    if response.status_code >= 400:
+        api_stats[(endpoint, "errors")] += 1
+    for hook in list(api_call_hooks):
+        hook()
+
 
 def raise_for_status(response):
+    record_api_call(response)
     try:
         response.raise_for_status()
     except Exception as e:
@@ -45,13 +107,17 @@ def raise_for_status(response):
 
 
 class DeviantArt:
-    def __init__(self, sqlitedb=None):
+    def __init__(self, sqlitedb=None, archive_payloads=False):
         self.access_token = ""
         self.refresh_token = ""
         self.expires = 0
         self.client_id = None
         self.client_secret = None
 
+        # When set (see populate), raw API payloads are stored in raw_payloads
+        self.archive_payloads = archive_payloads
+        self.archive = None
+
         if sqlitedb:
             self.sqlite_db = sqlitedb
         else:
@@ -70,6 +136,10 @@ class DeviantArt:
                 self.refresh_token = data["refresh_token"]
                 self.expires = data.get("expires_at", 0)
 
+    def _archive(self, kind, entity_id, data):
+        if self.archive:
+            self.archive.store(kind, entity_id, data)
+
     def authorization_url(self):
         url = f"{AUTHORIZATION_BASE_URL}?client_id={self.client_id}&redirect_uri={REDIRECT_URI}&response_type=code&scope=browse message publish stash"
         logger.info(f"Authorization URL: {url}")
@@ -176,10 +246,10 @@ class DeviantArt:
 
         return response.json()
 
-    def get_all_deviations(self, gallery="all", offset=0, username=None):
-        limit = 24
+    def get_all_deviations(self, gallery="all", offset=0, username=None, end=None):
         has_more = True
-        while has_more:
+        while has_more and (end is None or offset < end):
+            limit = min(GALLERY_PAGE_SIZE, end - offset) if end else GALLERY_PAGE_SIZE
             logger.info(f"Fetching gallery {gallery}: offset={offset}, limit={limit}")
             data = self._get_deviations(
                 offset, limit, gallery=gallery, username=username
@@ -191,6 +261,7 @@ class DeviantArt:
                 break
 
             for item in results:
+                self._archive("deviation", item.get("deviationid"), item)
                 yield Deviation.from_json(item)
 
     def get_deviation(self, deviation_id) -> Deviation:
@@ -198,6 +269,7 @@ class DeviantArt:
         params = {"access_token": self.access_token}
         try:
             response = raise_for_status(requests.get(url, params=params))
+            self._archive("deviation", deviation_id, response.json())
             return Deviation.from_json(response.json())
         except Exception as e:
             logging.error(f"Error fetching deviation {deviation_id}: {e}")
@@ -266,6 +338,7 @@ class DeviantArt:
                 metadata = response.json().get("metadata", [])
 
                 for item in metadata:
+                    self._archive("metadata", item.get("deviationid"), item)
                     yield DeviationMetadata.from_json(item)
 
                 sleep_time = max(1, sleep_time / 2)
@@ -329,6 +402,7 @@ class DeviantArt:
 
             logger.info(f"Feed data: {data}")
             for item in results:
+                self._archive("message", item.get("messageid"), item)
                 yield Message.from_json(item)
 
             cursor = data.get("cursor", None)
@@ -343,6 +417,7 @@ class DeviantArt:
             data = self._get_feed_stack(stackid, offset)
             results = data.pop("results")
             for item in results:
+                self._archive("message", item.get("messageid"), item)
                 yield Message.from_json(item)
 
             has_more = data.get("has_more", False)
@@ -359,40 +434,38 @@ class DeviantArt:
         ).json()
 
 
-def populate_feed(da: DeviantArt, db: sqlite3.Connection):
+def populate_feed(da: DeviantArt, writer: storage.BatchWriter):
     stacks = set()
 
-    query = Select(Message, ["messageid"]).where(f"messageid is not null")
-    rows = db.execute(query.sql()).fetchall()
-    messages = {row[0] for row in rows}
-
     inserted = 0
-    for item in da.get_feed():
-        logger.debug(item)
+    with writer.reader() as db:
+        for item in da.get_feed():
+            logger.debug(item)
+            seen = Message.exists(db, item.messageid)
 
-        if item.stackid and item.stack_count > 1:
-            stacks.add(item.stackid)
-            item.timestamp = None
+            if item.stackid and item.stack_count > 1:
+                stacks.add(item.stackid)
+                item.timestamp = None
 
-        item.deviationid = (item.deviation and item.deviation.deviationid) or (
-            item.subject and item.subject.get("deviation", {}).get("deviationid")
-        )
+            item.deviationid = (item.deviation and item.deviation.deviationid) or (
+                item.subject and item.subject.get("deviation", {}).get("deviationid")
+            )
 
-        item.insert(db, conflict_mode="replace")
-        item.originator.insert(db, conflict_mode="replace")
+            writer.upsert(item, conflict_mode="replace")
+            writer.upsert(item.originator, conflict_mode="replace")
 
-        inserted += 1
+            inserted += 1
 
-        if item.messageid in messages:
-            logger.info(
-                f"Stopping feed collection because message {item.messageid} already exists"
-            )
-            break
+            if seen:
+                logger.info(
+                    f"Stopping feed collection because message {item.messageid} already exists"
+                )
+                break
 
     logger.info(f"Processed {inserted} stacks")
 
 
-def populate_feed_stacks(da: DeviantArt, db: sqlite3.Connection):
+def populate_feed_stacks(da: DeviantArt, writer: storage.BatchWriter):
     query = (
         Select(Message, ["stackid", "deviationid", "stack_count", "count(*)"])
         .where(f"stackid is not null and stack_count > 1")
@@ -401,93 +474,166 @@ def populate_feed_stacks(da: DeviantArt, db: sqlite3.Connection):
     )
     logger.info(query.sql())
 
-    rows = db.execute(
-        Select(Message, ["messageid"]).where(f"stackid is null").sql()
-    ).fetchall()
-    messages = {row[0] for row in rows}
+    # The feed stage's messages must be committed before looking for stacks
+    writer.flush()
+    with writer.reader() as db:
+        rows = db.execute(query.sql()).fetchall()
+        for stack, deviationid, stack_count, count in rows:
+            logger.info(
+                f"Processing stack {stack}: {deviationid=} {stack_count=} {count=}"
+            )
+            store_feed_stack(da, writer, db, stack)
 
-    rows = db.execute(query.sql()).fetchall()
-    for stack, deviationid, stack_count, count in rows:
-        logger.info(f"Processing stack {stack}: {deviationid=} {stack_count=} {count=}")
-        inserted = 0
-        for item in da.get_feed_stack(stack):
 
-            logger.debug(item)
-            item.deviationid = (item.deviation and item.deviation.deviationid) or (
-                item.subject and item.subject.get("deviation", {}).get("deviationid")
-            )
+def store_feed_stack(da: DeviantArt, writer: storage.BatchWriter, db, stack):
+    """Queue a stack's messages, stopping at one already stored unstacked."""
+    inserted = 0
+    for item in da.get_feed_stack(stack):
 
-            item.insert(
-                db, conflict_mode="replace", allow_nulls=["stackid", "stack_count"]
+        logger.debug(item)
+        seen = any(
+            Message.stream(
+                db,
+                where="messageid = ? and stackid is null",
+                params=(item.messageid,),
+                columns=["messageid"],
             )
+        )
+        item.deviationid = (item.deviation and item.deviation.deviationid) or (
+            item.subject and item.subject.get("deviation", {}).get("deviationid")
+        )
 
-            item.originator.insert(db, conflict_mode="replace")
+        writer.upsert(
+            item, conflict_mode="replace", allow_nulls=["stackid", "stack_count"]
+        )
 
-            if item.messageid in messages:
-                logger.info(f"Message {item.messageid} already exists")
-                break
+        writer.upsert(item.originator, conflict_mode="replace")
 
-            inserted += 1
+        if seen:
+            logger.info(f"Message {item.messageid} already exists")
+            break
 
-        logger.info(f"Inserted {inserted} messages for stack {stack}")
-        db.commit()
+        inserted += 1
 
+    logger.info(f"Inserted {inserted} messages for stack {stack}")
 
-def populate_gallery(
+
+def crawl_gallery(
     da: DeviantArt,
-    db: sqlite3.Connection,
+    writer: storage.BatchWriter,
     gallery="all",
     username=None,
     full=False,
     offset=0,
+    end=None,
 ):
+    """Upsert gallery deviations from `offset` (up to `end`); returns the ids seen."""
     deviation_ids = []
+    new_thumbs = []
 
-    # These are ordered newest first
-    for i, item in enumerate(
-        da.get_all_deviations(gallery=gallery, offset=offset, username=username)
-    ):
-        logger.debug(item)
-        deviation_ids.append(item.deviationid)
-        author = item.author
-        if author:
-            r = author.insert(db, conflict_mode="replace")
-            item.user_id = author.userid
-
-        if item.thumbs and not os.path.exists(
-            f"{file_path}/thumbs/{item.deviationid}.jpg"
+    with writer.reader() as db:
+        # These are ordered newest first
+        for i, item in enumerate(
+            da.get_all_deviations(
+                gallery=gallery, offset=offset, username=username, end=end
+            )
         ):
-            for thumb in item.thumbs:
-                if thumb.src:
-                    os.makedirs("thumbs", exist_ok=True)
-                    res = requests.get(thumb.src)
-                    if res.status_code == 200:
-                        with open(f"thumbs/{item.deviationid}.jpg", "wb") as F:
-                            F.write(res.content)
-                        break
-
-        q = Select(Deviation).where(f"deviations.deviationid == '{item.deviationid}'")
-        rs = db.execute(q.sql())
-        if rs.fetchone():
-            logger.debug(f"Deviation {item.deviationid} already exists")
-            if not full:
-                break
+            logger.debug(item)
+            deviation_ids.append(item.deviationid)
+            author = item.author
+            if author:
+                writer.upsert(author, conflict_mode="replace")
+                item.user_id = author.userid
+
+            if thumbs.missing_derivatives(item.deviationid):
+                # Downloaded before, but an earlier resize didn't finish
+                new_thumbs.append(item.deviationid)
+            elif item.thumbs and not os.path.exists(
+                thumbs.original_path(item.deviationid)
+            ):
+                # Keep the largest thumb; smaller sizes are derived from it
+                for thumb in sorted(
+                    item.thumbs, key=lambda t: t.width or 0, reverse=True
+                ):
+                    if thumb.src:
+                        os.makedirs(thumbs.THUMBS_DIR, exist_ok=True)
+                        res = requests.get(thumb.src)
+                        record_api_call(res)
+                        if res.status_code == 200:
+                            with open(
+                                thumbs.original_path(item.deviationid), "wb"
+                            ) as F:
+                                F.write(res.content)
+                            new_thumbs.append(item.deviationid)
+                            break
+
+            if Deviation.exists(db, item.deviationid):
+                logger.debug(f"Deviation {item.deviationid} already exists")
+                if not full:
+                    break
+
+            writer.upsert(item, conflict_mode="replace")
 
-        item.insert(db, conflict_mode="replace")
+    try:
+        thumbs.generate_derivatives(new_thumbs)
+    except Exception as e:
+        # Missing sizes are regenerated the next time a crawl sees the deviation
+        logger.error(f"Error generating thumbnail derivatives: {e}")
+    return deviation_ids
+
+
+def mark_deleted(writer: storage.BatchWriter, seen_ids):
+    """Flag every deviation a full crawl didn't see as deleted."""
+    if not seen_ids:
+        return
+    logger.info(f"Marking deviations outside {len(seen_ids)} seen ones as deleted")
+    writer.execute(
+        "update deviations set is_deleted = true, row_hash = null, "
+        "updated_at = datetime('now') "
+        "where deviationid not in (select value from json_each(?))",
+        (json.dumps(sorted(seen_ids)),),
+    )
 
-        if i % 24 == 0:
-            db.commit()
 
-    db.commit()
+def populate_gallery(
+    da: DeviantArt,
+    writer: storage.BatchWriter,
+    gallery="all",
+    username=None,
+    full=False,
+    offset=0,
+):
+    deviation_ids = crawl_gallery(
+        da, writer, gallery=gallery, username=username, full=full, offset=offset
+    )
+    if full:
+        mark_deleted(writer, set(deviation_ids))
 
-    if full and deviation_ids:
-        q = f"""update deviations set is_deleted = true, updated_at = datetime('now') where deviationid not in ('{"','".join(deviation_ids)}')"""
-        logger.info(q)
-        db.execute(q)
-        db.commit()
 
+def plan_gallery_shards(db_path, offset=0, shard_size=GALLERY_SHARD_SIZE):
+    """Split a full gallery crawl into [(offset, end)] ranges for parallel workers.
 
-def populate_metadata(da: DeviantArt, db: sqlite3.Connection):
+    Sized from the deviations already stored; the last range is open-ended
+    so the crawl still reaches the end of a grown gallery. Neighbouring
+    ranges overlap by a page, so a deviation published mid-crawl (shifting
+    every offset by one) isn't missed between two shards.
+    """
+    try:
+        with storage.read_connection(db_path) as conn:
+            count = conn.execute(
+                f"SELECT count(*) FROM {Deviation.table_name} "
+                "WHERE is_deleted IS NOT true"
+            ).fetchone()[0]
+    except sqlite3.OperationalError:
+        count = 0
+
+    starts = range(offset, max(offset + 1, count), shard_size)
+    shards = [(start, start + shard_size + GALLERY_PAGE_SIZE) for start in starts]
+    shards[-1] = (shards[-1][0], None)
+    return shards
+
+
+def populate_metadata(da: DeviantArt, writer: storage.BatchWriter):
     select = (
         Select(
             Deviation,
@@ -500,27 +646,34 @@ def populate_metadata(da: DeviantArt, db: sqlite3.Connection):
     )
     print(select.sql())
 
-    rs = db.execute(select.sql(), {"mod": datetime.now().hour})
-    rows = rs.fetchall()
+    # Include deviations the gallery stage has just queued
+    writer.flush()
+    with writer.reader() as db:
+        rows = db.execute(select.sql(), {"mod": datetime.now().hour}).fetchall()
     logger.info(f"Fetching metadata for {len(rows)} deviations")
 
-    deviation_ids = [str(row[0]) for row in rows]
-    for i, item in enumerate(da.get_metadata(deviation_ids)):
+    store_metadata(da, writer, [str(row[0]) for row in rows])
+
+
+def store_metadata(da: DeviantArt, writer: storage.BatchWriter, deviation_ids):
+    """Fetch metadata for deviation_ids and queue it, with the stats copy on deviations."""
+    for item in da.get_metadata(list(deviation_ids)):
         user = item.author
         if user:
-            user.insert(db, conflict_mode="replace")
+            writer.upsert(user, conflict_mode="replace")
             item.user_id = user.userid
 
-        item.insert(db, conflict_mode="replace")
+        writer.upsert(item, conflict_mode="replace")
 
         for c in item.collections:
-            r = c.insert(db, conflict_mode="replace")
+            writer.upsert(c, conflict_mode="replace")
 
         for g in item.galleries:
-            r = g.insert(db, conflict_mode="replace")
+            writer.upsert(g, conflict_mode="replace")
 
-        db.execute(
-            f"UPDATE deviations SET stats = ?, title = ? WHERE deviationid = ?",
+        writer.execute(
+            f"UPDATE deviations SET stats = ?, title = ?, row_hash = NULL "
+            "WHERE deviationid = ?",
             (
                 json.dumps(
                     {
@@ -532,12 +685,9 @@ def populate_metadata(da: DeviantArt, db: sqlite3.Connection):
                 item.deviationid,
             ),
         )
-        if i % 10 == 0:
-            db.commit()
-    db.commit()
 
 
-def populate_favorites(da: DeviantArt, db: sqlite3.Connection):
+def populate_favorites(da: DeviantArt, writer: storage.BatchWriter):
     select = (
         Select(
             DeviationMetadata,
@@ -555,56 +705,116 @@ def populate_favorites(da: DeviantArt, db: sqlite3.Connection):
         )
     )
     logger.info(select.sql())
-    rows = db.execute(select.sql()).fetchall()
+    writer.flush()
+    with writer.reader() as db:
+        rows = db.execute(select.sql()).fetchall()
 
     for deviation_id, fav, count in rows:
         logger.info(f"Fetching /whofaved for {deviation_id=}: ({count=}, {fav=})")
         if count > fav:
-            db.execute(
+            writer.execute(
                 f"DELETE FROM {DeviationActivity.table_name} WHERE deviationid = ?",
                 (deviation_id,),
             )
             logger.info(f"Deleted {count - fav} rows for deviation: {deviation_id}")
             count = 0
 
-        for item in da.get_whofaved(deviation_id, offset=count):
-            user = User.from_json(item.get("user"))
-            if user:
-                user.insert(db, conflict_mode="replace")
-
-                a = DeviationActivity(
-                    deviationid=deviation_id,
-                    userid=user.userid,
-                    time=item.get("time"),
-                    action="fave",
-                    timestamp=datetime.fromtimestamp(item.get("time")),
-                )
-                a.insert(db, conflict_mode="ignore")
-        db.commit()
+        store_whofaved(da, writer, deviation_id, offset=count)
         time.sleep(1)
 
 
-def populate(da: DeviantArt, full=False, username=None, offset=0):
+def store_whofaved(da: DeviantArt, writer: storage.BatchWriter, deviation_id, offset=0):
+    """Queue the fans of a deviation from /whofaved, starting at `offset`."""
+    for item in da.get_whofaved(deviation_id, offset=offset):
+        user = User.from_json(item.get("user"))
+        if user:
+            writer.upsert(user, conflict_mode="replace")
+
+            a = DeviationActivity(
+                deviationid=deviation_id,
+                userid=user.userid,
+                time=item.get("time"),
+                action="fave",
+                timestamp=datetime.fromtimestamp(item.get("time")),
+            )
+            writer.upsert(a, conflict_mode="ignore")
 
-    da.check_token()
 
-    with sqlite3.connect(da.sqlite_db) as db:
-        for table in [
-            User,
-            Deviation,
-            DeviationMetadata,
-            DeviationActivity,
-            Collection,
-            Gallery,
-            Message,
-        ]:
-            existing = get_table_info(da.sqlite_db, table.table_name)
-            if not existing["columns"]:
-                logging.info(table.create_table_sql())
-                db.execute(table.create_table_sql())
-                continue
+def populate_refresh_requests(da: DeviantArt, writer: storage.BatchWriter):
+    """Service the on-demand refresh queue (see refresh.py), highest priority first.
+
+    A request is only marked done once the rows it wrote are committed, so a
+    poller never sees "done" before the new numbers are readable.
+    """
+    serviced = 0
+    while claimed := writer.call(refresh.claim):
+        for request_id, kind, target in claimed:
+            error = None
+            try:
+                if kind == "metadata":
+                    store_metadata(da, writer, [target])
+                elif kind == "whofaved":
+                    with writer.reader() as db:
+                        (count,) = db.execute(
+                            f"SELECT count(*) FROM {DeviationActivity.table_name} "
+                            "WHERE deviationid = ? AND action = 'fave'",
+                            (target,),
+                        ).fetchone()
+                    store_whofaved(da, writer, target, offset=count)
+                elif kind == "stack":
+                    with writer.reader() as db:
+                        store_feed_stack(da, writer, db, target)
+                writer.flush()
+            except Exception as e:
+                logger.error(f"Error refreshing {kind} {target}: {e}")
+                error = f"{type(e).__name__}: {e}"
+            writer.submit(refresh.finish, request_id, error)
+            serviced += 1
 
-            new_info = create_temp_db_from_sql(table.create_table_sql())
+    logger.info(f"Serviced {serviced} refresh requests")
+
+
+TABLES = [
+    User,
+    Deviation,
+    DeviationMetadata,
+    DeviationActivity,
+    Collection,
+    Gallery,
+    Message,
+    RawPayload,
+    PopulateRun,
+]
+
+SCHEMA_META_TABLE = "schema_meta"
+
+
+def sync_schema(db: sqlite3.Connection, tables=TABLES):
+    """Create or migrate model tables whose schema changed since the last run.
+
+    Each table's CREATE TABLE/INDEX sql is hashed and stored in schema_meta;
+    tables whose hash still matches are skipped without touching PRAGMAs.
+    """
+    db.execute(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA_META_TABLE} "
+        "(table_name VARCHAR PRIMARY KEY, fingerprint VARCHAR, updated_at TIMESTAMP)"
+    )
+    stored = dict(
+        db.execute(f"SELECT table_name, fingerprint FROM {SCHEMA_META_TABLE}")
+    )
+
+    for table in tables:
+        schema_sql = "\n".join([table.create_table_sql(), *table.create_index_sql()])
+        fingerprint = schema_fingerprint(schema_sql)
+        if stored.get(table.table_name) == fingerprint:
+            continue
+
+        existing = get_table_info(db, table.table_name)
+        if not existing["columns"]:
+            logging.info(table.create_table_sql())
+            db.execute(table.create_table_sql())
+        else:
+            new_info = create_temp_db_from_sql(schema_sql)
 
             alter_statements = generate_alter_statements(
                 existing, new_info, table.table_name
@@ -614,22 +824,258 @@ def populate(da: DeviantArt, full=False, username=None, offset=0):
                 logging.info(stmt)
                 db.execute(stmt)
 
-        populate_gallery(
-            da, db, gallery="all", username=username, full=full, offset=offset
+        for stmt in table.create_index_sql():
+            db.execute(stmt)
+
+        db.execute(
+            f"INSERT OR REPLACE INTO {SCHEMA_META_TABLE} VALUES (?, ?, ?)",
+            (table.table_name, fingerprint, datetime.now().isoformat()),
+        )
+
+    db.commit()
+
+
+def backfill_message_epochs(db: sqlite3.Connection, batch_size=1000):
+    """Fill messages.epoch/day for rows stored before those columns existed."""
+    updated = 0
+    while True:
+        rows = db.execute(
+            Select(Message, ["messageid", "ts"])
+            .where("epoch is null and ts is not null")
+            .sql(limit=batch_size)
+        ).fetchall()
+
+        params = []
+        for messageid, ts in rows:
+            try:
+                epoch = to_epoch(ts)
+            except ValueError:
+                logger.warning(f"Unparseable ts for message {messageid}: {ts}")
+                epoch = -1
+            params.append((epoch, epoch // 86400, messageid))
+
+        if not params:
+            break
+
+        db.executemany(
+            f"UPDATE {Message.table_name} SET epoch = ?, day = ? WHERE messageid = ?",
+            params,
         )
-        db.commit()
+        updated += len(params)
+
+    if updated:
+        logger.info(f"Backfilled epoch for {updated} messages")
+    return updated
+
+
+def backfill_deviation_epochs(db: sqlite3.Connection):
+    """Fill deviations.published_epoch for rows stored before it existed."""
+    updated = db.execute(
+        f"UPDATE {Deviation.table_name} "
+        "SET published_epoch = cast(published_time as integer), row_hash = NULL "
+        "WHERE published_epoch IS NULL AND published_time GLOB '[0-9]*'"
+    ).rowcount
+    if updated:
+        logger.info(f"Backfilled published_epoch for {updated} deviations")
+    return updated
+
+
+def count_stage(run: PopulateRun, api_before, writes_before):
+    """Fill run's API and row counts from the change in api_stats/write_stats."""
+    api_calls = {}
+    for (endpoint, kind), count in (api_stats - api_before).items():
+        api_calls.setdefault(endpoint, {})[kind] = count
+    run.api_calls = api_calls
+    run.api_requests = sum(c.get("requests", 0) for c in api_calls.values())
+    run.api_bytes = sum(c.get("bytes", 0) for c in api_calls.values())
+    run.api_429 = sum(c.get("429", 0) for c in api_calls.values())
+    run.api_errors = sum(c.get("errors", 0) for c in api_calls.values())
+
+    # write_stats is updated by the writer thread; dict() copies it atomically
+    rows = {}
+    for (table, outcome), count in (Counter(dict(write_stats)) - writes_before).items():
+        if table != PopulateRun.table_name:
+            rows.setdefault(table, {})[outcome] = count
+    run.rows = rows
+    run.rows_inserted = sum(r.get("inserted", 0) for r in rows.values())
+    run.rows_updated = sum(r.get("updated", 0) for r in rows.values())
+    run.rows_skipped = sum(r.get("skipped", 0) for r in rows.values())
+
+
+@contextmanager
+def run_stage(writer: storage.BatchWriter, run_id, stage, progress=None):
+    """Record a populate stage in populate_runs, then commit.
+
+    The row is queued as "running" when the stage starts, so a stage that
+    is still going (or whose process was killed) shows up in the ledger,
+    and is updated when it finishes. API calls and row writes are taken as
+    the difference in api_stats and write_stats across the stage, so stages
+    can nest (see "total"). The stage's queued writes are flushed before it
+    counts as finished.
+
+    `progress`, if given, is called with the running PopulateRun (counts
+    so far) at most every PROGRESS_INTERVAL seconds, after an API response.
+    """
+    api_before, writes_before = api_stats.copy(), Counter(dict(write_stats))
+    run = PopulateRun(run_id=run_id, stage=stage, started_at=int(time.time()))
+    # A copy, since the writer thread may apply it after the stage has ended
+    writer.upsert(copy.copy(run), conflict_mode="replace")
+
+    hook = None
+    if progress:
+        last_report = time.monotonic()
+
+        def hook():
+            nonlocal last_report
+            if time.monotonic() - last_report < PROGRESS_INTERVAL:
+                return
+            last_report = time.monotonic()
+            snapshot = copy.copy(run)
+            count_stage(snapshot, api_before, writes_before)
+            try:
+                progress(snapshot)
+            except Exception as e:
+                logger.warning(f"Error reporting progress of stage {stage}: {e}")
+
+        api_call_hooks.append(hook)
+
+    try:
+        yield run
+        writer.flush()
+        run.status = "ok"
+    except Exception as e:
+        run.status = "error"
+        run.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if hook:
+            api_call_hooks.remove(hook)
+        run.finished_at = int(time.time())
+        count_stage(run, api_before, writes_before)
+
+        logger.info(
+            f"Stage {stage} {run.status} in {run.finished_at - run.started_at}s: "
+            f"{run.api_requests} API requests ({run.api_429} rate limited), "
+            f"{run.rows_inserted} rows inserted, {run.rows_updated} updated"
+        )
+        try:
+            writer.upsert(run, conflict_mode="replace")
+            writer.flush()
+        except Exception as e:
+            logger.error(f"Error recording populate run {run_id}/{stage}: {e}")
+
+
+def populate_stages(da: DeviantArt, full=False, username=None, offset=0):
+    """Populate stages in run order: name -> function taking the BatchWriter."""
+    return {
+        # On-demand refreshes go first, ahead of the scheduled crawl
+        "refresh": lambda writer: populate_refresh_requests(da, writer),
+        "gallery": lambda writer: populate_gallery(
+            da, writer, gallery="all", username=username, full=full, offset=offset
+        ),
+        "metadata": lambda writer: populate_metadata(da, writer),
+        # "favorites": lambda writer: populate_favorites(da, writer),
+        "feed": lambda writer: populate_feed(da, writer),
+        "feed_stacks": lambda writer: populate_feed_stacks(da, writer),
+        "leaderboards": lambda writer: writer.call(refresh_leaderboards),
+    }
+
+
+def run_stages(da: DeviantArt, stages=None, run_id=None, **kwargs):
+    """Run populate stages (all of them by default) through one BatchWriter.
+
+    Every stage gets a populate_runs row under `run_id`; returns the run id.
+    kwargs go to populate_stages. Queued refresh requests are serviced
+    between stages, so they wait for at most the stage that is running.
+    """
+    da.check_token()
+    write_stats.clear()
+    run_id = run_id or uuid.uuid4().hex
 
-        populate_metadata(da, db)
-        db.commit()
+    available = populate_stages(da, **kwargs)
+    stages = stages or list(available)
 
-        # populate_favorites(da, db)
-        # db.commit()
+    with storage.BatchWriter(da.sqlite_db) as writer:
+        writer.call(sync_schema)
 
-        populate_feed(da, db)
-        db.commit()
+        if da.archive_payloads:
+            da.archive = PayloadArchive(writer=writer)
 
-        populate_feed_stacks(da, db)
-        db.commit()
+        writer.call(backfill_message_epochs)
+        writer.call(backfill_deviation_epochs)
+
+        with run_stage(writer, run_id, "total"):
+            for stage in stages:
+                if stage != "refresh" and refresh.pending(da.sqlite_db):
+                    with run_stage(writer, run_id, "refresh"):
+                        available["refresh"](writer)
+                with run_stage(writer, run_id, stage):
+                    available[stage](writer)
+
+    for (table, outcome), count in sorted(write_stats.items()):
+        logger.info(f"{table}: {count} rows {outcome}")
+    return run_id
+
+
+def populate(da: DeviantArt, full=False, username=None, offset=0):
+    return run_stages(da, full=full, username=username, offset=offset)
+
+
+def reproject_archive(db: sqlite3.Connection, kind=None):
+    """Re-run from_json over archived payloads and fill in what they add.
+
+    Fills columns added to the models since the payloads were fetched
+    without making any API calls. Only NULL columns are filled, so newer
+    data from the live stages wins: deleted deviations are skipped, and
+    the stats/title copy from the metadata stage and the stack columns
+    cleared by the feed_stacks stage are never touched.
+    """
+    counts = {}
+    for i, (kind, entity_id, data) in enumerate(PayloadArchive(db).iter_payloads(kind)):
+        if kind == "deviation":
+            item = Deviation.from_json(data)
+            deleted = db.execute(
+                f"SELECT 1 FROM {Deviation.table_name} "
+                "WHERE deviationid = ? AND is_deleted IS true",
+                (str(item.deviationid),),
+            ).fetchone()
+            if deleted:
+                continue
+            if item.author:
+                item.author.insert(db, conflict_mode="fill")
+                item.user_id = item.author.userid
+            item.insert(db, conflict_mode="fill", keep=["is_deleted", "stats", "title"])
+        elif kind == "metadata":
+            item = DeviationMetadata.from_json(data)
+            if item.author:
+                item.author.insert(db, conflict_mode="fill")
+                item.user_id = item.author.userid
+            item.insert(db, conflict_mode="fill")
+            for c in item.collections or []:
+                c.insert(db, conflict_mode="fill")
+            for g in item.galleries or []:
+                g.insert(db, conflict_mode="fill")
+        elif kind == "message":
+            item = Message.from_json(data)
+            item.insert(
+                db,
+                conflict_mode="fill",
+                allow_nulls=["stackid", "stack_count"],
+                keep=["stackid", "stack_count"],
+            )
+            if item.originator:
+                item.originator.insert(db, conflict_mode="fill")
+        else:
+            logger.warning(f"Unknown archive kind {kind} for {entity_id}")
+            continue
+
+        counts[kind] = counts.get(kind, 0) + 1
+        if i % 1000 == 0:
+            db.commit()
+
+    db.commit()
+    logger.info(f"Reprojected archived payloads: {counts}")
+    return counts
 
 
 def download_images(da: DeviantArt, output_folder="images"):
@@ -641,12 +1087,11 @@ def download_images(da: DeviantArt, output_folder="images"):
     # Create output folder if it doesn't exist
     Path(output_folder).mkdir(exist_ok=True)
 
-    with sqlite3.connect(da.sqlite_db) as db:
-        # Get all deviations with content info
-        cursor = db.execute("SELECT deviationid, title, content FROM deviations")
-        deviations = cursor.fetchall()
-
-        for deviationid, title, content in deviations:
+    with storage.connect(da.sqlite_db) as db:
+        # Stream deviations with content info
+        for deviationid, title, content in Deviation.stream(
+            db, columns=["deviationid", "title", "content"]
+        ):
             print(deviationid, title)
 
             if content := json.loads(content or "{}"):
@@ -713,6 +1158,12 @@ if __name__ == "__main__":
     parser.add_argument("--username", type=str, default=None)
     parser.add_argument("--full", action="store_true")
     parser.add_argument("--skip", action="store_true")
+    parser.add_argument("--archive", action="store_true", help="Store raw API payloads")
+    parser.add_argument(
+        "--reproject",
+        action="store_true",
+        help="Rebuild model tables from archived payloads and exit",
+    )
     args = parser.parse_args()
 
     logging.basicConfig(
@@ -720,9 +1171,18 @@ if __name__ == "__main__":
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     )
     if args.username:
-        da = DeviantArt(sqlitedb=os.path.join(file_path, f"{args.username}.sqlite"))
+        da = DeviantArt(
+            sqlitedb=os.path.join(file_path, f"{args.username}.sqlite"),
+            archive_payloads=args.archive,
+        )
     else:
-        da = DeviantArt()
+        da = DeviantArt(archive_payloads=args.archive)
+
+    if args.reproject:
+        with storage.writer(da.sqlite_db) as db:
+            sync_schema(db)
+            reproject_archive(db)
+        raise SystemExit(0)
 
     da.check_token()
 
@@ -731,7 +1191,7 @@ if __name__ == "__main__":
 
     print("Data collection completed.")
 
-    with sqlite3.connect(da.sqlite_db) as db:
+    with storage.connect(da.sqlite_db) as db:
         rs = db.execute(
             """SELECT title, count(*) filter(where type='feedback.favourite' or type='feedback.collect'), count(*) filter(where type='feedback.comment'), url
             FROM deviations 
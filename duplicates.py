@@ -3,7 +3,7 @@ import sqlite3
 from PIL import Image
 import imagehash
 from collections import defaultdict
-from da import DeviantArt
+from models import Deviation
 
 
 def get_hashes(folder_path):
@@ -89,21 +89,25 @@ def main():
         return
 
     conn = sqlite3.connect(args.sqlitedb)
-    cursor = conn.cursor()
 
     print(f"\nFound {len(duplicates)} duplicate images:")
     for hash_value, filepaths in duplicates:
         print(f"\nDuplicate set (hash: {hash_value}):")
         for filepath in filepaths:
             uuid = os.path.basename(filepath).split(".")[0]
-            cursor.execute("SELECT * FROM deviations WHERE deviationid = ?", (uuid,))
-            cols = [desc[0] for desc in cursor.description]
-            rec = cursor.fetchone()
-            if rec is None:
+            dev = next(
+                Deviation.stream(
+                    conn,
+                    where="deviationid = ?",
+                    params=(uuid,),
+                    columns=["url", "is_deleted"],
+                ),
+                None,
+            )
+            if dev is None:
                 print(f"  {filepath} --> Not found in database")
                 continue
-            dev = {cols[i]: rec[i] for i in range(len(cols))}
-            print(f"  {filepath} --> {dev['url']} ({dev['is_deleted']})")
+            print(f"  {filepath} --> {dev.url} ({dev.is_deleted})")
 
         # for filepath in filepaths[1:]:
         #     print(f"  {filepath} --> Deleting")
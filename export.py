@@ -0,0 +1,251 @@
+import io
+import csv
+import copy
+import json
+import logging
+
+from models import (
+    Select,
+    Message,
+    DeviationActivity,
+    Deviation,
+    DeviationMetadata,
+    to_epoch,
+    end_epoch,
+)
+import storage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Rows pulled from the cursor (and written) per step; bounds memory use
+EXPORT_BATCH_SIZE = 5000
+
+GALLERY_FILTER = """deviationid IN (
+    SELECT dm.deviationid FROM deviation_metadata dm, json_each(dm.galleries) gallery
+    WHERE gallery.value->>'folderid' = ?)"""
+
+# dataset -> (query, column holding unix seconds for the date range filter)
+DATASETS = {
+    "messages": (
+        Select(
+            Message,
+            columns=[
+                "messageid",
+                "type",
+                "ts",
+                "epoch",
+                "deviationid",
+                "stackid",
+                "stack_count",
+                "originator->>'userid' as originator_userid",
+                "originator->>'username' as originator_username",
+            ],
+        ).order_by("epoch"),
+        "epoch",
+    ),
+    "deviation_activity": (
+        Select(
+            DeviationActivity,
+            columns=["deviationid", "userid", "action", "time", "timestamp"],
+        ).order_by("time"),
+        "time",
+    ),
+    "deviation_stats": (
+        Select(
+            Deviation,
+            columns=[
+                "deviationid",
+                "deviations.title as title",
+                "deviations.url as url",
+                "deviations.published_epoch as published_time",
+                "cast(coalesce(deviation_metadata.stats->'favourites', deviations.stats->'favourites') as int) as favourites",
+                "cast(deviation_metadata.stats->'views' as int) as views",
+                "cast(deviation_metadata.stats->'comments' as int) as comments",
+                "cast(deviation_metadata.stats->'downloads' as int) as downloads",
+            ],
+        )
+        .join(DeviationMetadata, on="deviationid", how="left")
+        .order_by("deviations.published_epoch"),
+        "deviations.published_epoch",
+    ),
+}
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_query(dataset, start=None, end=None, gallery=None):
+    """(sql, params) for one dataset with optional date range and gallery."""
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset}")
+    base, time_column = DATASETS[dataset]
+
+    query = copy.deepcopy(base)
+    params = []
+    if start:
+        query.where(f"{time_column} >= ?")
+        params.append(to_epoch(start))
+    if end:
+        query.where(f"{time_column} < ?")
+        params.append(end_epoch(end))
+    if gallery and gallery != "all":
+        query.where(GALLERY_FILTER)
+        params.append(gallery)
+
+    return query.sql(), params
+
+
+def iter_batches(db_path, sql, params=(), batch_size=EXPORT_BATCH_SIZE):
+    """Yield (columns, rows) batches from a dedicated read-only connection.
+
+    Exports can run for minutes, so they don't hold a connection from the
+    shared read pool.
+    """
+    conn = storage.connect(db_path, readonly=True)
+    try:
+        cursor = conn.execute(sql, params)
+        columns = [col[0].lower() for col in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield columns, rows
+    finally:
+        conn.close()
+
+
+def write_ndjson(batches):
+    for columns, rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+def write_csv(batches):
+    header = True
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for columns, rows in batches:
+        if header:
+            writer.writerow(columns)
+            header = False
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back in chunks.
+
+    Keeps a running position so the parquet footer offsets stay correct
+    after earlier chunks have been sent.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def write_parquet(batches):
+    """One row group per batch; the schema is inferred from the first batch."""
+    sink = _ChunkSink()
+    writer = None
+    for columns, rows in batches:
+        table = pa.Table.from_pylist([dict(zip(columns, row)) for row in rows])
+        if writer is None:
+            schema = pa.schema(
+                pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                for f in table.schema
+            )
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(table.cast(writer.schema))
+        yield sink.drain()
+
+    if writer is None:
+        return
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {"ndjson": write_ndjson, "csv": write_csv, "parquet": write_parquet}
+
+
+def stream_export(
+    db_path,
+    dataset,
+    fmt="ndjson",
+    start=None,
+    end=None,
+    gallery=None,
+    batch_size=EXPORT_BATCH_SIZE,
+):
+    """Generator of encoded chunks for a dataset export."""
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown format: {fmt}")
+    if fmt == "parquet" and pa is None:
+        raise ValueError("Parquet export requires the pyarrow package")
+
+    sql, params = export_query(dataset, start, end, gallery)
+    return WRITERS[fmt](iter_batches(db_path, sql, params, batch_size))
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    from da import DeviantArt
+
+    parser = argparse.ArgumentParser(description="Export a dataset from the database")
+    parser.add_argument("dataset", choices=list(DATASETS))
+    parser.add_argument("--format", "-f", choices=list(FORMATS), default="ndjson")
+    parser.add_argument("--start", type=str, default=None)
+    parser.add_argument("--end", type=str, default=None)
+    parser.add_argument("--gallery", type=str, default=None)
+    parser.add_argument(
+        "--output", "-o", type=str, default=None, help="Default: stdout"
+    )
+    parser.add_argument("--sqlitedb", type=str, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    db_path = DeviantArt(args.sqlitedb).sqlite_db
+    chunks = stream_export(
+        db_path, args.dataset, args.format, args.start, args.end, args.gallery
+    )
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
@@ -0,0 +1,230 @@
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import multiprocessing
+from dataclasses import dataclass
+
+from da import DeviantArt, run_stages
+import refresh
+import storage
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_TABLE = "ingest_schedule"
+
+# Longest single sleep, so queued refresh requests are picked up quickly
+MAX_SLEEP = 5
+
+# Longest wait (seconds) before servicing refresh requests again after the
+# refresh child failed; the wait doubles from MAX_SLEEP on each failure
+MAX_REFRESH_BACKOFF = 10 * 60
+
+
+@dataclass
+class Schedule:
+    """Populate stages that run together on one adaptive interval.
+
+    After a run the interval halves (down to min_interval) if `signal_table`
+    got new or changed rows, and grows by `backoff` (up to max_interval)
+    if it didn't or the run failed.
+    """
+
+    name: str
+    stages: tuple
+    signal_table: str
+    min_interval: int
+    max_interval: int
+    backoff: float = 1.5
+    interval: float = None
+    next_run: float = 0.0
+    last_run: float = None
+    last_status: str = None
+
+    def __post_init__(self):
+        if self.interval is None:
+            self.interval = self.min_interval
+
+    def adapt(self, changed_rows, ok=True):
+        if ok and changed_rows:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        self.last_run = time.time()
+        self.last_status = "ok" if ok else "error"
+        self.next_run = self.last_run + self.interval
+
+
+def default_schedules():
+    # Ordered like populate(); when several are due the first one runs first
+    return [
+        Schedule("gallery", ("gallery",), "deviations", 6 * 3600, 24 * 3600),
+        Schedule(
+            "metadata",
+            ("metadata", "leaderboards"),
+            "deviation_metadata",
+            3 * 3600,
+            12 * 3600,
+        ),
+        Schedule(
+            "feed", ("feed", "feed_stacks", "leaderboards"), "messages", 60, 30 * 60
+        ),
+    ]
+
+
+def create_schema(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {SCHEDULE_TABLE} ("
+        "name VARCHAR PRIMARY KEY, stages VARCHAR, interval DOUBLE, "
+        "next_run DOUBLE, last_run DOUBLE, last_status VARCHAR)"
+    )
+
+
+def load_schedules(db_path, schedules):
+    """Resume intervals and next run times saved by a previous scheduler."""
+    conn = storage.connect(db_path)
+    try:
+        create_schema(conn)
+        saved = {
+            row[0]: row[1:]
+            for row in conn.execute(
+                f"SELECT name, interval, next_run, last_run, last_status "
+                f"FROM {SCHEDULE_TABLE}"
+            )
+        }
+    finally:
+        conn.close()
+
+    for schedule in schedules:
+        if schedule.name in saved:
+            interval, next_run, last_run, last_status = saved[schedule.name]
+            schedule.interval = min(
+                max(interval, schedule.min_interval), schedule.max_interval
+            )
+            schedule.next_run = next_run
+            schedule.last_run = last_run
+            schedule.last_status = last_status
+    return schedules
+
+
+def save_schedule(db_path, schedule):
+    conn = storage.connect(db_path)
+    try:
+        create_schema(conn)
+        conn.execute(
+            f"INSERT OR REPLACE INTO {SCHEDULE_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                schedule.name,
+                json.dumps(schedule.stages),
+                schedule.interval,
+                schedule.next_run,
+                schedule.last_run,
+                schedule.last_status,
+            ),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_once(da: DeviantArt, stages=None, run_id=None):
+    """Run populate stages in a child process and wait for it to finish.
+
+    The child keeps the API crawl off the web workers' GIL and releases all
+    of its memory when it exits. Returns the child's exit code.
+    """
+    p = multiprocessing.Process(target=run_stages, args=(da, stages, run_id))
+    p.daemon = True
+    p.start()
+    p.join()
+    if p.exitcode:
+        logger.error(f"Populate {stages or 'all'} exited with code {p.exitcode}")
+    return p.exitcode
+
+
+def changed_rows(db_path, run_id, table):
+    """Rows inserted or updated in `table` by a run, from populate_runs."""
+    try:
+        with storage.read_connection(db_path) as conn:
+            rows = conn.execute(
+                "SELECT rows FROM populate_runs WHERE run_id = ? AND stage = 'total'",
+                (run_id,),
+            ).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    if not rows or not rows[0]:
+        return 0
+    counts = json.loads(rows[0]).get(table, {})
+    return counts.get("inserted", 0) + counts.get("updated", 0)
+
+
+def run_scheduler(da: DeviantArt, schedules=None):
+    """Run each schedule whenever it's due, one at a time, forever.
+
+    Schedules run sequentially in this loop, and each run takes the
+    database's writer lock, so stages never overlap on one database.
+    Requests in the on-demand refresh queue (see refresh.py) run first,
+    ahead of any schedule that is due, and between the stages of a
+    scheduled run; a request made during a stage (e.g. a long gallery
+    crawl) waits for that stage to finish. If the refresh child fails
+    (e.g. a bad token) its requests stay queued and are retried with a
+    growing backoff instead of on every pass.
+    """
+    schedules = load_schedules(da.sqlite_db, schedules or default_schedules())
+    for schedule in schedules:
+        save_schedule(da.sqlite_db, schedule)
+
+    refresh_backoff, refresh_retry_at = MAX_SLEEP, 0.0
+    while True:
+        if time.time() >= refresh_retry_at and refresh.pending(da.sqlite_db):
+            try:
+                exitcode = run_once(da, ["refresh"])
+            except Exception as e:
+                logger.error(f"Error starting refresh: {e}")
+                exitcode = -1
+            if exitcode == 0:
+                refresh_backoff = MAX_SLEEP
+                continue
+            logger.warning(f"Refresh failed, retrying in {refresh_backoff:.0f}s")
+            refresh_retry_at = time.time() + refresh_backoff
+            refresh_backoff = min(refresh_backoff * 2, MAX_REFRESH_BACKOFF)
+
+        due = min(schedules, key=lambda s: s.next_run)
+        wait = due.next_run - time.time()
+        if wait > 0:
+            time.sleep(min(wait, MAX_SLEEP))
+            continue
+
+        run_id = uuid.uuid4().hex
+        logger.info(f"Running {due.name} stages {due.stages}")
+        try:
+            ok = run_once(da, list(due.stages), run_id) == 0
+        except Exception as e:
+            logger.error(f"Error starting {due.name}: {e}")
+            ok = False
+
+        due.adapt(changed_rows(da.sqlite_db, run_id, due.signal_table), ok)
+        save_schedule(da.sqlite_db, due)
+        logger.info(f"Next {due.name} run in {due.interval:.0f}s")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Keep the database up to date, separately from the web app"
+    )
+    parser.add_argument("--sqlitedb", type=str, default=None)
+    parser.add_argument("--once", action="store_true", help="Run a single populate")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    da = DeviantArt(args.sqlitedb)
+    if args.once:
+        raise SystemExit(run_once(da))
+    run_scheduler(da)
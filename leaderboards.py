@@ -0,0 +1,224 @@
+import time
+import sqlite3
+import logging
+
+from models import DeviationActivity, DeviationMetadata
+
+logger = logging.getLogger(__name__)
+
+# Materialized windows: name -> length in seconds (None = all time)
+WINDOWS = {
+    "24h": 24 * 60 * 60,
+    "7d": 7 * 24 * 60 * 60,
+    "30d": 30 * 24 * 60 * 60,
+    "all": None,
+}
+
+# (table, key column) for the deviation and fan leaderboards
+BOARDS = [
+    ("leaderboard_deviations", "deviationid"),
+    ("leaderboard_fans", "userid"),
+]
+
+STATE_TABLE = "leaderboard_state"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS leaderboard_deviations (
+    period VARCHAR, gallery VARCHAR, deviationid VARCHAR, favorites BIGINT,
+    PRIMARY KEY (period, gallery, deviationid)
+);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_deviations_rank
+    ON leaderboard_deviations (period, gallery, favorites);
+
+CREATE TABLE IF NOT EXISTS leaderboard_fans (
+    period VARCHAR, gallery VARCHAR, userid VARCHAR, favorites BIGINT,
+    PRIMARY KEY (period, gallery, userid)
+);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_fans_rank
+    ON leaderboard_fans (period, gallery, favorites);
+
+-- last_created_at: deviation_activity rows created up to here are counted
+--   (NULL = rebuild); unlike rowid, created_at survives a VACUUM
+-- lower_bound: activity older than this has been expired
+CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+    period VARCHAR PRIMARY KEY, last_created_at VARCHAR, lower_bound BIGINT,
+    refreshed_at BIGINT
+);
+
+-- Deleted activity, or a deviation moving between galleries, can't be
+-- applied as a delta; force a rebuild on the next refresh instead
+CREATE TRIGGER IF NOT EXISTS leaderboard_activity_deleted
+AFTER DELETE ON {DeviationActivity.table_name}
+BEGIN
+    UPDATE {STATE_TABLE} SET last_created_at = NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS leaderboard_galleries_changed
+AFTER UPDATE OF galleries ON {DeviationMetadata.table_name}
+WHEN old.galleries IS NOT new.galleries
+BEGIN
+    UPDATE {STATE_TABLE} SET last_created_at = NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS leaderboard_galleries_added
+AFTER INSERT ON {DeviationMetadata.table_name}
+WHEN EXISTS (
+    SELECT 1 FROM {DeviationActivity.table_name} WHERE deviationid = new.deviationid
+)
+BEGIN
+    UPDATE {STATE_TABLE} SET last_created_at = NULL;
+END;
+"""
+
+
+def create_schema(db: sqlite3.Connection):
+    columns = [row[1] for row in db.execute(f"PRAGMA table_info({STATE_TABLE})")]
+    if "last_rowid" in columns:
+        # State from before it was keyed on created_at; rebuild every window
+        db.executescript(f"""
+            DROP TABLE {STATE_TABLE};
+            DROP TRIGGER IF EXISTS leaderboard_activity_deleted;
+            DROP TRIGGER IF EXISTS leaderboard_galleries_changed;
+            DROP TRIGGER IF EXISTS leaderboard_galleries_added;
+            """)
+    db.executescript(SCHEMA)
+
+
+def _apply(db: sqlite3.Connection, period, sign, where, params):
+    """Add (sign=1) or remove (sign=-1) the activity rows matching `where`.
+
+    Every row counts towards the "all" gallery and each gallery its
+    deviation belongs to.
+    """
+    for table, key in BOARDS:
+        db.execute(
+            f"""
+            WITH delta AS (
+                SELECT deviationid, userid
+                FROM {DeviationActivity.table_name}
+                WHERE {where}
+            ), scoped AS (
+                SELECT 'all' AS gallery, deviationid, userid FROM delta
+                UNION ALL
+                SELECT gallery.value->>'folderid', delta.deviationid, delta.userid
+                FROM delta
+                JOIN {DeviationMetadata.table_name} USING (deviationid),
+                    json_each({DeviationMetadata.table_name}.galleries) AS gallery
+            )
+            INSERT INTO {table} (period, gallery, {key}, favorites)
+            SELECT ?, gallery, {key}, ? * count(*) FROM scoped WHERE true
+            GROUP BY gallery, {key}
+            ON CONFLICT DO UPDATE SET favorites = favorites + excluded.favorites
+            """,
+            (*params, period, sign),
+        )
+
+
+def _rebuild(db: sqlite3.Connection, period, lower, max_created_at):
+    for table, _ in BOARDS:
+        db.execute(f"DELETE FROM {table} WHERE period = ?", (period,))
+    _apply(
+        db,
+        period,
+        1,
+        "(created_at <= ? OR created_at IS NULL) AND time >= ?",
+        (max_created_at, lower),
+    )
+
+
+def refresh_leaderboards(db: sqlite3.Connection, now=None):
+    """Bring every window up to date with deviation_activity.
+
+    Adds rows inserted since the last refresh and subtracts rows that have
+    aged out of each window, so a refresh costs about as much as the new and
+    expired activity rather than a full aggregation. Windows without state
+    (or invalidated by a delete) are rebuilt. The caller commits.
+    """
+    create_schema(db)
+    now = int(now or time.time())
+    # created_at is stamped by the single writer, so later rows sort after it
+    max_created_at = db.execute(
+        f"SELECT coalesce(max(created_at), '') FROM {DeviationActivity.table_name}"
+    ).fetchone()[0]
+
+    for period, seconds in WINDOWS.items():
+        lower = now - seconds if seconds else 0
+        state = db.execute(
+            f"SELECT last_created_at, lower_bound FROM {STATE_TABLE} WHERE period = ?",
+            (period,),
+        ).fetchone()
+
+        if state is None or state[0] is None or state[0] > max_created_at:
+            logger.info(f"Rebuilding {period} leaderboards")
+            _rebuild(db, period, lower, max_created_at)
+        else:
+            last_created_at, old_lower = state
+            _apply(
+                db,
+                period,
+                1,
+                "created_at > ? AND created_at <= ? AND time >= ?",
+                (last_created_at, max_created_at, lower),
+            )
+            if lower > old_lower:
+                _apply(
+                    db,
+                    period,
+                    -1,
+                    "(created_at <= ? OR created_at IS NULL) "
+                    "AND time >= ? AND time < ?",
+                    (last_created_at, old_lower, lower),
+                )
+            for table, _ in BOARDS:
+                db.execute(
+                    f"DELETE FROM {table} WHERE period = ? AND favorites <= 0",
+                    (period,),
+                )
+
+        db.execute(
+            f"INSERT OR REPLACE INTO {STATE_TABLE} VALUES (?, ?, ?, ?)",
+            (period, max_created_at, lower, now),
+        )
+
+
+def is_ready(conn: sqlite3.Connection, period):
+    """True if `period` has been materialized and isn't waiting for a rebuild."""
+    try:
+        row = conn.execute(
+            f"SELECT last_created_at FROM {STATE_TABLE} WHERE period = ?", (period,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return False
+    return row is not None and row[0] is not None
+
+
+def top_deviations(conn: sqlite3.Connection, period, gallery="all", limit=10):
+    cursor = conn.execute(
+        """
+        SELECT l.deviationid, d.title, d.url, d.published_time, l.favorites
+        FROM leaderboard_deviations l
+        JOIN deviations d USING (deviationid)
+        WHERE l.period = ? AND l.gallery = ?
+        ORDER BY l.favorites DESC, d.published_time
+        LIMIT ?
+        """,
+        (period, gallery or "all", int(limit)),
+    )
+    columns = [col[0].lower() for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def top_fans(conn: sqlite3.Connection, period, gallery="all", limit=10):
+    cursor = conn.execute(
+        """
+        SELECT l.userid, u.username, u.usericon, l.favorites
+        FROM leaderboard_fans l
+        JOIN users u USING (userid)
+        WHERE l.period = ? AND l.gallery = ?
+        ORDER BY l.favorites DESC
+        LIMIT ?
+        """,
+        (period, gallery or "all", int(limit)),
+    )
+    columns = [col[0].lower() for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
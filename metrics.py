@@ -0,0 +1,281 @@
+import re
+import time
+import bisect
+import sqlite3
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("slow_queries")
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Queries slower than this are logged with their EXPLAIN QUERY PLAN
+SLOW_QUERY_SECONDS = 0.25
+
+# Recent slow queries kept for /api/slow-queries
+SLOW_QUERY_LOG_SIZE = 100
+
+HELP = {
+    "http_request_duration_seconds": ("histogram", "Request latency by endpoint"),
+    "http_requests_total": ("counter", "Requests by endpoint and status"),
+    "sql_query_duration_seconds": ("histogram", "SQLite execute + fetch time"),
+    "sql_query_rows_total": ("counter", "Rows returned (or changed) by query"),
+    "sql_slow_queries_total": ("counter", "Queries over the slow query threshold"),
+    "read_pool_connections": ("gauge", "Read pool connection counts"),
+    "read_pool_requests_total": ("counter", "Read pool checkouts by outcome"),
+    "response_cache_requests_total": ("counter", "Response cache lookups by outcome"),
+    "response_cache_entries": ("gauge", "Responses held in the cache"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Registry:
+    """In-process metrics rendered in the Prometheus text format.
+
+    Each process (e.g. every gunicorn worker) keeps its own registry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._values = {}
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            key = (name, tuple(labels))
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            key = (name, tuple(labels))
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self._values[(name, tuple(labels))] = value
+
+    def render(self):
+        lines = []
+        with self._lock:
+            series = {}
+            for (name, labels), hist in self._histograms.items():
+                series.setdefault(name, []).append((labels, hist))
+            for (name, labels), value in self._values.items():
+                series.setdefault(name, []).append((labels, value))
+
+            for name in sorted(series):
+                kind, help_text = HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series[name], key=lambda s: s[0]):
+                    if not isinstance(value, Histogram):
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+                        continue
+
+                    cumulative = 0
+                    for bound, count in zip(value.buckets, value.counts):
+                        cumulative += count
+                        le = _format_labels(labels, [("le", bound)])
+                        lines.append(f"{name}_bucket{le} {cumulative}")
+                    le = _format_labels(labels, [("le", "+Inf")])
+                    lines.append(f"{name}_bucket{le} {value.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+
+def observe_request(endpoint, method, status, seconds):
+    registry.observe(
+        "http_request_duration_seconds",
+        [("endpoint", endpoint), ("method", method)],
+        seconds,
+    )
+    registry.inc(
+        "http_requests_total",
+        [("endpoint", endpoint), ("method", method), ("status", status)],
+    )
+
+
+def normalize_sql(sql):
+    """Collapse literals and whitespace so one query shape is one series."""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?, ...)", sql)
+    return " ".join(sql.split())[:200]
+
+
+def explain(conn, sql, params):
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return []
+    try:
+        # A plain cursor, so the plan lookup isn't traced itself
+        cursor = sqlite3.Cursor(conn)
+        rows = cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        return [row[-1] for row in rows]
+    except sqlite3.Error as e:
+        return [f"EXPLAIN failed: {e}"]
+
+
+def record_query(conn, sql, params, seconds, rows):
+    if sql.lstrip().upper().startswith("PRAGMA"):
+        return
+
+    labels = [("query", normalize_sql(sql))]
+    registry.observe("sql_query_duration_seconds", labels, seconds)
+    registry.inc("sql_query_rows_total", labels, max(rows, 0))
+
+    if seconds < SLOW_QUERY_SECONDS:
+        return
+
+    registry.inc("sql_slow_queries_total", labels)
+    plan = explain(conn, sql, params)
+    slow_queries.append(
+        {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(seconds, 4),
+            "rows": rows,
+            "sql": " ".join(sql.split()),
+            "plan": plan,
+        }
+    )
+    slow_query_logger.warning(
+        "\n    ".join(
+            [f"Slow query ({seconds:.3f}s, {rows} rows): {' '.join(sql.split())}"]
+            + plan
+        )
+    )
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that times execute plus fetches and counts the rows returned.
+
+    SQLite steps lazily, so a query is recorded once its results are
+    exhausted or the cursor is reused, closed or garbage collected (as after
+    a lone `conn.execute(...).fetchone()`), not when execute returns.
+    """
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._sql, self._params, self._rows = sql, parameters, 0
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed = time.perf_counter() - started
+            if self.description is None:
+                self._rows = self.rowcount
+                self._finish()
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(
+                self.connection, sql, (), time.perf_counter() - started, self.rowcount
+            )
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - started
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._elapsed += time.perf_counter() - started
+            self._finish()
+            raise
+        self._elapsed += time.perf_counter() - started
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        sql, self._sql = self._sql, None
+        try:
+            record_query(self.connection, sql, self._params, self._elapsed, self._rows)
+        except Exception as e:
+            logger.error(f"Error recording query metrics: {e}")
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors report to the metrics registry."""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -2,6 +2,7 @@ from dataclasses import dataclass, field, fields
 from typing import (
     Any,
     Dict,
+    Iterator,
     List,
     Optional,
     Union,
@@ -11,15 +12,20 @@ from typing import (
     Literal,
 )
 import uuid
+import hashlib
 import logging
 import sqlite3
+from collections import Counter, namedtuple
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 
-
 logger = logging.getLogger(__name__)
 
+# (table_name, "inserted" | "updated" | "skipped") -> count, recorded by
+# BaseModel.insert
+write_stats = Counter()
+
 
 class Select:
     def __init__(self, model: Union["BaseModel", str], columns="*"):
@@ -142,6 +148,7 @@ def get_sql_type(field_type: Any) -> str:
         BaseModel: "JSONB",  # Nested dataclasses map to STRUCT
         uuid.UUID: "UUID",
         datetime: "TIMESTAMP",
+        bytes: "BLOB",
     }
 
     origin = get_origin(field_type)
@@ -171,6 +178,21 @@ def get_sql_type(field_type: Any) -> str:
     return type_mapping.get(field_type, "TEXT")
 
 
+def is_json_type(field_type: Any) -> bool:
+    """True for fields that convert_type stores as JSON text."""
+    origin = get_origin(field_type)
+    args = get_args(field_type)
+    if origin is Union and type(None) in args:
+        field_type = next(t for t in args if t != type(None))
+        origin = get_origin(field_type)
+
+    return (
+        field_type in (dict, list)
+        or origin in (dict, list)
+        or hasattr(field_type, "__dataclass_fields__")
+    )
+
+
 def convert_type(value: Any) -> Any:
     if isinstance(value, BaseModel):
         return json.dumps(value.to_dict(), cls=BaseModelEncoder)
@@ -181,6 +203,42 @@ def convert_type(value: Any) -> Any:
     return value
 
 
+def to_epoch(value: Any) -> Optional[int]:
+    """Convert an ISO string, datetime or number into integer unix seconds."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            value = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+    return int(value.timestamp())
+
+
+def end_epoch(value: Any) -> Optional[int]:
+    """Exclusive upper bound (unix seconds) for an inclusive end date or time.
+
+    A date without a time part (or at midnight, as the date filters parse
+    to) covers that whole day.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) + 1
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return to_epoch(value) + 1
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    if value.time() == datetime.min.time():
+        return to_epoch(value + timedelta(days=1))
+    return to_epoch(value) + 1
+
+
 class BaseModelEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
@@ -190,10 +248,23 @@ class BaseModelEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+class ContentEncoder(BaseModelEncoder):
+    """Serializes only API-sourced fields, so bookkeeping columns
+    (created_at, updated_at, row_hash) don't affect content hashes."""
+
+    def default(self, obj):
+        if isinstance(obj, BaseModel):
+            return {f.name: getattr(obj, f.name) for f in fields(obj) if f.init}
+        if isinstance(obj, bytes):
+            return hashlib.sha1(obj).hexdigest()
+        return super().default(obj)
+
+
 @dataclass
 class BaseModel:
 
     table_name: str = field(init=False, default="")
+    indexes = []
 
     def __post_init__(self):
         if not self.table_name:
@@ -225,13 +296,10 @@ class BaseModel:
     @classmethod
     def from_json(cls, data: Dict[str, Any]) -> "BaseModel":
         type_hints = get_type_hints(cls)
+        init_fields = {f.name for f in fields(cls) if f.init}
         init_args = {}
         for field_name, field_type in type_hints.items():
-            if (
-                field_name == "table_name"
-                or field_name == "created_at"
-                or field_name == "updated_at"
-            ):
+            if field_name not in init_fields:
                 continue
             value = data.get(field_name)
 
@@ -259,22 +327,84 @@ class BaseModel:
 
         return cls(**init_args)
 
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "BaseModel":
+        """Build a model from a stored row, decoding its JSON columns."""
+        data = dict(row)
+        for f in fields(cls):
+            value = data.get(f.name)
+            if isinstance(value, str) and is_json_type(f.type):
+                try:
+                    data[f.name] = json.loads(value)
+                except ValueError:
+                    pass
+        return cls.from_json(data)
+
     @classmethod
     def select(
         cls, conn, where: str = "", offset=None, limit=None
     ) -> List["BaseModel"]:
+        query = Select(cls, "*")
+        if where:
+            query = query.where(where)
+        return conn.execute(query.sql(offset, limit)).fetchall()
+
+    @classmethod
+    def stream(
+        cls,
+        conn,
+        where: str = "",
+        params=(),
+        columns: List[str] = None,
+        order_by: str = None,
+        batch_size: int = 500,
+    ) -> Iterator[Any]:
+        """Lazily yield rows in fetchmany batches.
+
+        Without `columns` each row is decoded into a model instance; with a
+        column projection a named tuple of just those columns is yielded.
+        """
+        query = Select(cls, columns or "*")
+        if where:
+            query = query.where(where)
+        if order_by:
+            query = query.order_by(order_by)
+
+        cursor = conn.execute(query.sql(), params)
+        names = [col[0] for col in cursor.description]
+        row_type = namedtuple(f"{cls.__name__}Row", names, rename=True)
+
+        while rows := cursor.fetchmany(batch_size):
+            for row in rows:
+                if columns:
+                    yield row_type(*row)
+                else:
+                    yield cls.from_row(zip(names, row))
 
-        return conn.execute(Select(cls, "*").where(where).sql(offset, limit)).fetchall()
+    @classmethod
+    def exists(cls, conn, *key) -> bool:
+        """Primary key lookup without loading the row."""
+        where = " AND ".join(f"{col} = ?" for col in cls.pk())
+        query = Select(cls, "1").where(where)
+        return conn.execute(query.sql(limit=1), key).fetchone() is not None
 
     def insert(
         self,
         conn: sqlite3.Connection,
         *,
-        conflict_mode: Literal["ignore", "replace"] = None,
+        conflict_mode: Literal["ignore", "replace", "fill"] = None,
         allow_nulls: List[str] = None,
+        keep: List[str] = None,
     ) -> sqlite3.Cursor:
+        """Insert the row; `conflict_mode` decides what happens to an existing one.
+
+        "replace" overwrites it, "fill" only sets its columns that are still
+        NULL (e.g. ones added to the model since) and never touches `keep`.
+        """
         if allow_nulls is None:
             allow_nulls = []
+        if keep is None:
+            keep = []
 
         # Convert any BaseModel values to their JSON representation
         non_null_cols = {
@@ -283,6 +413,12 @@ class BaseModel:
             if value is not None or col in allow_nulls
         }
 
+        hashed = "row_hash" in self.columns
+        if hashed:
+            non_null_cols.pop("row_hash", None)
+            self.row_hash = self.content_hash(non_null_cols.keys())
+            non_null_cols["row_hash"] = self.row_hash
+
         non_null_cols["created_at"] = datetime.now().isoformat()
         non_null_cols["updated_at"] = datetime.now().isoformat()
 
@@ -295,10 +431,53 @@ class BaseModel:
             sql = f"INSERT OR IGNORE INTO {self.table_name} ({cols}) VALUES ({values})"
         if conflict_mode == "replace":
             sql = f"INSERT INTO {self.table_name} ({cols}) VALUES ({values}) ON CONFLICT DO UPDATE SET {', '.join(f'{col} = excluded.{col}' for col in non_null_cols.keys() if col != 'created_at' and col not in self.pk())}"
+            if hashed:
+                # Identical payloads leave the row (and updated_at) untouched;
+                # writes outside insert() clear row_hash so this can't skip them
+                sql += f" WHERE {self.table_name}.row_hash IS NOT excluded.row_hash"
+            # created_at is never overwritten, so it tells inserts from updates
+            sql += " RETURNING created_at"
+        if conflict_mode == "fill":
+            fill = [
+                col
+                for col in non_null_cols.keys()
+                if col not in ("created_at", "updated_at", "row_hash")
+                and col not in self.pk()
+                and col not in keep
+            ]
+            sql = f"INSERT INTO {self.table_name} ({cols}) VALUES ({values}) ON CONFLICT DO "
+            if fill:
+                sql += f"UPDATE SET {', '.join(f'{col} = coalesce({self.table_name}.{col}, excluded.{col})' for col in fill)}, updated_at = excluded.updated_at"
+                if hashed:
+                    sql += ", row_hash = NULL"
+                # Rows with nothing left to fill are skipped
+                sql += f" WHERE {' OR '.join(f'({self.table_name}.{col} IS NULL AND excluded.{col} IS NOT NULL)' for col in fill)}"
+            else:
+                sql += "NOTHING"
+            sql += " RETURNING created_at"
 
         logger.debug(sql)
 
-        return conn.execute(f"{sql};", non_null_cols)
+        cursor = conn.execute(f"{sql};", non_null_cols)
+        if conflict_mode in ("replace", "fill"):
+            returned = cursor.fetchall()
+            if not returned:
+                outcome = "skipped"
+            elif returned[0][0] == non_null_cols["created_at"]:
+                outcome = "inserted"
+            else:
+                outcome = "updated"
+        else:
+            outcome = "inserted" if cursor.rowcount > 0 else "skipped"
+        write_stats[(self.table_name, outcome)] += 1
+        return cursor
+
+    def content_hash(self, columns) -> str:
+        """Hash of the given columns' values, used to skip no-op upserts."""
+        init_fields = {f.name for f in fields(self) if f.init}
+        content = {col: getattr(self, col) for col in columns if col in init_fields}
+        payload = json.dumps(content, sort_keys=True, cls=ContentEncoder)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
 
     def update(self, conn, cols=None) -> str:
         if not cols:
@@ -309,6 +488,9 @@ class BaseModel:
             for col, value in self.to_dict().items()
             if col not in self.pk() and col in cols
         }
+        if "row_hash" in self.columns:
+            # The row no longer matches a hashed payload
+            columns["row_hash"] = None
 
         pk = {col: getattr(self, col) for col in self.pk()}
 
@@ -372,6 +554,14 @@ class BaseModel:
             f"CREATE TABLE IF NOT EXISTS {cls.table_name} (\n    {columns_clause}\n);"
         )
 
+    @classmethod
+    def create_index_sql(cls) -> List[str]:
+        return [
+            f"CREATE INDEX IF NOT EXISTS idx_{cls.table_name}_{'_'.join(columns)} "
+            f"ON {cls.table_name} ({', '.join(columns)});"
+            for columns in cls.indexes
+        ]
+
     def __str__(self) -> str:
         field_values = ", ".join(
             f"{f.name}={repr(getattr(self, f.name))}"
@@ -452,6 +642,7 @@ class User(BaseModel):
 
     created_at: datetime = field(init=False, default_factory=datetime.now)
     updated_at: datetime = field(init=False, default_factory=datetime.now)
+    row_hash: Optional[str] = field(init=False, default=None)
 
     @classmethod
     def pk(self) -> str:
@@ -461,6 +652,7 @@ class User(BaseModel):
 @dataclass
 class Deviation(BaseModel):
     table_name = "deviations"
+    indexes = [("published_epoch", "deviationid")]
 
     deviationid: uuid.UUID = field(metadata={"primary_key": True})
     printid: Optional[str]
@@ -496,11 +688,23 @@ class Deviation(BaseModel):
 
     created_at: datetime = field(init=False, default_factory=datetime.now)
     updated_at: datetime = field(init=False, default_factory=datetime.now)
+    row_hash: Optional[str] = field(init=False, default=None)
+
+    # Integer copy of published_time (a string of unix seconds) for range scans
+    published_epoch: Optional[int] = field(default=None)
+
+    def __post_init__(self):
+        if self.published_epoch is None and self.published_time:
+            try:
+                self.published_epoch = int(self.published_time)
+            except ValueError:
+                logger.warning(f"Unparseable published_time: {self.published_time}")
 
 
 @dataclass
 class DeviationActivity(BaseModel):
     table_name = "deviation_activity"
+    indexes = [("time",), ("created_at",)]
 
     deviationid: uuid.UUID = field(
         metadata={"primary_key": True, "foreign_key": Deviation}
@@ -553,6 +757,7 @@ class Collection(BaseModel):
 
     created_at: datetime = field(init=False, default_factory=datetime.now)
     updated_at: datetime = field(init=False, default_factory=datetime.now)
+    row_hash: Optional[str] = field(init=False, default=None)
 
 
 @dataclass
@@ -564,6 +769,7 @@ class Gallery(BaseModel):
 
     created_at: datetime = field(init=False, default_factory=datetime.now)
     updated_at: datetime = field(init=False, default_factory=datetime.now)
+    row_hash: Optional[str] = field(init=False, default=None)
 
 
 @dataclass
@@ -593,11 +799,63 @@ class DeviationMetadata(BaseModel):
 
     created_at: datetime = field(init=False, default_factory=datetime.now)
     updated_at: datetime = field(init=False, default_factory=datetime.now)
+    row_hash: Optional[str] = field(init=False, default=None)
+
+
+@dataclass
+class RawPayload(BaseModel):
+    table_name = "raw_payloads"
+
+    kind: str = field(metadata={"primary_key": True})
+    entity_id: str = field(metadata={"primary_key": True})
+    encoding: str
+    payload: bytes
+
+    created_at: datetime = field(init=False, default_factory=datetime.now)
+    updated_at: datetime = field(init=False, default_factory=datetime.now)
+    row_hash: Optional[str] = field(init=False, default=None)
+
+
+@dataclass
+class PopulateRun(BaseModel):
+    """One stage of one populate run (stage "total" covers the whole run)."""
+
+    table_name = "populate_runs"
+    indexes = [("started_at",)]
+
+    run_id: str = field(metadata={"primary_key": True})
+    stage: str = field(metadata={"primary_key": True})
+    started_at: int
+    finished_at: Optional[int] = None
+    status: str = "running"
+    error: Optional[str] = None
+
+    api_requests: int = 0
+    api_bytes: int = 0
+    api_429: int = 0
+    api_errors: int = 0
+    # endpoint -> {"requests": n, "bytes": n, "429": n, "errors": n}
+    api_calls: Optional[Dict[str, Any]] = None
+
+    rows_inserted: int = 0
+    rows_updated: int = 0
+    rows_skipped: int = 0
+    # table -> {"inserted": n, "updated": n, "skipped": n}
+    rows: Optional[Dict[str, Any]] = None
+
+    created_at: datetime = field(init=False, default_factory=datetime.now)
+    updated_at: datetime = field(init=False, default_factory=datetime.now)
 
 
 @dataclass
 class Message(BaseModel):
     table_name = "messages"
+    indexes = [
+        ("epoch",),
+        ("day",),
+        ("deviationid", "epoch"),
+        ("created_at", "messageid"),
+    ]
 
     messageid: uuid.UUID = field(metadata={"primary_key": True})
     type: str
@@ -618,10 +876,19 @@ class Message(BaseModel):
 
     created_at: datetime = field(init=False, default_factory=datetime.now)
     updated_at: datetime = field(init=False, default_factory=datetime.now)
+    row_hash: Optional[str] = field(init=False, default=None)
 
     deviationid: Optional[uuid.UUID] = field(metadata={"foreign_key": Deviation})
 
+    # Integer copies of ts (unix seconds and days since epoch) for range scans
+    epoch: Optional[int] = field(default=None)
+    day: Optional[int] = field(default=None)
+
     def __post_init__(self):
         self.deviationid = (self.subject.get("deviation", {}).get("deviationid")) or (
             self.deviation and self.deviation.deviationid
         )
+        if self.epoch is None:
+            self.epoch = to_epoch(self.ts)
+        if self.epoch is not None:
+            self.day = self.epoch // 86400
@@ -0,0 +1,152 @@
+import time
+import sqlite3
+import logging
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+QUEUE_TABLE = "refresh_requests"
+
+# What can be refreshed on demand, and what `target` holds for each
+KINDS = {
+    "metadata": "deviationid",
+    "whofaved": "deviationid",
+    "stack": "stackid",
+}
+
+DEFAULT_PRIORITY = 10
+
+# Requests claimed per pass of the ingest worker
+CLAIM_LIMIT = 50
+
+# A "running" request older than this (seconds) is assumed to belong to a
+# worker that died, and is claimed again
+STALE_AFTER = 30 * 60
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {QUEUE_TABLE} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind VARCHAR,
+    target VARCHAR,
+    priority INTEGER,
+    status VARCHAR,
+    error VARCHAR,
+    requested_at BIGINT,
+    started_at BIGINT,
+    finished_at BIGINT
+);
+CREATE INDEX IF NOT EXISTS idx_{QUEUE_TABLE}_pending
+    ON {QUEUE_TABLE} (status, priority, id);
+CREATE INDEX IF NOT EXISTS idx_{QUEUE_TABLE}_target
+    ON {QUEUE_TABLE} (kind, target, status);
+"""
+
+
+def create_schema(conn: sqlite3.Connection):
+    conn.executescript(SCHEMA)
+
+
+def enqueue(db_path, kind, targets, priority=DEFAULT_PRIORITY):
+    """Queue refreshes of `targets`; returns one request id per target.
+
+    A target that is already queued keeps its request (raised to the higher
+    priority) instead of being queued twice.
+
+    Writes straight to the database instead of through the writer lock: an
+    ingest run holds that lock for the whole run, which a dashboard request
+    can't wait out. SQLite still serializes this short transaction against
+    the writer's batches (up to the busy timeout), it only touches the queue
+    table, and no cached response reads the queue, so there's no data
+    generation to bump.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown refresh kind: {kind}")
+
+    now = int(time.time())
+    ids = []
+    conn = storage.connect(db_path)
+    try:
+        create_schema(conn)
+        for target in targets:
+            row = conn.execute(
+                f"UPDATE {QUEUE_TABLE} SET priority = max(priority, ?) "
+                "WHERE kind = ? AND target = ? AND status = 'queued' RETURNING id",
+                (priority, kind, str(target)),
+            ).fetchone()
+            if row is None:
+                row = conn.execute(
+                    f"INSERT INTO {QUEUE_TABLE} "
+                    "(kind, target, priority, status, requested_at) "
+                    "VALUES (?, ?, ?, 'queued', ?) RETURNING id",
+                    (kind, str(target), priority, now),
+                ).fetchone()
+            ids.append(row[0])
+        conn.commit()
+    finally:
+        conn.close()
+
+    logger.info(f"Queued {kind} refresh for {len(ids)} targets")
+    return ids
+
+
+def pending(db_path):
+    """Number of requests waiting for a worker (through the read pool)."""
+    try:
+        with storage.read_connection(db_path) as conn:
+            return conn.execute(
+                f"SELECT count(*) FROM {QUEUE_TABLE} WHERE status = 'queued' "
+                "OR (status = 'running' AND started_at < ?)",
+                (int(time.time()) - STALE_AFTER,),
+            ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+def claim(conn: sqlite3.Connection, limit=CLAIM_LIMIT):
+    """Mark the highest priority requests running; [(id, kind, target)].
+
+    Commits, so pollers see the requests as running straight away.
+    """
+    create_schema(conn)
+    now = int(time.time())
+    rows = conn.execute(
+        f"""
+        UPDATE {QUEUE_TABLE} SET status = 'running', started_at = ?
+        WHERE id IN (
+            SELECT id FROM {QUEUE_TABLE}
+            WHERE status = 'queued' OR (status = 'running' AND started_at < ?)
+            ORDER BY priority DESC, id
+            LIMIT ?
+        )
+        RETURNING id, kind, target, priority
+        """,
+        (now, now - STALE_AFTER, int(limit)),
+    ).fetchall()
+    conn.commit()
+
+    # RETURNING doesn't keep the subquery's order
+    rows.sort(key=lambda row: (-row[3], row[0]))
+    return [(id, kind, target) for id, kind, target, _ in rows]
+
+
+def finish(conn: sqlite3.Connection, request_id, error=None):
+    conn.execute(
+        f"UPDATE {QUEUE_TABLE} SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+        ("error" if error else "done", error, int(time.time()), request_id),
+    )
+
+
+def get_requests(conn: sqlite3.Connection, ids=None, limit=50):
+    """Requests by id, or the most recent ones, newest first."""
+    query = f"SELECT * FROM {QUEUE_TABLE}"
+    params = []
+    if ids:
+        query += f" WHERE id IN ({', '.join('?' for _ in ids)})"
+        params.extend(int(i) for i in ids)
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(int(limit))
+
+    cursor = conn.execute(query, params)
+    columns = [col[0].lower() for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -2,6 +2,8 @@ import os
 import sqlite3
 import shutil
 
+from models import Deviation
+
 
 def move_thumbs_to_subfolders(db_path, thumbs_dir, dryrun, destination):
     """
@@ -11,23 +13,16 @@ def move_thumbs_to_subfolders(db_path, thumbs_dir, dryrun, destination):
         print("No SQLite database path provided")
         return
 
-    # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Get all deviation IDs
-    cursor.execute("SELECT deviationid FROM deviations")
-    deviation_ids = [row[0] for row in cursor.fetchall()]
-
-    conn.close()
-
     thumbs_dir = "thumbs"
     if not os.path.exists(thumbs_dir):
         print(f"Thumbs directory '{thumbs_dir}' does not exist")
         return
 
+    # Connect to SQLite database
+    conn = sqlite3.connect(db_path)
+
     # Process each deviation ID
-    for dev_id in deviation_ids:
+    for (dev_id,) in Deviation.stream(conn, columns=["deviationid"]):
         filename = f"{dev_id}.jpg"
         src_path = os.path.join(thumbs_dir, filename)
         if not os.path.exists(src_path):
@@ -44,6 +39,8 @@ def move_thumbs_to_subfolders(db_path, thumbs_dir, dryrun, destination):
             except Exception as e:
                 print(f"Error moving {src_path}: {e}")
 
+    conn.close()
+
 
 if __name__ == "__main__":
     import argparse
@@ -1,12 +1,32 @@
+import base64
+import json
 import sqlite3
 from models import *
 from datetime import datetime, timedelta
 from da import DeviantArt
+from timeseries import TARGET_POINTS, activity_series
+import leaderboards
+import refresh
+import storage
 
 
 def top_by_activity(
-    da: DeviantArt, start_time=None, end_time=None, limit=10, gallery="all"
+    da: DeviantArt,
+    start_time=None,
+    end_time=None,
+    limit=10,
+    gallery="all",
+    window=None,
 ):
+    """Top deviations by favourites.
+
+    `window` (one of leaderboards.WINDOWS) reads the precomputed leaderboard
+    when it's available; otherwise the start/end range is aggregated live.
+    """
+    if window in leaderboards.WINDOWS:
+        with storage.read_connection(da.sqlite_db) as conn:
+            if leaderboards.is_ready(conn, window):
+                return leaderboards.top_deviations(conn, window, gallery, limit)
 
     # Connect to the database
     query = Select(
@@ -46,22 +66,32 @@ def top_by_activity(
             .order_by("count(*) desc, deviations.published_time")
         )
         if start_time:
-            query = query.where(f"timestamp >= '{start_time}'")
+            query = query.where(f"time >= {to_epoch(start_time)}")
         if end_time:
-            query = query.where(f"timestamp <= '{end_time}'")
+            query = query.where(f"time < {end_epoch(end_time)}")
     else:
         query = query.order_by(
             "cast(deviations.stats->'favourites' as int) desc, deviations.published_time"
         )
 
-    with sqlite3.connect(da.sqlite_db) as conn:
+    with storage.read_connection(da.sqlite_db) as conn:
         cursor = conn.cursor()
         cursor.execute(query.sql(limit=limit))
         columns = [col[0].lower() for col in cursor.description]
         return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 
-def get_user_data(da: DeviantArt, start_time, end_time, limit=10, gallery="all"):
+def get_user_data(
+    da: DeviantArt, start_time, end_time, limit=10, gallery="all", window=None
+):
+    """Top fans by favourites; see top_by_activity for `window`."""
+    if not window and not start_time and not end_time:
+        window = "all"
+
+    if window in leaderboards.WINDOWS:
+        with storage.read_connection(da.sqlite_db) as conn:
+            if leaderboards.is_ready(conn, window):
+                return leaderboards.top_fans(conn, window, gallery, limit)
 
     # Connect to the database
     query = (
@@ -78,89 +108,37 @@ def get_user_data(da: DeviantArt, start_time, end_time, limit=10, gallery="all")
         query = query.where(f"gallery.value->>'folderid' = '{gallery}'")
 
     if start_time:
-        query = query.where(f"timestamp >= '{start_time}'")
+        query = query.where(f"time >= {to_epoch(start_time)}")
     if end_time:
-        query = query.where(f"timestamp <= '{end_time}'")
+        query = query.where(f"time < {end_epoch(end_time)}")
 
-    with sqlite3.connect(da.sqlite_db) as conn:
+    with storage.read_connection(da.sqlite_db) as conn:
         cursor = conn.cursor()
         cursor.execute(query.sql(limit=limit))
         columns = [col[0].lower() for col in cursor.description]
         return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 
-def calculate_grouping_minutes(start_date, end_date, max_groups=100):
-    """Calculates the number of minutes for grouping, expanding as the date range increases."""
-    if not end_date:
-        end_date = datetime.now(tz=start_date.tzinfo)
-    return 1440
+def get_deviation_activity(
+    da: DeviantArt, deviationid, start_date, end_date, points=TARGET_POINTS
+):
+    return get_deviation_activity_bulk(da, [deviationid], start_date, end_date, points)[
+        deviationid
+    ]
 
-    diff_minutes = int((end_date - start_date).total_seconds() / 60)
-
-    if diff_minutes <= 1440 * 3:  # 3 days
-        return 15
-    elif diff_minutes <= 10080:  # 1 week
-        return 60
-    elif diff_minutes <= 43200:  # 1 month
-        return 60 * 6
-    else:
-        return 60 * 24
 
+def get_deviation_activity_bulk(
+    da: DeviantArt, deviationids, start_date, end_date, points=TARGET_POINTS
+):
+    """Sparkline series for many deviations from one query.
 
-def get_deviation_activity(da: DeviantArt, deviationid, start_date, end_date):
-    grouping_minutes = calculate_grouping_minutes(start_date, end_date)
-    query = f"""
-        WITH grouped_data AS (
-            SELECT substr(ts, 1, 10) as time_bucket,
-                COUNT(*) AS count
-            FROM
-                {Message.table_name}
-            WHERE
-                ts >= :start_date
-                AND ts <= :end_date
-                AND deviationid = :deviationid
-            GROUP BY
-                time_bucket
-        ),
-        time_series AS (
-            -- Base case: start with the first timestamp
-            SELECT
-                (CAST(strftime('%s', :start_date) AS integer) /(:grouping_minutes * 60)) *(:grouping_minutes * 60) AS time_bucket
-            UNION ALL
-            -- Recursive case: add grouping_minutes until we reach end_date
-            SELECT
-                time_bucket +(:grouping_minutes * 60)
-            FROM
-                time_series
-            WHERE
-                time_bucket < CAST(strftime('%s', :end_date) AS integer)
-                -- SQLite has a recursion limit of 1000 by default
-            LIMIT 10000)
-        -- Step 3: Join the time series with the grouped data
-        SELECT
-            datetime(ts.time_bucket, 'unixepoch') AS timestamp,
-            COALESCE(gd.count, 0) AS count
-        FROM
-            time_series ts
-            LEFT JOIN grouped_data gd ON ts.time_bucket = gd.time_bucket
-        ORDER BY
-            ts.time_bucket
-        """
-
-    with sqlite3.connect(da.sqlite_db) as conn:
-        logger.debug(query)
-        cursor = conn.cursor()
-        cursor.execute(
-            query,
-            {
-                "grouping_minutes": grouping_minutes,
-                "start_date": start_date,
-                "end_date": end_date,
-                "deviationid": deviationid,
-            },
+    Returns {deviationid: [{"timestamp": ..., "count": ...}, ...]}; the
+    bucket width adapts to the date range (see timeseries.choose_resolution).
+    """
+    with storage.read_connection(da.sqlite_db) as conn:
+        return activity_series(
+            conn, Message.table_name, deviationids, start_date, end_date, points
         )
-        columns = [col[0].lower() for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 
 def get_publication_data(da: DeviantArt, start_date, end_date, gallery="all"):
@@ -178,30 +156,34 @@ def get_publication_data(da: DeviantArt, start_date, end_date, gallery="all"):
 
     query = f"""
     with deviationas as (
-        SELECT date(published_time, 'unixepoch') as date, COUNT(distinct deviationid) as count 
+        SELECT published_epoch / 86400 as day, COUNT(distinct deviationid) as count
         FROM deviations
         {gallery_join if gallery else ''}
-        WHERE date(published_time, 'unixepoch') >= '{start_date}' AND date(published_time, 'unixepoch') <= '{end_date}'
+        WHERE published_epoch >= :start_epoch AND published_epoch < :end_epoch
         {" and " +gallery_where if gallery else ''}
         GROUP BY 1
         ORDER BY 1
     ), activity as (
-        SELECT substr(ts, 1, 10) as date, COUNT(distinct deviationid) as count
+        SELECT day, COUNT(distinct deviationid) as count
         FROM messages
         {gallery_join if gallery else ''}
-        WHERE ts >= '{start_date}' AND ts <= '{end_date}'
+        WHERE epoch >= :start_epoch AND epoch < :end_epoch
         {" and " +gallery_where if gallery else ''}
         GROUP BY 1
         ORDER BY 1
     )
-    SELECT coalesce(activity.date, deviationas.date) as date, coalesce(deviationas.count, 0) as deviations, coalesce(activity.count, 0) as favorites
+    SELECT date(coalesce(activity.day, deviationas.day) * 86400, 'unixepoch') as date, coalesce(deviationas.count, 0) as deviations, coalesce(activity.count, 0) as favorites
     FROM activity
-    FULL OUTER JOIN deviationas ON activity.date = deviationas.date
+    FULL OUTER JOIN deviationas ON activity.day = deviationas.day
+    ORDER BY 1
     """
-    print(query)
-    with sqlite3.connect(da.sqlite_db) as conn:
+    logger.debug(query)
+    with storage.read_connection(da.sqlite_db) as conn:
         cursor = conn.cursor()
-        cursor.execute(query)
+        cursor.execute(
+            query,
+            {"start_epoch": to_epoch(start_date), "end_epoch": end_epoch(end_date)},
+        )
         columns = [col[0].lower() for col in cursor.description]
         return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
@@ -214,7 +196,7 @@ def get_gallery_data(da: DeviantArt):
         GROUP BY folderid, name
         ORDER BY count(*) DESC
     """
-    with sqlite3.connect(da.sqlite_db) as conn:
+    with storage.read_connection(da.sqlite_db) as conn:
         logger.debug(query)
         cursor = conn.cursor()
         cursor.execute(query)
@@ -222,41 +204,194 @@ def get_gallery_data(da: DeviantArt):
         return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 
-def get_deviation_data(da: DeviantArt, tags=None, gallery=None, limit=100, offset=0):
-    """Get deviations filtered by tags and galleries.
+def latest_activity_id(da: DeviantArt):
+    """Cursor at the newest message; live clients start after it."""
+    with storage.read_connection(da.sqlite_db) as conn:
+        row = conn.execute(
+            f"SELECT created_at, messageid FROM {Message.table_name} "
+            "ORDER BY created_at DESC, messageid DESC LIMIT 1"
+        ).fetchone()
+    return encode_cursor(*row) if row else encode_cursor("", "")
+
+
+def get_new_activity(da: DeviantArt, after_id, limit=500):
+    """Messages inserted after the cursor `after_id`, oldest first.
+
+    Keyed on (created_at, messageid): created_at is stamped when the writer
+    applies a batch under the writer lock and never overwritten, so it
+    orders commits, and unlike rowid it survives a VACUUM. Each row's "id"
+    is the cursor to resume after it.
+    """
+    created_at, messageid = decode_cursor(after_id)
+    query = f"""
+        SELECT m.created_at, m.messageid, m.deviationid, m.type, m.epoch,
+            m.originator->>'userid' as userid,
+            m.originator->>'username' as username,
+            m.originator->>'usericon' as usericon,
+            (
+                SELECT json_group_array(gallery.value->>'folderid')
+                FROM deviation_metadata dm, json_each(dm.galleries) gallery
+                WHERE dm.deviationid = m.deviationid
+            ) as galleries
+        FROM {Message.table_name} m
+        WHERE (m.created_at, m.messageid) > (?, ?)
+        ORDER BY m.created_at, m.messageid
+        LIMIT ?
+    """
+    with storage.read_connection(da.sqlite_db) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (created_at, messageid, limit))
+        columns = [col[0].lower() for col in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    for row in rows:
+        row["id"] = encode_cursor(row.pop("created_at"), row["messageid"])
+        row["galleries"] = json.loads(row["galleries"] or "[]")
+    return rows
+
+
+def get_populate_runs(da: DeviantArt, limit=50, stage=None):
+    """Most recent populate run ledger rows, newest first."""
+    query = Select(PopulateRun).order_by("started_at desc", "stage")
+    params = []
+    if stage:
+        query = query.where("stage = ?")
+        params.append(stage)
+
+    with storage.read_connection(da.sqlite_db) as conn:
+        try:
+            cursor = conn.execute(query.sql(limit=int(limit)), params)
+        except sqlite3.OperationalError:
+            # No populate has run since the ledger was added
+            return []
+        columns = [col[0].lower() for col in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    for row in rows:
+        row["api_calls"] = json.loads(row["api_calls"] or "{}")
+        row["rows"] = json.loads(row["rows"] or "{}")
+    return rows
+
+
+def get_ingest_schedule(da: DeviantArt):
+    """Interval and next run time of each ingest schedule (see ingest.py)."""
+    with storage.read_connection(da.sqlite_db) as conn:
+        try:
+            cursor = conn.execute("SELECT * FROM ingest_schedule ORDER BY next_run")
+        except sqlite3.OperationalError:
+            # The scheduler hasn't run against this database yet
+            return []
+        columns = [col[0].lower() for col in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    now = datetime.now().timestamp()
+    for row in rows:
+        row["stages"] = json.loads(row["stages"])
+        row["next_run_in"] = max(0, round(row["next_run"] - now))
+    return rows
+
+
+def get_refresh_requests(da: DeviantArt, ids=None, limit=50):
+    """On-demand refresh requests by id (or the latest ones) for polling."""
+    with storage.read_connection(da.sqlite_db) as conn:
+        try:
+            return refresh.get_requests(conn, ids, limit)
+        except sqlite3.OperationalError:
+            # Nothing has been queued against this database yet
+            return []
+
+
+def encode_cursor(key, tiebreak):
+    """Opaque keyset cursor for the deviations browser and live activity."""
+    raw = json.dumps([key, tiebreak]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        key, tiebreak = json.loads(base64.urlsafe_b64decode(cursor))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return key, tiebreak
+
+
+def get_deviation_data(da: DeviantArt, tags=None, gallery=None, limit=100, cursor=None):
+    """Get deviations filtered by tags and galleries, newest first.
+
+    Pages with a keyset on (published_epoch, deviationid) so deep pages cost
+    the same as the first one. Deviations without a published time come
+    last.
 
     Args:
         da: DeviantArt instance
         tags: List of tags to filter by
-        galleries: List of gallery folder IDs to filter by
+        gallery: Gallery folder ID to filter by
         limit: Maximum number of results to return
+        cursor: next_cursor from the previous page
+
+    Returns:
+        (rows, next_cursor); next_cursor is None on the last page
     """
     if gallery == "all":
         gallery = None
 
     query = """
-        SELECT DISTINCT d.*, json_group_array(json_object('folderid', g.folderid, 'name', g.name)) as galleries
+        SELECT d.*, (
+            SELECT json_group_array(json_object('folderid', g.folderid, 'name', g.name))
+            FROM deviation_metadata dm, json_each(dm.galleries) gallery_json
+            JOIN galleries g ON g.folderid = gallery_json.value->>'folderid'
+            WHERE dm.deviationid = d.deviationid
+        ) as galleries
         FROM deviations d
-        LEFT JOIN deviation_metadata dm USING (deviationid)
-        LEFT JOIN json_each(dm.galleries) gallery_json
-        LEFT JOIN galleries g ON g.folderid = gallery_json.value->>'folderid'
     """
 
     where_clauses = ["d.is_deleted = 0"]
+    params = []
     if tags:
-        tags_list = [f"'%{tag}%'" for tag in tags]
-        where_clauses.append(f"dm.tags LIKE ANY ({','.join(tags_list)})")
+        where_clauses.append(
+            "EXISTS (SELECT 1 FROM deviation_metadata dm WHERE dm.deviationid = d.deviationid AND ("
+            + " OR ".join("dm.tags LIKE ?" for _ in tags)
+            + "))"
+        )
+        params.extend(f"%{tag}%" for tag in tags)
 
     if gallery:
-        where_clauses.append(f"g.folderid = '{gallery}'")
-
-    if where_clauses:
-        query += f" WHERE {' AND '.join(where_clauses)}"
+        where_clauses.append(
+            """EXISTS (SELECT 1 FROM deviation_metadata dm, json_each(dm.galleries) gallery_json
+            WHERE dm.deviationid = d.deviationid AND gallery_json.value->>'folderid' = ?)"""
+        )
+        params.append(gallery)
+
+    if cursor:
+        published_epoch, deviationid = decode_cursor(cursor)
+        if published_epoch is None:
+            where_clauses.append("d.published_epoch IS NULL AND d.deviationid < ?")
+            params.append(deviationid)
+        else:
+            try:
+                published_epoch = int(published_epoch)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid cursor: {cursor}") from e
+            # NULLs sort last, and compare as NULL (not true) in a row value
+            where_clauses.append(
+                "((d.published_epoch, d.deviationid) < (?, ?) "
+                "OR d.published_epoch IS NULL)"
+            )
+            params.extend([published_epoch, deviationid])
 
-    query += f" GROUP BY d.deviationid order by d.published_time desc LIMIT {limit} OFFSET {offset}"
+    query += f" WHERE {' AND '.join(where_clauses)}"
+    query += " ORDER BY d.published_epoch DESC, d.deviationid DESC LIMIT ?"
+    params.append(int(limit))
 
-    with sqlite3.connect(da.sqlite_db) as conn:
+    with storage.read_connection(da.sqlite_db) as conn:
         cursor = conn.cursor()
-        cursor.execute(query)
+        cursor.execute(query, params)
         columns = [col[0].lower() for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    next_cursor = None
+    if len(rows) == int(limit):
+        next_cursor = encode_cursor(
+            rows[-1]["published_epoch"], rows[-1]["deviationid"]
+        )
+    return rows, next_cursor
@@ -1,6 +1,5 @@
 // Chart initialization and update functions
-function updatePublicationChart() {
-  // Show loading spinner while fetching data
+function showPublicationLoading() {
   const existingChart = Chart.getChart("publicationChart");
   if (existingChart) {
     existingChart.destroy();
@@ -17,125 +16,118 @@ function updatePublicationChart() {
   ctx.clearRect(0, 0, ctx.canvas.width, ctx.canvas.height);
   ctx.fillText("Loading...", ctx.canvas.width / 2, ctx.canvas.height / 2);
   ctx.restore();
+}
 
+function renderPublicationChart(rows) {
   const startDate = document.getElementById("startDate").value;
   const endDate = document.getElementById("endDate").value;
-  const gallery = document.getElementById("gallerySelect").value;
-
-  const queryParams = new URLSearchParams({
-    start_date: startDate,
-    end_date: endDate,
-    gallery: gallery,
-  }).toString();
-
-  fetch(`/get-publication-data?${queryParams}`)
-    .then((response) => response.json())
-    .then((data) => {
-      console.log(data);
-      // Fill in any missing dates with 0 counts
-      const firstDate = startDate
-        ? new Date(startDate)
-        : new Date(data.data[0].date);
-      const lastDate = endDate
-        ? new Date(endDate)
-        : new Date(data.data[data.data.length - 1].date);
-      const filledData = [];
-
-      let currentDate = new Date(firstDate);
-      while (currentDate <= lastDate) {
-        const existingData = data.data.find(
-          (d) => new Date(d.date).toDateString() === currentDate.toDateString()
-        );
-
-        filledData.push({
-          date: currentDate.toISOString().split("T")[0],
-          count: existingData ? existingData.deviations : 0,
-          favorites: existingData ? existingData.favorites : 0,
-        });
+  const data = { data: rows };
+
+  if (!rows.length && !(startDate && endDate)) return;
+
+  // Fill in any missing dates with 0 counts
+  const firstDate = startDate
+    ? new Date(startDate)
+    : new Date(data.data[0].date);
+  const lastDate = endDate
+    ? new Date(endDate)
+    : new Date(data.data[data.data.length - 1].date);
+  const filledData = [];
+
+  let currentDate = new Date(firstDate);
+  while (currentDate <= lastDate) {
+    const existingData = data.data.find(
+      (d) => new Date(d.date).toDateString() === currentDate.toDateString()
+    );
+
+    filledData.push({
+      date: currentDate.toISOString().split("T")[0],
+      count: existingData ? existingData.deviations : 0,
+      favorites: existingData ? existingData.favorites : 0,
+    });
 
-        currentDate.setDate(currentDate.getDate() + 1);
-      }
+    currentDate.setDate(currentDate.getDate() + 1);
+  }
 
-      data.data = filledData;
-
-      // Create new chart with zoom plugin
-      const chart = new Chart("publicationChart", {
-        type: "bar",
-        plugins: [
-          {
-            id: "dragSelect",
-            afterInit: function (chart) {
-              let dragStart = null;
-              let dragging = false;
-
-              chart.canvas.addEventListener("mousedown", (e) => {
-                const rect = chart.canvas.getBoundingClientRect();
-                dragStart = {
-                  x: e.clientX - rect.left,
-                  y: e.clientY - rect.top,
-                };
-                dragging = true;
-              });
-
-              chart.canvas.addEventListener("mousemove", (e) => {
-                if (!dragging) return;
-
-                const rect = chart.canvas.getBoundingClientRect();
-                const x = e.clientX - rect.left;
-
-                // Get dates from x coordinates
-                const xScale = chart.scales.x;
-                const startIndex = xScale.getValueForPixel(
-                  Math.min(dragStart.x, x)
-                );
-                const endIndex = xScale.getValueForPixel(
-                  Math.max(dragStart.x, x)
-                );
-
-                const startDate =
-                  data.data[Math.max(0, Math.floor(startIndex))].date;
-                const endDate =
-                  data.data[Math.min(data.data.length - 1, Math.ceil(endIndex))]
-                    .date;
-
-                // Update date inputs
-                document.getElementById("startDate").value = startDate;
-                document.getElementById("endDate").value = endDate;
-              });
-
-              document.addEventListener("mouseup", () => {
-                if (dragging) {
-                  dragging = false;
-                  updateAll();
-                }
-              });
-            },
-          },
-        ],
-        data: {
-          labels: data.data.map((d) => new Date(d.date).toLocaleDateString()),
-          datasets: [
-            {
-              label: "Number of Deviations",
-              data: data.data.map((d) => d.count),
-              backgroundColor: "rgba(54, 162, 235, 0.5)",
-              borderColor: "rgba(54, 162, 235, 1)",
-            },
-            {
-              label: "Number of Favorites",
-              data: data.data.map((d) => d.favorites),
-              backgroundColor: "rgba(255, 159, 64, 0.5)",
-              borderColor: "rgba(255, 159, 64, 1)",
-            },
-          ],
+  data.data = filledData;
+
+  // Create new chart with zoom plugin
+  const chart = new Chart("publicationChart", {
+    type: "bar",
+    plugins: [
+      {
+        id: "dragSelect",
+        afterInit: function (chart) {
+          let dragStart = null;
+          let dragging = false;
+
+          chart.canvas.addEventListener("mousedown", (e) => {
+            const rect = chart.canvas.getBoundingClientRect();
+            dragStart = {
+              x: e.clientX - rect.left,
+              y: e.clientY - rect.top,
+            };
+            dragging = true;
+          });
+
+          chart.canvas.addEventListener("mousemove", (e) => {
+            if (!dragging) return;
+
+            const rect = chart.canvas.getBoundingClientRect();
+            const x = e.clientX - rect.left;
+
+            // Get dates from x coordinates
+            const xScale = chart.scales.x;
+            const startIndex = xScale.getValueForPixel(
+              Math.min(dragStart.x, x)
+            );
+            const endIndex = xScale.getValueForPixel(
+              Math.max(dragStart.x, x)
+            );
+
+            const startDate =
+              data.data[Math.max(0, Math.floor(startIndex))].date;
+            const endDate =
+              data.data[Math.min(data.data.length - 1, Math.ceil(endIndex))]
+                .date;
+
+            // Update date inputs
+            document.getElementById("startDate").value = startDate;
+            document.getElementById("endDate").value = endDate;
+          });
+
+          document.addEventListener("mouseup", () => {
+            if (dragging) {
+              dragging = false;
+              updateAll();
+            }
+          });
         },
-        options: {
-          responsive: true,
-          maintainAspectRatio: false,
-          scales: { y: { beginAtZero: true } },
+      },
+    ],
+    data: {
+      labels: data.data.map((d) => new Date(d.date).toLocaleDateString()),
+      datasets: [
+        {
+          label: "Number of Deviations",
+          data: data.data.map((d) => d.count),
+          backgroundColor: "rgba(54, 162, 235, 0.5)",
+          borderColor: "rgba(54, 162, 235, 1)",
         },
-      });
-    });
+        {
+          label: "Number of Favorites",
+          data: data.data.map((d) => d.favorites),
+          backgroundColor: "rgba(255, 159, 64, 0.5)",
+          borderColor: "rgba(255, 159, 64, 1)",
+        },
+      ],
+    },
+    options: {
+      responsive: true,
+      maintainAspectRatio: false,
+      scales: { y: { beginAtZero: true } },
+    },
+  });
 }
 
 // Table sorting functionality
@@ -205,10 +197,9 @@ function sortTable(n) {
 }
 
 // Function to update the table
-function updateTable() {
+function showTableLoading() {
   const startDate = document.getElementById("startDate").value;
   const endDate = document.getElementById("endDate").value;
-  const limit = document.getElementById("limitSelect").value;
   const gallery = document.getElementById("gallerySelect").value;
   const selectedGallery =
     document.getElementById("gallerySelect").options[
@@ -239,153 +230,203 @@ function updateTable() {
       </td>
     </tr>
   `;
+}
+
+function updateTable() {
+  showTableLoading();
+
+  const startDate = document.getElementById("startDate").value;
+  const endDate = document.getElementById("endDate").value;
+  const limit = document.getElementById("limitSelect").value;
+  const gallery = document.getElementById("gallerySelect").value;
 
   const queryParams = new URLSearchParams({
     start_date: startDate,
     end_date: endDate,
     limit: limit,
     gallery: gallery,
+    window: document.getElementById("windowSelect").value,
   }).toString();
 
   fetch(`/update-table?${queryParams}`)
     .then((response) => response.json())
-    .then((data) => {
-      const header = document.getElementById("deviationTableHeader");
-      header.innerHTML = "";
-      if (!startDate && !endDate) {
-        header.innerHTML = `
-          <tr>
-            <th></th>
-            <th class="sortable" onclick="sortTable(1)">Title</th>
-            <th class="sortable" onclick="sortTable(2)">Favorites</th>
-            <th class="sortable" onclick="sortTable(3)">Views</th>
-            <th class="sortable" onclick="sortTable(4)">Comments</th>
-            <th class="sortable" onclick="sortTable(5)">Downloads</th>
-          </tr>
-        `;
-      } else {
-        header.innerHTML = `
-          <tr>
-            <th></th>
-            <th class="sortable" onclick="sortTable(1)">Title</th>
-            <th class="sortable" onclick="sortTable(2)">Favorites</th>
-            <th></th>
-          </tr>
-        `;
-      }
+    .then((data) => renderTable(data.data));
+}
 
-      const table = document.getElementById("deviationTable");
-      table.innerHTML = "";
-
-      data.data.forEach((row) => {
-        const tr = document.createElement("tr");
-
-        if (!startDate && !endDate) {
-          tr.innerHTML = `
-            <td><img src="/thumbs/${row.deviationid}" alt="thumbnail" style="width: 50px;"></td>
-            <td><a class="deviation-link" href="${row.url}" target="_blank">${row.title}</a></td>
-            <td>${row.favorites}</td>
-            <td>${row.views}</td>
-            <td>${row.comments}</td>
-            <td>${row.downloads}</td>
-          `;
-          table.appendChild(tr);
-        } else {
-          tr.innerHTML = `
-            <td><img src="/thumbs/${row.deviationid}" alt="Thumbnail" style="width: 50px;"></td>
-            <td><a href="${row.url}" target="_blank">${row.title}</a></td>
-            <td>${row.favorites}</td>
-            <td id="sparkline-${row.deviationid}"></td>
-          `;
-          table.appendChild(tr);
-          getSparklineData(
-            row.deviationid,
-            document.getElementById(`sparkline-${row.deviationid}`)
-          );
-        }
-      });
+// Render the top deviations; sparklines are fetched unless already provided
+function renderTable(rows, sparklines) {
+  const startDate = document.getElementById("startDate").value;
+  const endDate = document.getElementById("endDate").value;
+
+  const header = document.getElementById("deviationTableHeader");
+  header.innerHTML = "";
+  if (!startDate && !endDate) {
+    header.innerHTML = `
+      <tr>
+        <th></th>
+        <th class="sortable" onclick="sortTable(1)">Title</th>
+        <th class="sortable" onclick="sortTable(2)">Favorites</th>
+        <th class="sortable" onclick="sortTable(3)">Views</th>
+        <th class="sortable" onclick="sortTable(4)">Comments</th>
+        <th class="sortable" onclick="sortTable(5)">Downloads</th>
+        <th></th>
+      </tr>
+    `;
+  } else {
+    header.innerHTML = `
+      <tr>
+        <th></th>
+        <th class="sortable" onclick="sortTable(1)">Title</th>
+        <th class="sortable" onclick="sortTable(2)">Favorites</th>
+        <th></th>
+      </tr>
+    `;
+  }
+
+  const table = document.getElementById("deviationTable");
+  table.innerHTML = "";
+  const sparklineIds = [];
+
+  rows.forEach((row) => {
+    const tr = document.createElement("tr");
+    tr.dataset.deviationid = row.deviationid;
+
+    if (!startDate && !endDate) {
+      tr.innerHTML = `
+        <td><img src="/thumbs/${row.deviationid}?size=64" alt="thumbnail" style="width: 50px;"></td>
+        <td><a class="deviation-link" href="${row.url}" target="_blank">${row.title}</a></td>
+        <td class="favorites">${row.favorites}</td>
+        <td>${row.views}</td>
+        <td>${row.comments}</td>
+        <td>${row.downloads}</td>
+        <td>
+          <button class="btn btn-sm btn-outline-secondary" title="Fetch fresh stats and favourites now"
+            onclick="requestRefresh('${row.deviationid}', this)">Refresh</button>
+        </td>
+      `;
+      table.appendChild(tr);
+    } else {
+      tr.innerHTML = `
+        <td><img src="/thumbs/${row.deviationid}?size=64" alt="Thumbnail" style="width: 50px;"></td>
+        <td><a href="${row.url}" target="_blank">${row.title}</a></td>
+        <td class="favorites">${row.favorites}</td>
+        <td id="sparkline-${row.deviationid}"></td>
+      `;
+      table.appendChild(tr);
+      sparklineIds.push(row.deviationid);
+    }
+  });
+
+  if (!sparklineIds.length) return;
+  if (sparklines) {
+    sparklineIds.forEach((deviationId) => {
+      const element = document.getElementById(`sparkline-${deviationId}`);
+      if (element && sparklines[deviationId]) {
+        renderSparkline(element, sparklines[deviationId]);
+      }
     });
+  } else {
+    getSparklineData(sparklineIds);
+  }
 }
 
-// Function to fetch and display sparkline data for a deviation
-function getSparklineData(deviationId, element) {
+// Function to fetch sparkline data for all table rows in one request
+function getSparklineData(deviationIds) {
   const startDate = document.getElementById("startDate").value;
   const endDate = document.getElementById("endDate").value;
 
-  fetch("/get-sparkline-data", {
+  fetch("/get-sparkline-data/bulk", {
     method: "POST",
     headers: {
       "Content-Type": "application/json",
     },
     body: JSON.stringify({
-      id: deviationId,
+      ids: deviationIds,
       start_date: startDate,
       end_date: endDate,
+      window: document.getElementById("windowSelect").value,
     }),
   })
     .then((response) => response.json())
     .then((data) => {
       if (data.status === "success") {
-        // Create sparkline using data.data
-        const sparklineData = data.data.map((d) => d.count || 0);
-
-        // Clear any existing content
-        element.innerHTML = "";
-
-        // Create sparkline chart
-        const sparkline = document.createElement("canvas");
-        sparkline.style.width = "100px";
-        element.appendChild(sparkline);
-
-        new Chart(sparkline, {
-          type: "line",
-          data: {
-            labels: data.data.map((d) =>
-              new Date(d.timestamp).toLocaleDateString()
-            ),
-            datasets: [
-              {
-                data: sparklineData,
-                borderColor: "rgba(54, 162, 235, 1)",
-                borderWidth: 1,
-                fill: false,
-                pointRadius: 0,
-                pointHoverRadius: 4,
-                pointHoverBackgroundColor: "rgba(54, 162, 235, 1)",
-                pointHoverBorderColor: "rgba(54, 162, 235, 1)",
-                pointHitRadius: 10,
-              },
-            ],
-          },
-          options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-              legend: {
-                display: false,
-              },
-            },
-            scales: {
-              x: {
-                display: false,
-              },
-              y: {
-                display: false,
-              },
-            },
-          },
+        deviationIds.forEach((deviationId) => {
+          const element = document.getElementById(`sparkline-${deviationId}`);
+          if (element && data.data[deviationId]) {
+            renderSparkline(element, data.data[deviationId]);
+          }
         });
       }
     })
     .catch((error) => {
       console.error("Error fetching sparkline data:", error);
-      element.innerHTML = '<span class="text-danger">Error</span>';
+      deviationIds.forEach((deviationId) => {
+        const element = document.getElementById(`sparkline-${deviationId}`);
+        if (element) {
+          element.innerHTML = '<span class="text-danger">Error</span>';
+        }
+      });
     });
 }
 
+// Function to draw a sparkline from a list of {timestamp, count} points
+function renderSparkline(element, series) {
+  const sparklineData = series.map((d) => d.count || 0);
+
+  // Clear any existing content
+  element.innerHTML = "";
+
+  // Create sparkline chart
+  const sparkline = document.createElement("canvas");
+  sparkline.style.width = "100px";
+  // Bucket start times (epoch seconds), used to place live activity
+  sparkline.bucketEpochs = series.map(
+    (d) => Date.parse(d.timestamp.replace(" ", "T") + "Z") / 1000
+  );
+  element.appendChild(sparkline);
+
+  new Chart(sparkline, {
+    type: "line",
+    data: {
+      labels: series.map((d) =>
+        new Date(d.timestamp.replace(" ", "T") + "Z").toLocaleString()
+      ),
+      datasets: [
+        {
+          data: sparklineData,
+          borderColor: "rgba(54, 162, 235, 1)",
+          borderWidth: 1,
+          fill: false,
+          pointRadius: 0,
+          pointHoverRadius: 4,
+          pointHoverBackgroundColor: "rgba(54, 162, 235, 1)",
+          pointHoverBorderColor: "rgba(54, 162, 235, 1)",
+          pointHitRadius: 10,
+        },
+      ],
+    },
+    options: {
+      responsive: true,
+      maintainAspectRatio: false,
+      plugins: {
+        legend: {
+          display: false,
+        },
+      },
+      scales: {
+        x: {
+          display: false,
+        },
+        y: {
+          display: false,
+        },
+      },
+    },
+  });
+}
+
 // Function to fetch and display top users data
-function topUsers() {
-  // Show loading spinner while fetching data
+function showUsersLoading() {
   document.getElementById("userTable").innerHTML = `
     <tr>
       <td colspan="2" class="text-center">
@@ -395,6 +436,11 @@ function topUsers() {
       </td>
     </tr>
   `;
+}
+
+function topUsers() {
+  // Show loading spinner while fetching data
+  showUsersLoading();
 
   const startDate = document.getElementById("startDate").value;
   const endDate = document.getElementById("endDate").value;
@@ -405,43 +451,270 @@ function topUsers() {
     end_date: endDate,
     limit: limit,
     gallery: gallery,
+    window: document.getElementById("windowSelect").value,
   }).toString();
 
   fetch(`/get-users?${queryParams}`)
     .then((response) => response.json())
     .then((data) => {
       if (data.status === "success") {
-        const userTable = document.getElementById("userTable");
-        userTable.innerHTML = "";
-
-        data.data.forEach((user) => {
-          const row = document.createElement("tr");
-          row.innerHTML = `
-            <td><img src="${user.usericon}" alt="User Icon""></td>
-            <td><a class="user-link" href="https://www.deviantart.com/${user.username}" target="_blank">${user.username}</a></td>
-            <td>${user.favorites}</td>
-          `;
-          userTable.appendChild(row);
-        });
+        renderUsers(data.data);
+      }
+    })
+    .catch(showUsersError);
+}
+
+function renderUsers(users) {
+  const userTable = document.getElementById("userTable");
+  userTable.innerHTML = "";
+
+  users.forEach((user) => {
+    const row = document.createElement("tr");
+    row.dataset.userid = user.userid;
+    row.innerHTML = `
+      <td><img src="${user.usericon}" alt="User Icon""></td>
+      <td><a class="user-link" href="https://www.deviantart.com/${user.username}" target="_blank">${user.username}</a></td>
+      <td class="favorites">${user.favorites}</td>
+    `;
+    userTable.appendChild(row);
+  });
+}
+
+function showUsersError(error) {
+  console.error("Error fetching top users:", error);
+  document.getElementById("userTable").innerHTML = `
+    <tr>
+      <td colspan="2" class="text-center text-danger">
+        Error loading user data
+      </td>
+    </tr>
+  `;
+}
+
+// Live updates: apply favourites pushed over /events without re-querying
+const FAVOURITE_TYPES = ["feedback.favourite", "feedback.collect"];
+
+function matchesFilters(event) {
+  const endDate = document.getElementById("endDate").value;
+  const gallery = document.getElementById("gallerySelect").value;
+
+  if (endDate && event.epoch * 1000 >= new Date(endDate).getTime() + 86400000) {
+    return false;
+  }
+  if (gallery && gallery !== "all" && !event.galleries.includes(gallery)) {
+    return false;
+  }
+  return true;
+}
+
+function incrementCell(cell) {
+  if (!cell) return;
+  cell.textContent = Number(cell.textContent) + 1;
+}
+
+function bumpSparkline(canvas, epoch) {
+  const chart = Chart.getChart(canvas);
+  if (!chart || !canvas.bucketEpochs) return;
+
+  let index = -1;
+  canvas.bucketEpochs.forEach((start, i) => {
+    if (start <= epoch) index = i;
+  });
+  if (index < 0) return;
+
+  chart.data.datasets[0].data[index] += 1;
+  chart.update("none");
+}
+
+function applyActivity(events) {
+  events
+    .filter((e) => FAVOURITE_TYPES.includes(e.type) && matchesFilters(e))
+    .forEach((e) => {
+      const row = document.querySelector(
+        `#deviationTable tr[data-deviationid="${e.deviationid}"]`
+      );
+      if (row) {
+        incrementCell(row.querySelector(".favorites"));
+        const canvas = row.querySelector("canvas");
+        if (canvas) bumpSparkline(canvas, e.epoch);
       }
+
+      const userRow = document.querySelector(
+        `#userTable tr[data-userid="${e.userid}"]`
+      );
+      if (userRow) incrementCell(userRow.querySelector(".favorites"));
+    });
+}
+
+function startLiveUpdates() {
+  if (!window.EventSource) return;
+
+  // The browser reconnects on its own, resuming from the last event id
+  const source = new EventSource("/events");
+  source.addEventListener("activity", (e) => {
+    applyActivity(JSON.parse(e.data));
+  });
+}
+
+// Preset windows are served from precomputed leaderboards; the server
+// replaces the (date-only) start date below with the window's exact start
+const WINDOW_DAYS = { "24h": 1, "7d": 7, "30d": 30 };
+
+function selectWindow() {
+  const period = document.getElementById("windowSelect").value;
+  if (!period) return;
+
+  const start = new Date(Date.now() - WINDOW_DAYS[period] * 86400000);
+  document.getElementById("startDate")._flatpickr.setDate(start, false);
+  document.getElementById("endDate")._flatpickr.clear(false);
+  updateAll();
+}
+
+const REFRESH_POLL_MS = 3000;
+
+// Ask the ingest worker to refresh one deviation ahead of its schedule, then
+// poll the requests until they finish and reload the dashboard
+function requestRefresh(deviationId, button) {
+  button.disabled = true;
+  button.textContent = "Queued";
+
+  fetch("/api/refresh", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      kind: ["metadata", "whofaved"],
+      targets: [deviationId],
+      priority: 100,
+    }),
+  })
+    .then((response) => response.json())
+    .then((data) => {
+      if (data.status !== "success") throw new Error(data.message);
+      pollRefresh(data.data.ids, button);
     })
     .catch((error) => {
-      console.error("Error fetching top users:", error);
-      document.getElementById("userTable").innerHTML = `
-        <tr>
-          <td colspan="2" class="text-center text-danger">
-            Error loading user data
-          </td>
-        </tr>
-      `;
+      console.error("Error requesting refresh:", error);
+      button.disabled = false;
+      button.textContent = "Refresh";
     });
 }
 
-// Main update function
+function pollRefresh(ids, button) {
+  fetch(`/api/refresh?ids=${ids.join(",")}`)
+    .then((response) => response.json())
+    .then((data) => {
+      const requests = data.data || [];
+      if (requests.some((r) => r.status === "queued" || r.status === "running")) {
+        button.textContent = requests.some((r) => r.status === "running")
+          ? "Refreshing"
+          : "Queued";
+        setTimeout(() => pollRefresh(ids, button), REFRESH_POLL_MS);
+        return;
+      }
+
+      const failed = requests.some((r) => r.status === "error");
+      button.textContent = failed ? "Failed" : "Refresh";
+      button.disabled = false;
+      if (!failed) updateAll();
+    })
+    .catch((error) => {
+      console.error("Error polling refresh:", error);
+      setTimeout(() => pollRefresh(ids, button), REFRESH_POLL_MS);
+    });
+}
+
+// Throughput of recent populate runs, from the run ledger
+function updatePopulateRuns() {
+  fetch("/api/populate-runs?stage=total&limit=50")
+    .then((response) => response.json())
+    .then((data) => {
+      const runs = data.data.slice().reverse();
+      const existingChart = Chart.getChart("populateRunsChart");
+      if (existingChart) {
+        existingChart.destroy();
+      }
+
+      new Chart("populateRunsChart", {
+        type: "line",
+        data: {
+          labels: runs.map((r) => new Date(r.started_at * 1000).toLocaleString()),
+          datasets: [
+            {
+              label: "Rows written",
+              data: runs.map((r) => r.rows_inserted + r.rows_updated),
+              borderColor: "rgba(54, 162, 235, 1)",
+              yAxisID: "y",
+            },
+            {
+              label: "API requests",
+              data: runs.map((r) => r.api_requests),
+              borderColor: "rgba(255, 159, 64, 1)",
+              yAxisID: "y",
+            },
+            {
+              label: "Rate limited (429)",
+              data: runs.map((r) => r.api_429),
+              borderColor: "rgba(220, 53, 69, 1)",
+              yAxisID: "y",
+            },
+            {
+              label: "Duration (s)",
+              data: runs.map((r) => (r.finished_at || r.started_at) - r.started_at),
+              borderColor: "rgba(108, 117, 125, 1)",
+              borderDash: [4, 4],
+              yAxisID: "seconds",
+            },
+          ],
+        },
+        options: {
+          responsive: true,
+          scales: {
+            y: { beginAtZero: true },
+            seconds: { beginAtZero: true, position: "right" },
+          },
+        },
+      });
+    })
+    .catch((error) => console.error("Error fetching populate runs:", error));
+}
+
+function populateGalleries(galleries) {
+  const select = document.getElementById("gallerySelect");
+  if (select.options.length > 1) return;
+
+  galleries.forEach((gallery) => {
+    const option = document.createElement("option");
+    option.value = gallery.folderid;
+    option.textContent = gallery.name;
+    select.appendChild(option);
+  });
+}
+
+// Main update function: every section from one /api/dashboard request
 function updateAll() {
-  updatePublicationChart();
-  updateTable();
-  topUsers();
+  showPublicationLoading();
+  showTableLoading();
+  showUsersLoading();
+
+  const queryParams = new URLSearchParams({
+    start_date: document.getElementById("startDate").value,
+    end_date: document.getElementById("endDate").value,
+    gallery: document.getElementById("gallerySelect").value,
+    window: document.getElementById("windowSelect").value,
+    limit: document.getElementById("limitSelect").value,
+    user_limit: document.getElementById("topUserlimitSelect").value,
+  }).toString();
+
+  fetch(`/api/dashboard?${queryParams}`)
+    .then((response) => response.json())
+    .then((data) => {
+      console.debug("Dashboard timings (ms):", data.timings);
+      populateGalleries(data.data.galleries);
+      renderPublicationChart(data.data.publication);
+      renderTable(data.data.table, data.data.sparklines);
+      renderUsers(data.data.users);
+    })
+    .catch((error) => console.error("Error loading dashboard:", error));
 }
 
 // Initialize on page load
@@ -451,6 +724,7 @@ document.addEventListener("DOMContentLoaded", function () {
     enableTime: false,
     dateFormat: "Y-m-d",
     onChange: function (date) {
+      document.getElementById("windowSelect").value = "";
       updateAll();
     },
   });
@@ -459,23 +733,13 @@ document.addEventListener("DOMContentLoaded", function () {
     enableTime: false,
     dateFormat: "Y-m-d",
     onChange: function (date) {
+      document.getElementById("windowSelect").value = "";
       updateAll();
     },
   });
 
-  // Load gallery names
-  fetch("/get-gallery-names")
-    .then((response) => response.json())
-    .then((data) => {
-      const select = document.getElementById("gallerySelect");
-      data.data.forEach((gallery) => {
-        const option = document.createElement("option");
-        option.value = gallery.folderid;
-        option.textContent = gallery.name;
-        select.appendChild(option);
-      });
-    });
-
-  // Initial update
+  // Initial update (also loads the gallery names)
   updateAll();
+  updatePopulateRuns();
+  startLiveUpdates();
 });
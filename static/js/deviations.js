@@ -1,120 +1,98 @@
-// Main update function for deviations page
-function updateAll() {
-  const galleryId = document.getElementById("gallerySelect").value;
-  const startDate = document.getElementById("startDate").value;
-  const endDate = document.getElementById("endDate").value;
-
-  const queryParams = new URLSearchParams({
-    gallery: galleryId,
-    start_date: startDate,
-    end_date: endDate,
-  }).toString();
-
-  let offset = 0;
-  const limit = 100;
-
-  // Add scroll event listener
-  window.addEventListener("scroll", () => {
-    // Check if we're near the bottom
-    if (
-      window.innerHeight + window.scrollY >=
-      document.documentElement.scrollHeight - 100
-    ) {
-      // Increment offset and fetch more
-      offset += limit;
+// Keyset cursor for the next page; null once the last page has loaded
+let nextCursor = null;
+let loadingPage = false;
+const pageSize = 100;
 
-      const scrollQueryParams = new URLSearchParams({
-        gallery: document.getElementById("gallerySelect").value,
-        start_date: document.getElementById("startDate").value,
-        end_date: document.getElementById("endDate").value,
-        offset: offset,
-        limit: limit,
-      }).toString();
+function renderDeviation(deviation) {
+  const deviationElement = document.createElement("div");
+  deviationElement.classList.add("deviation", "grid-item");
+  deviationElement.style.width = "150px";
+  deviationElement.style.margin = "5px";
+  deviationElement.style.position = "relative";
+  deviationElement.innerHTML = `
+    <a href="${deviation.url}" class="deviation-link">
+      <img src="/thumbs/${deviation.deviationid}?size=150" alt="${
+    deviation.title
+  }" title="${deviation.title}" style="width: 100%; height: auto;"/>
+      <div class="deviation-info" style="padding: 8px;">
+        <div style="font-size: 0.8em; color: #666;">
+          <span>❤️ ${JSON.parse(deviation.stats).favourites}</span>
+          <span style="margin-left: 8px;">💬 ${
+            JSON.parse(deviation.stats).comments
+          }</span>
+        </div>
+      </div>
+    </a>
+  `;
+  return deviationElement;
+}
 
-      fetch(`/get-deviations?${scrollQueryParams}`)
-        .then((response) => response.json())
-        .then((data) => {
-          const deviationsContainer = document.getElementById(
-            "deviations-container"
-          );
+// Fetch one page of deviations, starting after `cursor` when given
+function loadDeviations(cursor) {
+  const params = {
+    gallery: document.getElementById("gallerySelect").value,
+    start_date: document.getElementById("startDate").value,
+    end_date: document.getElementById("endDate").value,
+    limit: pageSize,
+  };
+  if (cursor) {
+    params.cursor = cursor;
+  }
 
-          data.data.forEach((deviation) => {
-            const deviationElement = document.createElement("div");
-            deviationElement.classList.add("deviation", "grid-item");
-            deviationElement.style.width = "150px";
-            deviationElement.style.margin = "5px";
-            deviationElement.style.position = "relative";
-            deviationElement.innerHTML = `
-              <a href="${deviation.url}" class="deviation-link">
-                <img src="/thumbs/${deviation.deviationid}" alt="${
-              deviation.title
-            }" title="${deviation.title}" style="width: 100%; height: auto;"/>
-                <div class="deviation-info" style="padding: 8px;">
-                  <div style="font-size: 0.8em; color: #666;">
-                    <span>❤️ ${JSON.parse(deviation.stats).favourites}</span>
-                    <span style="margin-left: 8px;">💬 ${
-                      JSON.parse(deviation.stats).comments
-                    }</span>
-                  </div>
-                </div>
-              </a>
-            `;
-            deviationsContainer.appendChild(deviationElement);
-          });
-        })
-        .catch((error) => {
-          console.error("Error fetching more deviations:", error);
-        });
-    }
-  });
-
-  fetch(`/get-deviations?${queryParams}`)
+  loadingPage = true;
+  return fetch(`/get-deviations?${new URLSearchParams(params).toString()}`)
     .then((response) => response.json())
     .then((data) => {
       const deviationsContainer = document.getElementById(
         "deviations-container"
       );
-      deviationsContainer.innerHTML = "";
+      if (!cursor) {
+        deviationsContainer.innerHTML = "";
+      }
+
+      if (!deviationsContainer.classList.contains("masonry-grid")) {
+        deviationsContainer.classList.add("masonry-grid");
+        deviationsContainer.style.display = "grid";
+        deviationsContainer.style.gridAutoRows = "auto";
+        deviationsContainer.style.alignItems = "start";
+        deviationsContainer.style.gridTemplateColumns =
+          "repeat(auto-fill, minmax(150px, 1fr))";
+        deviationsContainer.style.gridGap = "10px";
+        deviationsContainer.style.justifyItems = "center";
+      }
 
       data.data.forEach((deviation) => {
-        const deviationElement = document.createElement("div");
-        deviationElement.classList.add("deviation", "grid-item");
-        deviationElement.style.width = "150px";
-        deviationElement.style.margin = "5px";
-        deviationElement.style.position = "relative";
-        deviationElement.innerHTML = `
-          <a href="${deviation.url}" class="deviation-link">
-            <img src="/thumbs/${deviation.deviationid}" alt="${
-          deviation.title
-        }" title="${deviation.title}" style="width: 100%; height: auto;"/>
-            <div class="deviation-info" style="padding: 8px;">
-              <div style="font-size: 0.8em; color: #666;">
-                <span>❤️ ${JSON.parse(deviation.stats).favourites}</span>
-                <span style="margin-left: 8px;">💬 ${
-                  JSON.parse(deviation.stats).comments
-                }</span>
-              </div>
-            </div>
-          </a>
-        `;
-        if (!deviationsContainer.classList.contains("masonry-grid")) {
-          deviationsContainer.classList.add("masonry-grid");
-          deviationsContainer.style.display = "grid";
-          deviationsContainer.style.gridAutoRows = "auto";
-          deviationsContainer.style.alignItems = "start";
-          deviationsContainer.style.gridTemplateColumns =
-            "repeat(auto-fill, minmax(150px, 1fr))";
-          deviationsContainer.style.gridGap = "10px";
-          deviationsContainer.style.justifyItems = "center";
-        }
-        deviationsContainer.appendChild(deviationElement);
+        deviationsContainer.appendChild(renderDeviation(deviation));
       });
+
+      nextCursor = data.next_cursor;
     })
     .catch((error) => {
       console.error("Error fetching deviations:", error);
+    })
+    .finally(() => {
+      loadingPage = false;
     });
 }
 
+// Main update function for deviations page
+function updateAll() {
+  nextCursor = null;
+  loadDeviations(null);
+}
+
+// Load the next page when scrolled near the bottom
+window.addEventListener("scroll", () => {
+  if (
+    nextCursor &&
+    !loadingPage &&
+    window.innerHeight + window.scrollY >=
+      document.documentElement.scrollHeight - 100
+  ) {
+    loadDeviations(nextCursor);
+  }
+});
+
 // Initialize on page load
 document.addEventListener("DOMContentLoaded", function () {
   // Initialize date pickers
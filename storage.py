@@ -0,0 +1,505 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from contextlib import contextmanager, ExitStack
+from datetime import datetime, timezone
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds a connection waits on a locked database before raising
+BUSY_TIMEOUT = 30
+
+# Long-lived read connections kept per database by read_pool()
+READ_POOL_SIZE = 4
+
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # negative = KiB
+    "temp_store": "MEMORY",
+}
+
+# BatchWriter commits after this many queued writes, or this many seconds
+# after the first write of a batch, whichever comes first
+WRITE_BATCH_SIZE = 1000
+WRITE_BATCH_SECONDS = 1.0
+
+# Queued writes before producers block, so a slow disk applies backpressure
+WRITE_QUEUE_SIZE = 10000
+
+# Record per-query timings of read pool connections (the dashboard's queries)
+# through metrics.TracedConnection; writer connections are never traced
+TRACE_SQL = True
+
+
+class WriterBusy(Exception):
+    pass
+
+
+def connect(
+    db_path, timeout=BUSY_TIMEOUT, readonly=False, **kwargs
+) -> sqlite3.Connection:
+    """Open a connection in WAL mode with a busy timeout and tuned caches.
+
+    WAL lets dashboard readers keep reading while a populate run holds the
+    write lock; writers should go through `writer()` or `BatchWriter` so only
+    one process writes at a time. `readonly` opens the file with mode=ro and
+    query_only.
+    """
+    if readonly:
+        conn = sqlite3.connect(
+            f"file:{db_path}?mode=ro", timeout=timeout, uri=True, **kwargs
+        )
+    else:
+        conn = sqlite3.connect(db_path, timeout=timeout, **kwargs)
+
+    conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    elif conn.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+        conn.execute("PRAGMA journal_mode = WAL")
+    for pragma, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+
+class ReadPool:
+    """Thread-safe pool of long-lived read connections.
+
+    Reusing connections keeps SQLite's page cache and statement cache warm
+    across dashboard requests.
+    """
+
+    def __init__(self, db_path, size=READ_POOL_SIZE, readonly=True):
+        self.db_path = db_path
+        self.size = size
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _open(self):
+        kwargs = {"factory": metrics.TracedConnection} if TRACE_SQL else {}
+        return connect(
+            self.db_path,
+            readonly=self.readonly,
+            check_same_thread=False,
+            cached_statements=256,
+            **kwargs,
+        )
+
+    def _acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                self.misses += 1
+                open_new = True
+            else:
+                open_new = False
+
+        if open_new:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        started = time.monotonic()
+        conn = self._idle.get()
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds += time.monotonic() - started
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses + self.waits
+            return {
+                "db_path": self.db_path,
+                "size": self.size,
+                "open": self._opened,
+                "idle": self._idle.qsize(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "hit_ratio": (self.hits + self.waits) / requests if requests else 0.0,
+            }
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._opened -= 1
+
+
+_read_pools = {}
+_read_pools_lock = threading.Lock()
+
+
+def read_pool(db_path) -> ReadPool:
+    with _read_pools_lock:
+        if db_path not in _read_pools:
+            _read_pools[db_path] = ReadPool(db_path)
+        return _read_pools[db_path]
+
+
+def read_connection(db_path):
+    """Borrow a pooled read-only connection: `with read_connection(p) as conn`"""
+    return read_pool(db_path).connection()
+
+
+def pool_stats():
+    with _read_pools_lock:
+        pools = list(_read_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+GENERATION_TABLE = "data_generation"
+
+
+def bump_generation(conn):
+    """Record that new data is about to be committed on `conn`."""
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {GENERATION_TABLE} "
+        "(id INTEGER PRIMARY KEY CHECK (id = 1), generation BIGINT, updated_at TIMESTAMP)"
+    )
+    conn.execute(
+        f"INSERT INTO {GENERATION_TABLE} VALUES (1, 1, datetime('now')) "
+        "ON CONFLICT DO UPDATE SET generation = generation + 1, updated_at = datetime('now')"
+    )
+
+
+def commit(conn, changes=None):
+    """Commit and bump the data generation so readers drop cached results.
+
+    With `changes` (an earlier conn.total_changes), the generation is only
+    bumped if rows changed since, so batches of skipped upserts keep the
+    response cache warm.
+    """
+    if changes is None or conn.total_changes > changes:
+        bump_generation(conn)
+    conn.commit()
+
+
+def generation_info(db_path):
+    """(generation, updated_at) read through the pool; (0, None) before any commit."""
+    try:
+        with read_connection(db_path) as conn:
+            row = conn.execute(
+                f"SELECT generation, updated_at FROM {GENERATION_TABLE} WHERE id = 1"
+            ).fetchone()
+    except sqlite3.OperationalError:
+        return 0, None
+    if not row:
+        return 0, None
+    return row[0], datetime.fromisoformat(row[1]).replace(tzinfo=timezone.utc)
+
+
+def data_generation(db_path):
+    """Current data generation; 0 before any commit."""
+    return generation_info(db_path)[0]
+
+
+@contextmanager
+def writer_lock(db_path, timeout=None):
+    """Hold an exclusive advisory lock on `{db_path}.lock`.
+
+    Blocks until the lock is free, or raises WriterBusy after `timeout`
+    seconds. A no-op where fcntl is unavailable.
+    """
+    if not fcntl:
+        yield
+        return
+
+    with open(f"{db_path}.lock", "a") as lock_file:
+        started = time.monotonic()
+        while timeout is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() - started > timeout:
+                    raise WriterBusy(f"Another process is writing to {db_path}")
+                time.sleep(1)
+        else:
+            # Without a timeout, wake as soon as the holder releases, so
+            # writers that lock per batch hand the lock over without delay
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        lock_file.truncate(0)
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def writer(db_path, timeout=None):
+    """Single-writer connection: commits on success, rolls back on error."""
+    with writer_lock(db_path, timeout):
+        conn = connect(db_path)
+        try:
+            changes = conn.total_changes
+            yield conn
+            commit(conn, changes)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+class BatchWriter:
+    """Owns the only write connection to a database and batches its writes.
+
+    Producers (any number of threads) queue model upserts and statements;
+    a writer thread applies them in order and commits every
+    WRITE_BATCH_SIZE writes or WRITE_BATCH_SECONDS, so a populate run pays
+    for a few large transactions instead of an fsync per handful of rows.
+    Holds the writer lock from start() to close(), or with hold_lock=False
+    only while writing each batch, so writers in several processes (e.g.
+    parallel crawl shards) can interleave batches. Reads should go through
+    `reader()`, which only sees committed writes; call flush() first when a
+    read depends on earlier writes.
+
+        with storage.BatchWriter(db_path) as writer:
+            writer.upsert(item, conflict_mode="replace")
+    """
+
+    # How a queued write is applied: inside the current batch, inside it and
+    # then committed right away, or alone (for functions that commit themselves)
+    BATCH, FLUSH, EXCLUSIVE, STOP = "batch", "flush", "exclusive", "stop"
+
+    def __init__(
+        self,
+        db_path,
+        batch_size=WRITE_BATCH_SIZE,
+        max_delay=WRITE_BATCH_SECONDS,
+        timeout=None,
+        hold_lock=True,
+    ):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.hold_lock = hold_lock
+        self._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._thread = None
+        self._stack = None
+        self._error = None
+        self._error_lock = threading.Lock()
+
+        self.batches = 0
+        self.writes = 0
+        self.errors = 0
+
+    def start(self):
+        self._stack = ExitStack()
+        if self.hold_lock:
+            self._stack.enter_context(writer_lock(self.db_path, self.timeout))
+        self._thread = threading.Thread(
+            target=self._run, name=f"BatchWriter({self.db_path})", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Commit everything queued, stop the writer thread and free the lock."""
+        if self._thread is None:
+            return
+        self._queue.put((None, None, self.STOP))
+        self._thread.join()
+        self._thread = None
+        self._stack.close()
+        logger.info(
+            f"Wrote {self.writes} changes in {self.batches} transactions "
+            f"({self.errors} failed) to {self.db_path}"
+        )
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _put(self, fn, mode) -> Future:
+        if self._thread is None:
+            raise RuntimeError("BatchWriter is not running")
+        future = Future()
+        self._queue.put((fn, future, mode))
+        return future
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queue `fn(conn, *args, **kwargs)` to run on the write connection.
+
+        The returned future resolves once the batch holding it is committed.
+        """
+        return self._put(lambda conn: fn(conn, *args, **kwargs), self.BATCH)
+
+    def upsert(self, obj, **kwargs) -> Future:
+        """Queue `obj.insert(conn, **kwargs)` for a model instance."""
+        return self.submit(lambda conn: obj.insert(conn, **kwargs) and None)
+
+    def execute(self, sql, params=()) -> Future:
+        """Queue a statement; the future resolves to its rowcount."""
+        return self.submit(lambda conn: conn.execute(sql, params).rowcount)
+
+    def call(self, fn, *args, **kwargs):
+        """Run `fn(conn, ...)` in its own transaction and wait for its result.
+
+        Everything queued before it is committed first. For schema changes
+        and other functions that commit (or executescript) themselves.
+        """
+        fn_call = lambda conn: fn(conn, *args, **kwargs)
+        return self._put(fn_call, self.EXCLUSIVE).result()
+
+    def flush(self):
+        """Wait until every write queued so far is committed.
+
+        Raises the first write error since the previous flush, so producers
+        that don't wait on their futures still see failures.
+        """
+        self._put(lambda conn: None, self.FLUSH).result()
+        with self._error_lock:
+            error, self._error = self._error, None
+        if error:
+            raise error
+
+    def reader(self):
+        """Borrow a pooled read connection to the same database."""
+        return read_connection(self.db_path)
+
+    def _failed(self, error, count=1):
+        self.errors += count
+        with self._error_lock:
+            self._error = self._error or error
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size and batch[-1][2] == self.BATCH:
+            try:
+                batch.append(
+                    self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                )
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = connect(self.db_path)
+        try:
+            while True:
+                batch = self._next_batch()
+                try:
+                    with ExitStack() as stack:
+                        if not self.hold_lock:
+                            stack.enter_context(writer_lock(self.db_path))
+                        self._write(conn, batch)
+                except Exception as e:
+                    logger.error(f"Error writing a batch of {len(batch)}: {e}")
+                    if conn.in_transaction:
+                        conn.rollback()
+                    self._failed(e, len(batch))
+                    for _, future, _ in batch:
+                        if future and not future.done():
+                            future.set_exception(e)
+                if batch[-1][2] == self.STOP:
+                    break
+        finally:
+            conn.close()
+
+    def _write(self, conn, batch):
+        results = []
+        exclusive = None
+        changes = conn.total_changes
+        for fn, future, mode in batch:
+            if mode == self.STOP:
+                continue
+            if mode == self.EXCLUSIVE:
+                exclusive = (fn, future)
+                continue
+
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            conn.execute("SAVEPOINT batch_write")
+            try:
+                results.append((future, fn(conn), None))
+                conn.execute("RELEASE batch_write")
+            except Exception as e:
+                # Undo just this write; the rest of the batch still commits
+                conn.execute("ROLLBACK TO batch_write")
+                conn.execute("RELEASE batch_write")
+                results.append((future, None, e))
+                self._failed(e)
+                logger.error(f"Queued write failed: {e}")
+
+        if results:
+            try:
+                commit(conn, changes)
+            except sqlite3.Error as e:
+                logger.error(f"Error committing {len(results)} writes: {e}")
+                conn.rollback()
+                self._failed(e, len(results))
+                results = [(future, None, error or e) for future, _, error in results]
+            self.batches += 1
+            self.writes += len(results)
+
+        if exclusive:
+            fn, future = exclusive
+            changes = conn.total_changes
+            try:
+                result = fn(conn)
+                commit(conn, changes)
+                results.append((future, result, None))
+            except Exception as e:
+                conn.rollback()
+                results.append((future, None, e))
+            self.batches += 1
+
+        for future, result, error in results:
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,39 @@
+import sqlite3
+
+import pytest
+
+import storage
+
+
+def create_table(conn):
+    conn.execute("CREATE TABLE t (x INTEGER PRIMARY KEY)")
+
+
+def partial_write(conn):
+    conn.execute("INSERT INTO t VALUES (2)")
+    conn.execute("INSERT INTO t VALUES (1)")  # duplicate key
+
+
+def test_failed_write_rolls_back_alone(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    # A long delay keeps every write below in one batch
+    with storage.BatchWriter(db_path, max_delay=60) as writer:
+        writer.call(create_table)
+        first = writer.execute("INSERT INTO t VALUES (1)")
+        failed = writer.submit(partial_write)
+        last = writer.execute("INSERT INTO t VALUES (3)")
+
+        with pytest.raises(sqlite3.IntegrityError):
+            writer.flush()
+        assert first.result() == 1 and last.result() == 1
+        with pytest.raises(sqlite3.IntegrityError):
+            failed.result()
+
+        # The failed write's first insert is undone, the rest committed
+        with writer.reader() as conn:
+            rows = conn.execute("SELECT x FROM t ORDER BY x").fetchall()
+        assert rows == [(1,), (3,)]
+
+        # The error is only raised once
+        writer.flush()
+    assert writer.errors == 1
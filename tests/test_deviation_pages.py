@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+import pytest
+
+import storage
+from da import sync_schema
+from models import Deviation
+from sql import get_deviation_data
+
+PUBLISHED = {
+    "00000000-0000-0000-0000-000000000001": "1700000000",
+    "00000000-0000-0000-0000-000000000002": "999999999",
+    "00000000-0000-0000-0000-000000000003": "1700000000",
+    "00000000-0000-0000-0000-000000000004": None,
+    "00000000-0000-0000-0000-000000000005": None,
+}
+
+
+@pytest.fixture
+def da(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    db = storage.connect(db_path)
+    sync_schema(db)
+    for deviationid, published_time in PUBLISHED.items():
+        Deviation.from_json(
+            {
+                "deviationid": deviationid,
+                "is_deleted": False,
+                "published_time": published_time,
+            }
+        ).insert(db)
+    db.commit()
+    return SimpleNamespace(sqlite_db=db_path)
+
+
+def pages(da, limit):
+    ids, cursor = [], None
+    while True:
+        rows, cursor = get_deviation_data(da, limit=limit, cursor=cursor)
+        ids.extend(row["deviationid"][-1] for row in rows)
+        if not cursor:
+            return ids
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 5])
+def test_pages_cover_every_deviation_in_order(da, limit):
+    # Newest first by integer time (a 9 digit epoch is older), then no time
+    assert pages(da, limit) == ["3", "1", "2", "5", "4"]
+
+
+def test_invalid_cursor(da):
+    with pytest.raises(ValueError):
+        get_deviation_data(da, cursor="not a cursor")
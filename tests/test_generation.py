@@ -0,0 +1,57 @@
+import storage
+from app import create_app
+from da import sync_schema
+from models import Deviation
+
+
+def deviation(title="Title"):
+    return Deviation.from_json(
+        {
+            "deviationid": "00000000-0000-0000-0000-000000000001",
+            "title": title,
+            "is_deleted": False,
+        }
+    )
+
+
+def schema(db_path):
+    with storage.writer(db_path) as db:
+        sync_schema(db)
+
+
+def test_skipped_batches_keep_the_generation(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    schema(db_path)
+
+    with storage.BatchWriter(db_path) as writer:
+        writer.upsert(deviation(), conflict_mode="replace")
+    generation = storage.data_generation(db_path)
+    assert generation > 0
+
+    with storage.BatchWriter(db_path) as writer:
+        writer.upsert(deviation(), conflict_mode="replace")
+    assert storage.data_generation(db_path) == generation
+
+    with storage.BatchWriter(db_path) as writer:
+        writer.upsert(deviation("New title"), conflict_mode="replace")
+    assert storage.data_generation(db_path) > generation
+
+
+def test_etag_revalidates_until_data_changes(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    schema(db_path)
+    client = create_app(sqlitedb=db_path).test_client()
+
+    response = client.get("/get-gallery-names")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+
+    response = client.get("/get-gallery-names", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    with storage.BatchWriter(db_path) as writer:
+        writer.upsert(deviation(), conflict_mode="replace")
+
+    response = client.get("/get-gallery-names", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+import pytest
+
+import ingest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if self.now > 1000.0 + 60:
+            raise StopIteration
+
+
+def test_failing_refresh_backs_off(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ingest, "time", clock)
+    monkeypatch.setattr(ingest.refresh, "pending", lambda db_path: 1)
+    runs = []
+    monkeypatch.setattr(ingest, "run_once", lambda da, stages, *a: runs.append(1) or 1)
+
+    schedule = ingest.Schedule("gallery", ("gallery",), "deviations", 3600, 3600)
+    schedule.next_run = clock.now + 3600
+    da = SimpleNamespace(sqlite_db=str(tmp_path / "test.sqlite"))
+    with pytest.raises(StopIteration):
+        ingest.run_scheduler(da, [schedule])
+
+    # Retried after 5, 10, 20 and 40 seconds rather than on every 5s pass
+    assert len(runs) == 4
@@ -0,0 +1,64 @@
+import time
+from datetime import datetime, timedelta
+
+import leaderboards
+import storage
+from app import parse_filters
+from da import sync_schema
+from models import DeviationActivity
+
+
+def favourite(db, deviationid, userid, now):
+    DeviationActivity(
+        deviationid=deviationid,
+        userid=userid,
+        action="fave",
+        time=now - 60,
+        timestamp=datetime.fromtimestamp(now - 60),
+    ).insert(db, conflict_mode="ignore")
+
+
+def counts(db, period="24h"):
+    return dict(
+        db.execute(
+            "SELECT deviationid, favorites FROM leaderboard_deviations "
+            "WHERE period = ? AND gallery = 'all'",
+            (period,),
+        ).fetchall()
+    )
+
+
+def test_leaderboard_survives_rowid_renumbering(tmp_path):
+    db = storage.connect(str(tmp_path / "test.sqlite"), isolation_level=None)
+    sync_schema(db)
+    now = int(time.time())
+    for userid in ("u1", "u2", "u3"):
+        favourite(db, "d1", userid, now)
+    db.execute("DELETE FROM deviation_activity WHERE userid = 'u1'")
+    leaderboards.refresh_leaderboards(db, now)
+    assert counts(db) == {"d1": 2}
+
+    # VACUUM and schema migrations (which copy the table) may renumber
+    # rowids, so new rows can reuse already-counted ones
+    db.executescript("""
+        PRAGMA legacy_alter_table = ON;
+        CREATE TABLE new_deviation_activity AS SELECT * FROM deviation_activity;
+        DROP TABLE deviation_activity;
+        ALTER TABLE new_deviation_activity RENAME TO deviation_activity;
+        """)
+    favourite(db, "d2", "u4", now)
+    leaderboards.refresh_leaderboards(db, now)
+    assert counts(db) == {"d1": 2, "d2": 1}
+    assert leaderboards.is_ready(db, "24h")
+
+
+def test_preset_window_is_rolling():
+    filters = parse_filters(
+        {"start_date": "2024-01-01", "end_date": "2024-01-02", "window": "24h"}
+    )
+    start = datetime.now() - timedelta(hours=24)
+    assert abs(filters["start_date"] - start) < timedelta(minutes=1)
+    assert filters["end_date"] is None
+
+    filters = parse_filters({"start_date": "2024-01-01", "window": "custom"})
+    assert filters["start_date"] == datetime(2024, 1, 1)
@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+import storage
+from da import sync_schema
+from models import Message
+from sql import get_new_activity, latest_activity_id
+
+
+def message(n):
+    return Message.from_json(
+        {
+            "messageid": f"00000000-0000-0000-0000-00000000000{n}",
+            "type": "feedback.favourite",
+            "orphaned": False,
+            "ts": f"2024-01-0{n}T12:00:00+0000",
+            "is_new": True,
+            "subject": {"deviation": {"deviationid": "d1"}},
+        }
+    )
+
+
+def test_activity_cursor_survives_vacuum(tmp_path):
+    da = SimpleNamespace(sqlite_db=str(tmp_path / "test.sqlite"))
+    db = storage.connect(da.sqlite_db, isolation_level=None)
+    sync_schema(db)
+    for n in (1, 2, 3):
+        message(n).insert(db)
+    start = latest_activity_id(da)
+
+    # Rows removed and VACUUM renumbering what's left
+    db.execute("DELETE FROM messages WHERE messageid LIKE '%1'")
+    db.execute("VACUUM")
+    message(4).insert(db)
+
+    events = get_new_activity(da, start)
+    assert [e["messageid"][-1] for e in events] == ["4"]
+    assert get_new_activity(da, events[-1]["id"]) == []
@@ -0,0 +1,26 @@
+import sqlite3
+
+import metrics
+
+
+def query_count(sql):
+    labels = (("query", metrics.normalize_sql(sql)),)
+    histogram = metrics.registry._histograms.get(("sql_query_duration_seconds", labels))
+    return histogram.count if histogram else 0
+
+
+def test_single_fetchone_is_recorded():
+    conn = sqlite3.connect(":memory:", factory=metrics.TracedConnection)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(1,), (2,)])
+    sql = "SELECT x FROM t ORDER BY x"
+    before = query_count(sql)
+
+    # One row of several, so the cursor is never exhausted
+    assert conn.execute(sql).fetchone() == (1,)
+    assert query_count(sql) == before + 1
+
+    cursor = conn.execute(sql)
+    cursor.fetchone()
+    cursor.close()
+    assert query_count(sql) == before + 2
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import pytest
+
+import da
+import storage
+from da import API_BASE_URL, record_api_call, run_stage, sync_schema
+
+
+def ledger(db_path):
+    db = storage.connect(db_path)
+    try:
+        return db.execute("SELECT stage, status, error FROM populate_runs").fetchall()
+    finally:
+        db.close()
+
+
+def test_stage_is_recorded_while_running(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    with storage.BatchWriter(db_path) as writer:
+        writer.call(sync_schema)
+        with run_stage(writer, "run1", "gallery"):
+            writer.flush()
+            assert ledger(db_path) == [("gallery", "running", None)]
+
+    assert ledger(db_path) == [("gallery", "ok", None)]
+
+
+def test_failed_stage_is_recorded(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    with storage.BatchWriter(db_path) as writer:
+        writer.call(sync_schema)
+        with pytest.raises(RuntimeError):
+            with run_stage(writer, "run1", "feed"):
+                raise RuntimeError("boom")
+
+    assert ledger(db_path) == [("feed", "error", "RuntimeError: boom")]
+
+
+def test_progress_is_reported_while_running(tmp_path, monkeypatch):
+    monkeypatch.setattr(da, "PROGRESS_INTERVAL", 0)
+    db_path = str(tmp_path / "test.sqlite")
+    reports = []
+    page = SimpleNamespace(
+        url=f"{API_BASE_URL}/gallery/all", content=b"{}", status_code=200
+    )
+
+    with storage.BatchWriter(db_path) as writer:
+        writer.call(sync_schema)
+        with run_stage(writer, "run1", "gallery", progress=reports.append):
+            record_api_call(page)
+            record_api_call(page)
+
+    assert [run.api_requests for run in reports] == [1, 2]
+    assert all(run.status == "running" for run in reports)
+    assert not da.api_call_hooks
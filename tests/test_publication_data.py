@@ -0,0 +1,62 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import storage
+from da import sync_schema
+from models import Deviation, DeviationActivity, User
+from sql import get_publication_data, get_user_data, top_by_activity
+
+
+def test_publication_on_end_date_is_counted(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    db = storage.connect(db_path)
+    sync_schema(db)
+    published = datetime(2024, 1, 31, 18, 30)
+    Deviation.from_json(
+        {
+            "deviationid": "00000000-0000-0000-0000-000000000001",
+            "is_deleted": False,
+            "published_time": str(int(published.timestamp())),
+        }
+    ).insert(db)
+    db.commit()
+
+    # The date filters parse "2024-01-31" to midnight
+    data = get_publication_data(
+        SimpleNamespace(sqlite_db=db_path),
+        datetime.fromisoformat("2024-01-01"),
+        datetime.fromisoformat("2024-01-31"),
+    )
+
+    assert sum(row["deviations"] for row in data) == 1
+
+
+def test_activity_on_end_date_is_counted(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    db = storage.connect(db_path)
+    sync_schema(db)
+    faved = datetime(2024, 1, 31, 18, 30)
+    Deviation.from_json(
+        {
+            "deviationid": "00000000-0000-0000-0000-000000000001",
+            "is_deleted": False,
+            "published_time": "1700000000",
+        }
+    ).insert(db)
+    User.from_json(
+        {"userid": "u1", "username": "fan", "usericon": "", "type": "regular"}
+    ).insert(db)
+    DeviationActivity(
+        deviationid="00000000-0000-0000-0000-000000000001",
+        userid="u1",
+        action="fave",
+        time=int(faved.timestamp()),
+        timestamp=faved,
+    ).insert(db)
+    db.commit()
+
+    da = SimpleNamespace(sqlite_db=db_path)
+    start, end = datetime(2024, 1, 1), datetime.fromisoformat("2024-01-31")
+
+    assert [row["favorites"] for row in get_user_data(da, start, end)] == [1]
+    assert [row["favorites"] for row in top_by_activity(da, start, end)] == [1]
@@ -0,0 +1,33 @@
+import pytest
+
+import storage
+from app import create_app
+from da import sync_schema
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    with storage.writer(db_path) as db:
+        sync_schema(db)
+    return create_app(sqlitedb=db_path).test_client()
+
+
+@pytest.mark.parametrize("priority", ["high", None, [1]])
+def test_bad_priority_is_rejected(client, priority):
+    response = client.post(
+        "/api/refresh",
+        json={"kind": "metadata", "targets": ["d1"], "priority": priority},
+    )
+    assert response.status_code == 400
+
+
+def test_refresh_is_queued(client):
+    response = client.post(
+        "/api/refresh", json={"kind": "metadata", "targets": ["d1"], "priority": "5"}
+    )
+    assert response.status_code == 202
+    (request_id,) = response.get_json()["data"]["ids"]
+
+    (queued,) = client.get(f"/api/refresh?ids={request_id}").get_json()["data"]
+    assert (queued["status"], queued["priority"]) == ("queued", 5)
@@ -0,0 +1,92 @@
+import json
+import sqlite3
+
+import storage
+from archive import PayloadArchive
+from da import mark_deleted, reproject_archive, store_metadata, sync_schema
+from models import Deviation, DeviationMetadata
+
+DEVIATIONID = "00000000-0000-0000-0000-000000000001"
+
+
+def deviation_payload(**extra):
+    return {
+        "deviationid": DEVIATIONID,
+        "url": "https://www.deviantart.com/a/art/1",
+        "title": "Old title",
+        "is_deleted": False,
+        "published_time": "1700000000",
+        "stats": {"favourites": 1, "comments": 0},
+        **extra,
+    }
+
+
+class MetadataOnly:
+    """Stands in for DeviantArt in store_metadata."""
+
+    def __init__(self, *items):
+        self.items = items
+
+    def get_metadata(self, deviation_ids):
+        return self.items
+
+
+def crawled_db(tmp_path):
+    """A database whose deviation was stored before `printid` was projected."""
+    db_path = str(tmp_path / "test.sqlite")
+    db = storage.connect(db_path)
+    sync_schema(db)
+    Deviation.from_json(deviation_payload()).insert(db, conflict_mode="replace")
+    PayloadArchive(db).store("deviation", DEVIATIONID, deviation_payload(printid="p1"))
+    db.commit()
+    return db_path, db
+
+
+def row(db):
+    return db.execute(
+        "SELECT printid, title, stats, is_deleted FROM deviations WHERE deviationid = ?",
+        (DEVIATIONID,),
+    ).fetchone()
+
+
+def test_reproject_fills_new_columns(tmp_path):
+    db_path, db = crawled_db(tmp_path)
+    reproject_archive(db)
+
+    printid, title, stats, is_deleted = row(db)
+    assert printid == "p1"
+    assert title == "Old title"
+
+
+def test_reproject_keeps_metadata_refresh(tmp_path):
+    db_path, db = crawled_db(tmp_path)
+    metadata = DeviationMetadata.from_json(
+        {
+            "deviationid": DEVIATIONID,
+            "title": "New title",
+            "stats": {"favourites": 5, "comments": 2},
+            "collections": [],
+            "galleries": [],
+        }
+    )
+    with storage.BatchWriter(db_path) as writer:
+        store_metadata(MetadataOnly(metadata), writer, [DEVIATIONID])
+
+    reproject_archive(db)
+
+    printid, title, stats, is_deleted = row(db)
+    assert printid == "p1"
+    assert title == "New title"
+    assert json.loads(stats)["favourites"] == 5
+
+
+def test_reproject_skips_deleted(tmp_path):
+    db_path, db = crawled_db(tmp_path)
+    with storage.BatchWriter(db_path) as writer:
+        mark_deleted(writer, {"00000000-0000-0000-0000-000000000002"})
+
+    reproject_archive(db)
+
+    printid, title, stats, is_deleted = row(db)
+    assert is_deleted
+    assert printid is None
@@ -0,0 +1,50 @@
+import storage
+from da import mark_deleted, sync_schema
+from models import Deviation, write_stats
+
+DEVIATIONID = "00000000-0000-0000-0000-000000000001"
+
+
+def deviation(**extra):
+    return Deviation.from_json(
+        {
+            "deviationid": DEVIATIONID,
+            "title": "Title",
+            "is_deleted": False,
+            "published_time": "1700000000",
+            **extra,
+        }
+    )
+
+
+def stored(db_path):
+    db = storage.connect(db_path)
+    sync_schema(db)
+    deviation().insert(db, conflict_mode="replace")
+    db.commit()
+    return db
+
+
+def test_identical_payload_is_skipped(tmp_path):
+    db = stored(str(tmp_path / "test.sqlite"))
+    write_stats.clear()
+
+    deviation().insert(db, conflict_mode="replace")
+    deviation(title="New title").insert(db, conflict_mode="replace")
+
+    assert write_stats[("deviations", "skipped")] == 1
+    assert write_stats[("deviations", "updated")] == 1
+    assert db.execute("SELECT title FROM deviations").fetchone()[0] == "New title"
+
+
+def test_identical_payload_undoes_mark_deleted(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    db = stored(db_path)
+    with storage.BatchWriter(db_path) as writer:
+        mark_deleted(writer, {"00000000-0000-0000-0000-000000000002"})
+    assert db.execute("SELECT is_deleted FROM deviations").fetchone()[0] == 1
+
+    # A full crawl that sees the deviation again returns the same payload
+    deviation().insert(db, conflict_mode="replace")
+
+    assert db.execute("SELECT is_deleted FROM deviations").fetchone()[0] == 0
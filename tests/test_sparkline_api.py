@@ -0,0 +1,47 @@
+import pytest
+
+import storage
+from app import create_app
+from da import sync_schema
+from timeseries import MAX_POINTS
+
+DEVIATIONID = "00000000-0000-0000-0000-000000000001"
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    with storage.writer(db_path) as db:
+        sync_schema(db)
+    return create_app(sqlitedb=db_path).test_client()
+
+
+def sparkline(client, points, url="/get-sparkline-data/bulk"):
+    return client.post(
+        url,
+        json={
+            "id": DEVIATIONID,
+            "ids": [DEVIATIONID],
+            "start_date": "2020-01-01",
+            "end_date": "2024-01-01",
+            "points": points,
+        },
+    )
+
+
+@pytest.mark.parametrize("url", ["/get-sparkline-data", "/get-sparkline-data/bulk"])
+@pytest.mark.parametrize("points", ["many", [10], {"n": 1}])
+def test_bad_points_are_rejected(client, url, points):
+    assert sparkline(client, points, url).status_code == 400
+
+
+def test_points_are_clamped(client):
+    response = sparkline(client, 10**9)
+    assert response.status_code == 200
+    (series,) = response.get_json()["data"].values()
+    assert len(series) <= MAX_POINTS + 1
+
+
+def test_dashboard_rejects_bad_points(client):
+    response = client.get("/api/dashboard?start_date=2020-01-01&points=many")
+    assert response.status_code == 400
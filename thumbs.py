@@ -0,0 +1,117 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+file_path = os.path.dirname(os.path.abspath(__file__))
+THUMBS_DIR = os.path.join(file_path, "thumbs")
+
+# Widths (px) of the derivatives generated for every thumbnail
+THUMB_SIZES = (64, 150, 300)
+
+THUMB_FORMAT, THUMB_EXT = (
+    ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+)
+
+
+def original_path(deviation_id, thumbs_dir=THUMBS_DIR):
+    return os.path.join(thumbs_dir, f"{deviation_id}.jpg")
+
+
+def derivative_path(deviation_id, size, thumbs_dir=THUMBS_DIR):
+    return os.path.join(thumbs_dir, str(size), f"{deviation_id}.{THUMB_EXT}")
+
+
+def missing_derivatives(deviation_id, thumbs_dir=THUMBS_DIR):
+    """True if an original exists but some THUMB_SIZES variant doesn't."""
+    return os.path.exists(original_path(deviation_id, thumbs_dir)) and not all(
+        os.path.exists(derivative_path(deviation_id, size, thumbs_dir))
+        for size in THUMB_SIZES
+    )
+
+
+def closest_size(size):
+    """Smallest derivative at least `size` px wide (or the largest one)."""
+    for candidate in THUMB_SIZES:
+        if candidate >= size:
+            return candidate
+    return THUMB_SIZES[-1]
+
+
+def make_derivatives(deviation_id, thumbs_dir=THUMBS_DIR, overwrite=False):
+    """Write every THUMB_SIZES variant of one original thumbnail."""
+    source = original_path(deviation_id, thumbs_dir)
+    written = 0
+    try:
+        with Image.open(source) as img:
+            img = img.convert("RGBA" if THUMB_FORMAT == "WEBP" else "RGB")
+            for size in THUMB_SIZES:
+                target = derivative_path(deviation_id, size, thumbs_dir)
+                if os.path.exists(target) and not overwrite:
+                    continue
+
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                resized = img.copy()
+                if resized.width > size:
+                    height = max(1, round(resized.height * size / resized.width))
+                    resized = resized.resize((size, height), Image.LANCZOS)
+                resized.save(target, THUMB_FORMAT, quality=80)
+                written += 1
+    except Exception as e:
+        logger.error(f"Error creating thumbnails for {deviation_id}: {e}")
+    return written
+
+
+def generate_derivatives(deviation_ids, thumbs_dir=THUMBS_DIR, workers=None):
+    """Create derivatives for many thumbnails in a thread pool.
+
+    Pillow releases the GIL while decoding, resizing and encoding, so threads
+    scale like processes here, and unlike a process pool they also work
+    inside ingest's daemonic populate process.
+    """
+    deviation_ids = list(deviation_ids)
+    if not deviation_ids:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        written = sum(
+            pool.map(
+                make_derivatives,
+                deviation_ids,
+                [thumbs_dir] * len(deviation_ids),
+            )
+        )
+    logger.info(f"Wrote {written} thumbnail derivatives for {len(deviation_ids)} ids")
+    return written
+
+
+def backfill(thumbs_dir=THUMBS_DIR, workers=None):
+    """Generate derivatives for existing originals that are missing any size."""
+    missing = []
+    for filename in os.listdir(thumbs_dir):
+        deviation_id, ext = os.path.splitext(filename)
+        if ext == ".jpg" and missing_derivatives(deviation_id, thumbs_dir):
+            missing.append(deviation_id)
+
+    return generate_derivatives(missing, thumbs_dir, workers)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Generate resized thumbnail derivatives for existing thumbs"
+    )
+    parser.add_argument("--thumbsdir", type=str, default=THUMBS_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    backfill(args.thumbsdir, args.workers)
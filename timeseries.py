@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from models import to_epoch, end_epoch
+
+# Default number of points in an activity series
+TARGET_POINTS = 100
+
+# Most points a client may ask for, which bounds the series' memory use
+MAX_POINTS = 1000
+
+# Candidate bucket widths (pandas frequency, approximate seconds), finest first
+RESOLUTIONS = [
+    ("15min", 15 * 60),
+    ("30min", 30 * 60),
+    ("1h", 60 * 60),
+    ("3h", 3 * 60 * 60),
+    ("6h", 6 * 60 * 60),
+    ("12h", 12 * 60 * 60),
+    ("1D", 24 * 60 * 60),
+    ("7D", 7 * 24 * 60 * 60),
+    ("MS", 30 * 24 * 60 * 60),
+]
+
+
+def choose_resolution(start_epoch, end_epoch, target_points=TARGET_POINTS):
+    """Finest resolution that keeps the series at or under target_points."""
+    span = max(end_epoch - start_epoch, 1)
+    for freq, seconds in RESOLUTIONS:
+        if span / seconds <= target_points:
+            return freq
+    return RESOLUTIONS[-1][0]
+
+
+def bucket_edges(start_epoch, end_epoch, freq) -> pd.DatetimeIndex:
+    """Bucket start times (UTC) covering [start_epoch, end_epoch]."""
+    start = pd.Timestamp(start_epoch, unit="s")
+    end = pd.Timestamp(end_epoch, unit="s")
+    if freq == "MS":
+        first = start.to_period("M").start_time
+    else:
+        first = start.floor(freq)
+    return pd.date_range(first, end, freq=freq)
+
+
+def bucket_counts(keys, epochs, key_order, edges) -> np.ndarray:
+    """Count events per (key, bucket) in one vectorized pass.
+
+    Returns an array of shape (len(key_order), len(edges)); events outside
+    the edges or with unknown keys are dropped.
+    """
+    edge_epochs = ((edges - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy()
+    epochs = np.asarray(epochs, dtype=np.int64)
+
+    bucket = np.searchsorted(edge_epochs, epochs, side="right") - 1
+    codes = pd.Categorical(keys, categories=key_order).codes
+    valid = (bucket >= 0) & (codes >= 0)
+
+    flat = codes[valid].astype(np.int64) * len(edges) + bucket[valid]
+    counts = np.bincount(flat, minlength=len(key_order) * len(edges))
+    return counts.reshape(len(key_order), len(edges))
+
+
+def activity_series(conn, table, deviationids, start_date, end_date, points=None):
+    """Gap-filled event counts per deviation between start_date and end_date.
+
+    Returns {deviationid: [{"timestamp": ..., "count": ...}, ...]}, with the
+    bucket width chosen from the range so each series has about `points`
+    entries (15 minutes up to monthly).
+    """
+    deviationids = list(dict.fromkeys(deviationids))
+    start_epoch = to_epoch(start_date)
+    # Exclusive, so a date-only end date covers its whole day
+    stop_epoch = end_epoch(end_date)
+    freq = choose_resolution(start_epoch, stop_epoch, points or TARGET_POINTS)
+    edges = bucket_edges(start_epoch, stop_epoch - 1, freq)
+
+    placeholders = ", ".join("?" for _ in deviationids)
+    frame = pd.read_sql_query(
+        f"""
+        SELECT deviationid, epoch
+        FROM {table}
+        WHERE deviationid IN ({placeholders})
+            AND epoch >= ?
+            AND epoch < ?
+        """,
+        conn,
+        params=[*deviationids, start_epoch, stop_epoch],
+    )
+
+    counts = bucket_counts(frame["deviationid"], frame["epoch"], deviationids, edges)
+    labels = edges.strftime("%Y-%m-%d %H:%M:%S")
+
+    return {
+        deviationid: [
+            {"timestamp": label, "count": int(count)}
+            for label, count in zip(labels, row)
+        ]
+        for deviationid, row in zip(deviationids, counts)
+    }
@@ -1,16 +1,20 @@
 import sqlite3
 import argparse
-import tempfile
-import os
+import hashlib
 import re
 
 
-def get_table_info(db_path, table_name):
+def get_table_info(db, table_name):
     """
     Get table information using PRAGMA table_info()
     Returns column information and table constraints
+
+    `db` may be a database path or an open sqlite3.Connection.
     """
-    conn = sqlite3.connect(db_path)
+    if isinstance(db, sqlite3.Connection):
+        conn = db
+    else:
+        conn = sqlite3.connect(db)
     cursor = conn.cursor()
 
     # Get column information
@@ -47,7 +51,8 @@ def get_table_info(db_path, table_name):
     else:
         create_stmt = None
 
-    conn.close()
+    if conn is not db:
+        conn.close()
 
     return {
         "columns": columns,
@@ -57,16 +62,13 @@ def get_table_info(db_path, table_name):
     }
 
 
-def create_temp_db_from_sql(sql_statement):
-    """
-    Create a temporary SQLite database from a CREATE TABLE statement
-    and return its path and the table name
-    """
-    # Create a temporary file
-    fd, path = tempfile.mkstemp(suffix=".db")
-    os.close(fd)
+def schema_fingerprint(sql_statement):
+    """Stable hash of a schema definition, used to skip unchanged tables"""
+    return hashlib.sha256(sql_statement.encode("utf-8")).hexdigest()
+
 
-    # Extract the table name from the CREATE TABLE statement
+def table_name_from_sql(sql_statement):
+    """Extract the table name from a CREATE TABLE statement"""
     table_match = re.search(
         r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?["\'`]?([a-zA-Z0-9_]+)["\'`]?',
         sql_statement,
@@ -76,16 +78,23 @@ def create_temp_db_from_sql(sql_statement):
     if not table_match:
         raise ValueError("Invalid CREATE TABLE statement")
 
-    table_name = table_match.group(1)
+    return table_match.group(1)
 
-    # Create a connection and execute the CREATE TABLE statement
-    conn = sqlite3.connect(path)
-    cursor = conn.cursor()
-    cursor.execute(sql_statement)
-    conn.commit()
-    conn.close()
 
-    return get_table_info(path, table_name)
+def create_temp_db_from_sql(sql_statement):
+    """
+    Create an in-memory SQLite database from a CREATE TABLE statement
+    (optionally followed by CREATE INDEX statements) and return its table info
+    """
+    table_name = table_name_from_sql(sql_statement)
+
+    # Create a connection and execute the CREATE TABLE statement
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.executescript(sql_statement)
+        return get_table_info(conn, table_name)
+    finally:
+        conn.close()
 
 
 def extract_check_constraints(create_stmt):
@@ -386,23 +395,17 @@ def main():
         return
 
     try:
-        # Create temporary databases with the provided schemas
-        db1_path, table1_name = create_temp_db_from_sql(sql1)
-        db2_path, table2_name = create_temp_db_from_sql(sql2)
-
-        # Get table information using PRAGMA
-        table1_info = get_table_info(db1_path, table1_name)
-        table2_info = get_table_info(db2_path, table2_name)
+        # Load both schemas into in-memory databases and read them back via PRAGMA
+        table1_name = table_name_from_sql(sql1)
+        table2_name = table_name_from_sql(sql2)
+        table1_info = create_temp_db_from_sql(sql1)
+        table2_info = create_temp_db_from_sql(sql2)
 
         # Generate ALTER statements
         alter_statements = generate_alter_statements(
             table1_info, table2_info, table1_name, table2_name
         )
 
-        # Clean up temporary databases
-        os.unlink(db1_path)
-        os.unlink(db2_path)
-
         # Output the statements
         if args.output:
             with open(args.output, "w") as f:
@@ -416,11 +419,6 @@ def main():
 
     except Exception as e:
         print(f"Error: {e}")
-        # Clean up temporary files in case of error
-        if "db1_path" in locals():
-            os.unlink(db1_path)
-        if "db2_path" in locals():
-            os.unlink(db2_path)
 
 
 if __name__ == "__main__":
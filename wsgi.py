@@ -0,0 +1,9 @@
+"""WSGI entry point: `gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:4444 wsgi:app`
+
+Configure with DASTATS_SQLITEDB and DASTATS_RESPONSE_CACHE; run `ingest.py`
+as a separate process to keep the database up to date.
+"""
+
+from app import create_app
+
+app = create_app()